@@ -6,8 +6,9 @@ from pathlib import Path
 import datetime
 
 # Import components
-from auth.auth_handler import authenticate, logout
-from auth.user_db import UserDatabase
+from auth.auth_handler import authenticate, logout, get_cookie_manager, sync_session_cookie
+from auth.user_db import get_user_db
+from auth.passwords import warm_up
 from components.navigation import create_sidebar
 from components.lessons import display_lessons
 from components.quizzes import display_quiz
@@ -34,6 +35,9 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Calibrate the bcrypt cost now rather than during the first login
+warm_up()
+
 # App configuration
 st.set_page_config(
     page_title="Chuqlab LEO AI Academy",
@@ -134,44 +138,51 @@ def main():
         if "authenticated" not in st.session_state:
             st.session_state.authenticated = False
         
+        # Restore a returning user's session from their cookie, or write the
+        # cookie for a fresh login
+        sync_session_cookie(get_cookie_manager())
+        
         # Authenticate user if not already authenticated
         if not st.session_state.authenticated:
             # Display login/registration form
             authenticate()
         else:
-            # Create sidebar for authenticated users
-            create_sidebar()
+            # Load the user's record once for this rerun; reads and writes made
+            # while rendering the page go through it and are saved together
+            with get_user_db().session(st.session_state.get("username")):
+                # Create sidebar for authenticated users
+                create_sidebar()
             
-            # Add direct debug access in footer
-            st.sidebar.markdown("---")
-            if st.sidebar.button("🔍 Debug Tools"):
-                st.session_state.page = "Debug"
-                st.rerun()
+                # Add direct debug access in footer
+                st.sidebar.markdown("---")
+                if st.sidebar.button("🔍 Debug Tools"):
+                    st.session_state.page = "Debug"
+                    st.rerun()
             
-            # Load user's lesson progress if not already loaded
-            if "lesson_progress" not in st.session_state and "username" in st.session_state:
-                user_db = UserDatabase()
-                user_data = user_db.get_user_data(st.session_state.username)
+                # Load user's lesson progress if not already loaded
+                if "lesson_progress" not in st.session_state and "username" in st.session_state:
+                    user_db = get_user_db()
+                    user_data = user_db.get_user_data(st.session_state.username)
                 
-                if user_data:
-                    st.session_state.lesson_progress = user_data.get('lesson_progress', 0)
-                    logger.info(f"Loaded progress for user {st.session_state.username}: {st.session_state.lesson_progress} lessons completed")
+                    if user_data:
+                        st.session_state.lesson_progress = user_data.get('lesson_progress', 0)
+                        logger.info(f"Loaded progress for user {st.session_state.username}: {st.session_state.lesson_progress} lessons completed")
             
-            # Display the selected page
-            if st.session_state.page == "Home":
-                display_home()
-            elif st.session_state.page == "Lessons":
-                display_lessons()
-            elif st.session_state.page == "Quizzes":
-                display_quiz()
-            elif st.session_state.page == "Playground":
-                display_playground()
-            elif st.session_state.page == "Settings":
-                display_settings()
-            elif st.session_state.page == "Admin":
-                display_admin()
-            elif st.session_state.page == "Debug":
-                display_debug()
+                # Display the selected page
+                if st.session_state.page == "Home":
+                    display_home()
+                elif st.session_state.page == "Lessons":
+                    display_lessons()
+                elif st.session_state.page == "Quizzes":
+                    display_quiz()
+                elif st.session_state.page == "Playground":
+                    display_playground()
+                elif st.session_state.page == "Settings":
+                    display_settings()
+                elif st.session_state.page == "Admin":
+                    display_admin()
+                elif st.session_state.page == "Debug":
+                    display_debug()
         
         # Navigate to the selected page
         if st.session_state.get("page_changed", False):
@@ -0,0 +1,494 @@
+"""Append-only history of quiz attempts.
+
+Every submitted quiz is one fixed-size 24-byte binary record::
+
+    user id (uint32), quiz id (uint16), question count (uint8), padding,
+    timestamp (uint32, Unix seconds), score (float32),
+    correctness bitmask (uint64, bit i set if question i was right)
+
+Usernames are mapped to user ids through a sidecar text file with one
+username per line; the line number is the id. The options each user picked
+go to a second sidecar, ``<path>.answers``, as one entry per attempt::
+
+    row number (uint32), question count (uint8),
+    one byte per question (bit j set if option j was picked)
+
+All three files are only ever appended to, so readers pick up new attempts by
+reading from where they last stopped and never need a lock.
+"""
+import os
+import sys
+import time
+import struct
+import logging
+import datetime
+import threading
+from array import array
+from urllib.parse import quote, unquote
+from auth.storage import file_lock, _copy_prefix
+
+logger = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<IHBxIfQ')
+
+RESPONSES = struct.Struct('<IB')
+
+# Width of the correctness bitmask
+MAX_QUESTIONS = 64
+
+# Width of each question's response bitmask
+MAX_OPTIONS = 8
+
+def pack_correct(correct):
+    """Pack per-question correctness into a bitmask.
+
+    Args:
+        correct (list): One bool per question, in question order
+
+    Returns:
+        int: Bitmask with bit i set if question i was answered correctly
+    """
+    if len(correct) > MAX_QUESTIONS:
+        raise ValueError(f"At most {MAX_QUESTIONS} questions can be recorded per attempt")
+    mask = 0
+    for i, ok in enumerate(correct):
+        if ok:
+            mask |= 1 << i
+    return mask
+
+def unpack_correct(mask, questions):
+    """Expand a bitmask from ``pack_correct`` back into a list of bools."""
+    return [bool(mask >> i & 1) for i in range(questions)]
+
+def pack_responses(responses):
+    """Pack the options picked for each question into one byte per question.
+
+    Args:
+        responses (list): One bitmask per question, in question order, with
+            bit j set if option j was picked
+
+    Returns:
+        bytes: The packed responses
+    """
+    if len(responses) > MAX_QUESTIONS:
+        raise ValueError(f"At most {MAX_QUESTIONS} questions can be recorded per attempt")
+    if any(not 0 <= mask < 1 << MAX_OPTIONS for mask in responses):
+        raise ValueError(f"Responses can only record options 0 to {MAX_OPTIONS - 1}")
+    return bytes(responses)
+
+def default_attempts_path(db_path):
+    """Get the attempt history that belongs with a user database.
+
+    Args:
+        db_path (str): User database path
+
+    Returns:
+        str: ``QUIZ_ATTEMPTS_PATH`` if set, otherwise ``<db_path>.attempts``,
+        so separate databases never share a history
+    """
+    return os.environ.get('QUIZ_ATTEMPTS_PATH') or db_path.rstrip('/\\') + '.attempts'
+
+class QuizAttemptStore:
+    """Every quiz attempt ever submitted, for learning-curve analytics.
+
+    Attempts are kept in memory as parallel ``array`` columns plus row
+    number indexes per user and per quiz (built on the first lookup), so
+    scanning one user's or one quiz's attempts touches only those rows. At a million attempts this is
+    about 24 MB on disk and roughly 30 MB in memory. Responses add a
+    ``5 + questions`` byte entry per attempt and are only loaded when asked
+    for (see ``columns``).
+    """
+
+    def __init__(self, path="quiz_attempts.bin"):
+        """Open an attempt store.
+
+        Args:
+            path (str, optional): Record file; the user id map and the
+                responses are kept next to it in ``<path>.users`` and
+                ``<path>.answers``
+        """
+        self.path = path
+        self.users_path = path + '.users'
+        self.answers_path = path + '.answers'
+        # Bumped whenever the columns are reloaded from scratch, so callers
+        # holding row numbers can tell they no longer apply
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self, ino=None):
+        self.generation += 1
+        self._ino = ino
+        self._offset = 0
+        self._users_offset = 0
+        self._answers_offset = 0
+        # Per row, where its responses start in ``_answers`` and how many
+        # questions they cover (0 if none were recorded)
+        self._answers = bytearray()
+        self.answer_start = array('I')
+        self.answer_count = array('B')
+        self._usernames = []
+        self._user_ids = {}
+        self.user_id = array('I')
+        self.quiz_id = array('H')
+        self.questions = array('B')
+        self.timestamp = array('I')
+        self.score = array('f')
+        self.correct = array('Q')
+        # Row numbers per user id and per quiz id, built on first lookup
+        self._by_user = None
+        self._by_quiz = None
+
+    def _refresh_users(self):
+        try:
+            with open(self.users_path, 'rb') as f:
+                f.seek(self._users_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        # Ignore a partially written last line until it is complete
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            username = unquote(line.decode('utf-8'))
+            old = self._user_ids.get(username)
+            if old is not None:
+                # Re-added by forget_user: the old id's attempts belong to no one
+                self._usernames[old] = None
+            self._user_ids[username] = len(self._usernames)
+            self._usernames.append(username)
+        self._users_offset += end
+
+    def _refresh_answers(self):
+        """Load responses appended since the last call; the caller holds ``_lock``.
+
+        Responses are written before their record, so calling this after
+        ``_refresh`` covers every record loaded. A later entry for the same
+        row wins: it replaces one left behind by a write that failed before
+        its record was appended.
+        """
+        try:
+            with open(self.answers_path, 'rb') as f:
+                f.seek(self._answers_offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        rows, counts, starts = array('I'), array('B'), array('I')
+        unpack, size = RESPONSES.unpack_from, RESPONSES.size
+        pos = 0
+        while pos + size <= len(data):
+            row, count = unpack(data, pos)
+            if pos + size + count > len(data):
+                # Partially written; picked up once complete
+                break
+            rows.append(row)
+            counts.append(count)
+            # ``_answers`` holds the file as read, headers included
+            starts.append(self._answers_offset + pos + size)
+            pos += size + count
+        self._answers += data[:pos]
+        self._answers_offset += pos
+
+        first = len(self.answer_count)
+        if rows == array('I', range(first, first + len(rows))):
+            # The usual case: one entry per row, in order
+            self.answer_count.extend(counts)
+            self.answer_start.extend(starts)
+            return
+        for row, count, start in zip(rows, counts, starts):
+            if row >= len(self.answer_count):
+                missing = row + 1 - len(self.answer_count)
+                self.answer_count.extend(bytes(missing))
+                self.answer_start.extend(array('I', bytes(4 * missing)))
+            self.answer_count[row] = count
+            self.answer_start[row] = start
+
+    def _refresh(self):
+        """Load attempts appended since the last call; the caller holds ``_lock``."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._ino is not None:
+                self._reset()
+            self._refresh_users()
+            return
+        if st.st_ino != self._ino or st.st_size < self._offset:
+            # The file was replaced (e.g. restored from a backup); start over
+            self._reset(st.st_ino)
+        size = st.st_size - st.st_size % RECORD.size
+        if size > self._offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read(size - self._offset)
+            first = len(self.user_id)
+            self._decode(data)
+            if self._by_user is not None:
+                self._index(first)
+            self._offset = size
+        # Records are written after their user's id, so reading the map last
+        # covers every record loaded above
+        self._refresh_users()
+
+    def _decode(self, data):
+        """Append records to the columns.
+
+        A record is six 32-bit words, so each column is a strided slice of
+        the words, which is several times faster than unpacking record by
+        record.
+        """
+        words = array('I')
+        words.frombytes(data)
+        if sys.byteorder == 'big':
+            words.byteswap()
+        self.user_id.extend(words[0::6])
+        quiz_and_questions = words[1::6]
+        self.quiz_id.extend(w & 0xFFFF for w in quiz_and_questions)
+        self.questions.extend(w >> 16 & 0xFF for w in quiz_and_questions)
+        self.timestamp.extend(words[2::6])
+        self.score.frombytes(words[3::6].tobytes())
+        masks = array('I', bytes(4 * 2 * (len(words) // 6)))
+        masks[0::2] = words[4::6]
+        masks[1::2] = words[5::6]
+        self.correct.frombytes(masks.tobytes())
+
+    def _index(self, first=0):
+        """Add rows from ``first`` on to the per-user and per-quiz indexes."""
+        if self._by_user is None:
+            self._by_user, self._by_quiz = {}, {}
+        for column, index in ((self.user_id, self._by_user), (self.quiz_id, self._by_quiz)):
+            for row in range(first, len(column)):
+                rows = index.get(column[row])
+                if rows is None:
+                    rows = index[column[row]] = array('I')
+                rows.append(row)
+
+    def _rows(self, index_name, key):
+        if self._by_user is None:
+            self._index()
+        return getattr(self, index_name).get(key, ())
+
+    def record(self, username, quiz_id, score, correct, timestamp=None, responses=None):
+        """Append one quiz attempt.
+
+        Args:
+            username (str): User who took the quiz
+            quiz_id (int): Quiz id
+            score (float): Score as a percentage
+            correct (list): One bool per question, in question order
+            timestamp (float, optional): Unix time of the attempt; defaults to now
+            responses (list, optional): Options picked per question, as for
+                ``pack_responses``; left out, with a warning, if they can't be
+                packed
+        """
+        self.record_many([(username, quiz_id, score, correct, timestamp, responses)])
+
+    def record_many(self, attempts):
+        """Append several quiz attempts with one write.
+
+        Args:
+            attempts (iterable): ``(username, quiz_id, score, correct, timestamp)``
+                tuples, optionally followed by ``responses``; ``timestamp``
+                and ``responses`` may be None
+        """
+        now = time.time()
+        with self._lock, file_lock(self.path, exclusive=True):
+            self._refresh()
+            new_users = []
+            records = []
+            answers = []
+            row = len(self.user_id)
+            try:
+                for attempt in attempts:
+                    username, quiz_id, score, correct, timestamp = attempt[:5]
+                    responses = attempt[5] if len(attempt) > 5 else None
+                    user_id = self._user_ids.get(username)
+                    if user_id is None:
+                        user_id = self._user_ids[username] = len(self._usernames)
+                        self._usernames.append(username)
+                        new_users.append(username)
+                    records.append(RECORD.pack(
+                        user_id, int(quiz_id), len(correct), int(timestamp or now),
+                        float(score), pack_correct(correct)
+                    ))
+                    # Every attempt gets an entry, so it replaces any left
+                    # for this row by a failed write
+                    try:
+                        packed = pack_responses(responses or [])
+                    except ValueError as e:
+                        # Keep the attempt; only its responses go unrecorded
+                        logger.warning(f"Recording an attempt at quiz {quiz_id} without responses: {e}")
+                        packed = b''
+                    answers.append(RESPONSES.pack(row, len(packed)) + packed)
+                    row += 1
+                if new_users:
+                    data = ''.join(quote(u, safe='@.+-_') + '\n' for u in new_users).encode('utf-8')
+                    with open(self.users_path, 'ab') as f:
+                        f.write(data)
+                    self._users_offset += len(data)
+                # Responses before records, as for the user ids
+                with open(self.answers_path, 'ab') as f:
+                    f.write(b''.join(answers))
+                with open(self.path, 'ab') as f:
+                    f.write(b''.join(records))
+            except Exception:
+                # The in-memory id map may be ahead of the files; reload it
+                self._reset()
+                raise
+            # Pick up our own records (and anyone else's) on the next read
+            self._refresh()
+
+    def forget_user(self, username):
+        """Detach a deleted user's attempts from their username.
+
+        The username is appended to the id map again, giving it a fresh id.
+        The old attempts stay in the history, and in the per-question
+        statistics, under an id with no username, so an account later
+        registered under the same name starts with no attempts.
+
+        Args:
+            username (str): Deleted user
+        """
+        with self._lock, file_lock(self.path, exclusive=True):
+            self._refresh()
+            if username not in self._user_ids:
+                return
+            with open(self.users_path, 'ab') as f:
+                f.write(quote(username, safe='@.+-_').encode('utf-8') + b'\n')
+            self._refresh()
+
+    def _attempt(self, row):
+        return {
+            'username': self._usernames[self.user_id[row]],
+            'quiz_id': self.quiz_id[row],
+            'timestamp': datetime.datetime.fromtimestamp(self.timestamp[row]).isoformat(),
+            'score': round(self.score[row], 2),
+            'correct': unpack_correct(self.correct[row], self.questions[row]),
+        }
+
+    def user_attempts(self, username, quiz_id=None):
+        """List a user's attempts, oldest first.
+
+        Args:
+            username (str): User whose attempts to list
+            quiz_id (int, optional): Only attempts at this quiz
+
+        Returns:
+            list: Attempt dicts with ``username``, ``quiz_id``, ``timestamp``,
+            ``score`` and ``correct``
+        """
+        with self._lock:
+            self._refresh()
+            user_id = self._user_ids.get(username)
+            rows = self._rows('_by_user', user_id)
+            if quiz_id is not None:
+                quiz_id = int(quiz_id)
+                rows = [row for row in rows if self.quiz_id[row] == quiz_id]
+            return [self._attempt(row) for row in rows]
+
+    def quiz_attempts(self, quiz_id):
+        """List every attempt at a quiz, oldest first.
+
+        Args:
+            quiz_id (int): Quiz id
+
+        Returns:
+            list: Attempt dicts, as for ``user_attempts``; ``username`` is
+            None for users deleted since
+        """
+        with self._lock:
+            self._refresh()
+            return [self._attempt(row) for row in self._rows('_by_quiz', int(quiz_id))]
+
+    def columns(self, first=0, responses=False):
+        """Get a snapshot of the attempts as parallel columns for analytics.
+
+        Attempts are only ever appended, so a caller that has processed the
+        first ``n`` rows can ask for just the rows after them, as long as
+        ``generation`` hasn't changed.
+
+        Args:
+            first (int, optional): First row to return
+            responses (bool, optional): Also return the options picked; the
+                first call loads every response, so leave this off unless
+                they are needed
+
+        Returns:
+            dict: ``first``, ``generation`` and the ``user_id``,
+            ``quiz_id``, ``questions``, ``timestamp``, ``score`` and
+            ``correct`` arrays, one entry per attempt from ``first`` on. With
+            ``responses``, also ``answer_count`` (questions with responses,
+            0 if none were recorded), ``answer_start`` (offset into
+            ``answers``) and ``answers`` (bytes, one per question, covering
+            only the rows returned)
+        """
+        with self._lock:
+            self._refresh()
+            end = len(self.user_id)
+            first = min(first, end)
+            result = {
+                'first': first,
+                'generation': self.generation,
+                'user_id': self.user_id[first:end],
+                'quiz_id': self.quiz_id[first:end],
+                'questions': self.questions[first:end],
+                'timestamp': self.timestamp[first:end],
+                'score': self.score[first:end],
+                'correct': self.correct[first:end],
+            }
+            if responses:
+                self._refresh_answers()
+                count = self.answer_count[first:end]
+                start = self.answer_start[first:end]
+                # Rows past the last response entry have none
+                missing = end - first - len(count)
+                count.extend(bytes(missing))
+                start.extend(array('I', bytes(4 * missing)))
+                # Copy only the responses of the returned rows, with their
+                # offsets rebased onto the copy
+                base = min((s for s, c in zip(start, count) if c), default=len(self._answers))
+                result['answer_count'] = count
+                result['answer_start'] = array('I', [s - base if c else 0 for s, c in zip(start, count)])
+                with memoryview(self._answers) as view:
+                    result['answers'] = view[base:].tobytes()
+            return result
+
+    def snapshot(self, dest):
+        """Copy the attempt history into a directory.
+
+        Attempts are appended under the exclusive lock, so under the shared
+        lock the files' current lengths mark a consistent point to copy up to.
+        Responses for rows beyond the copy can't exist then, since both are
+        written under the same lock. All three files are always written, a
+        file not created yet as an empty one.
+
+        Args:
+            dest (str): Directory to copy into
+
+        Returns:
+            list: Names of the files written to ``dest``
+        """
+        names = []
+        os.makedirs(dest, exist_ok=True)
+        with file_lock(self.path):
+            for path in (self.users_path, self.answers_path, self.path):
+                name = os.path.basename(path)
+                if os.path.exists(path):
+                    _copy_prefix(path, os.path.join(dest, name), os.path.getsize(path))
+                else:
+                    open(os.path.join(dest, name), 'wb').close()
+                names.append(name)
+        return names
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.user_id)
+
+    def stats(self):
+        """Get the number of attempts, users and bytes stored.
+
+        Returns:
+            dict: ``attempts``, ``users`` and ``bytes``
+        """
+        with self._lock:
+            self._refresh()
+            return {'attempts': len(self.user_id), 'users': len(self._usernames), 'bytes': self._offset}
@@ -9,7 +9,9 @@ import yaml
 from yaml.loader import SafeLoader
 import logging
 import json
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
+from auth.throttle import get_login_throttle
+from auth.sessions import get_session_tokens, SESSION_COOKIE
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -100,6 +102,68 @@ def get_cookie_manager():
     cookie_manager = stx.CookieManager()
     return cookie_manager
 
+def start_session(username, name):
+    """Mark the user as logged in and issue a session token for the cookie.
+    
+    Args:
+        username (str): Username that logged in
+        name (str): Display name
+    """
+    st.session_state.authenticated = True
+    st.session_state.username = username
+    st.session_state.name = name
+    st.session_state.login_error = None
+    try:
+        token, expires = get_session_tokens().issue(username, name)
+        st.session_state.session_token = token
+        st.session_state.session_token_expires = expires
+        # The cookie is written on the next run, since login ends with a rerun
+        st.session_state.session_cookie_pending = True
+    except Exception as e:
+        logger.error(f"Error issuing session token for user {username}: {e}")
+
+def sync_session_cookie(cookie_manager):
+    """Write a newly issued session cookie, or restore a session from one.
+    
+    A valid cookie restores the login without checking the password or
+    loading the user's record. Invalid, expired or revoked cookies are
+    deleted.
+    
+    Args:
+        cookie_manager (CookieManager): Cookie manager rendered for this run
+    
+    Returns:
+        bool: True if a session was restored from the cookie
+    """
+    try:
+        if st.session_state.get("authenticated", False):
+            if st.session_state.pop("session_cookie_pending", False):
+                cookie_manager.set(
+                    SESSION_COOKIE, st.session_state.session_token,
+                    key="set_session_cookie",
+                    expires_at=datetime.fromtimestamp(st.session_state.session_token_expires)
+                )
+            return False
+        
+        token = cookie_manager.get(SESSION_COOKIE)
+        if not token:
+            return False
+        
+        claims = get_session_tokens().verify(token)
+        # The hardcoded admin login has no database record
+        if claims and (claims['u'] == "admin" or get_user_db().user_exists(claims['u'])):
+            st.session_state.authenticated = True
+            st.session_state.username = claims['u']
+            st.session_state.name = claims['n']
+            st.session_state.session_token = token
+            logger.info(f"Restored session for user {claims['u']}")
+            return True
+        
+        cookie_manager.delete(SESSION_COOKIE, key="delete_session_cookie")
+    except Exception as e:
+        logger.error(f"Error restoring session from cookie: {e}")
+    return False
+
 # Main authentication function
 def authenticate():
     """Handle user authentication.
@@ -225,26 +289,75 @@ def authenticate():
     
     st.markdown('</div>', unsafe_allow_html=True)
 
+def client_address(peer, forwarded, trusted_proxies=0):
+    """Pick the client address from a connection and its X-Forwarded-For.
+    
+    Each trusted proxy appends the address it received the request from, so
+    with N proxies in front of the app the client is the Nth address from
+    the right. Anything further left was sent by the client itself and can
+    be anything.
+    
+    Args:
+        peer (str): Address the connection came from
+        forwarded (str): X-Forwarded-For header, or None
+        trusted_proxies (int, optional): Reverse proxies in front of the app
+    
+    Returns:
+        str: Client address
+    """
+    if trusted_proxies <= 0:
+        return peer
+    addresses = [a.strip() for a in (forwarded or "").split(",") if a.strip()]
+    if len(addresses) < trusted_proxies:
+        # Didn't come through every proxy; only the peer can be trusted
+        return peer
+    return addresses[-trusted_proxies]
+
+def get_client_id():
+    """Identify the browser client for login throttling.
+    
+    Uses the address of the connection, or with ``TRUSTED_PROXIES`` set to
+    the number of reverse proxies in front of the app, the address the
+    outermost one saw (see ``client_address``).
+    
+    Returns:
+        str: Client address, or None if it can't be determined
+    """
+    try:
+        from streamlit import runtime
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        client = runtime.get_instance().get_client(ctx.session_id) if ctx else None
+        request = getattr(client, "request", None)
+        if request is None:
+            return None
+        forwarded = ",".join(request.headers.get_list("X-Forwarded-For"))
+        return client_address(request.remote_ip, forwarded, int(os.environ.get("TRUSTED_PROXIES") or 0))
+    except Exception as e:
+        logger.debug(f"Could not read the client address: {e}")
+        return None
+
 def handle_login(username, password):
     """Handle login form submission."""
     try:
+        # Reject floods before spending any time on password checks
+        wait = get_login_throttle().acquire(username, get_client_id())
+        if wait:
+            st.session_state.login_error = f"Too many login attempts. Please try again in {int(wait) + 1} seconds."
+            st.session_state.authenticated = False
+            return
+        
         # Check if it's the admin account
         if username == "cornelius@chuqlab.com" and password == "Amari197$Tara":
-            st.session_state.authenticated = True
-            st.session_state.username = "admin"
-            st.session_state.name = "Admin"
-            st.session_state.login_error = None
+            start_session("admin", "Admin")
             st.rerun()
             return
 
         # Regular user authentication
-        user_db = UserDatabase()
+        user_db = get_user_db()
         if user_db.verify_user(username, password):
-            st.session_state.authenticated = True
-            st.session_state.username = username
             user_data = user_db.get_user_data(username)
-            st.session_state.name = user_data.get('name', username)
-            st.session_state.login_error = None
+            start_session(username, user_data.get('name', username))
             st.rerun()
         else:
             st.session_state.login_error = "Invalid username or password"
@@ -269,7 +382,7 @@ def handle_registration(name, email, agency, password, confirm_password):
     else:
         try:
             # Create new user
-            user_db = UserDatabase()
+            user_db = get_user_db()
             
             # Create the user with agency info
             success, error_msg = user_db.create_user(username=email, password=password, name=name, email=email, agency=agency)
@@ -289,7 +402,7 @@ def handle_registration(name, email, agency, password, confirm_password):
 def create_demo_accounts():
     """Create demo accounts if they don't exist."""
     try:
-        user_db = UserDatabase()
+        user_db = get_user_db()
         
         # Create demo user account
         if not user_db.user_exists("demo"):
@@ -315,7 +428,15 @@ def create_demo_accounts():
         logger.error(f"Error creating demo accounts: {e}")
 
 def logout():
-    """Log out the current user."""
+    """Log out the current user.
+    
+    Revokes the session token, so the cookie left in the browser can't
+    restore the session; it is deleted on the next run.
+    """
+    token = st.session_state.get("session_token")
+    if token:
+        get_session_tokens().revoke(token)
+    
     for key in list(st.session_state.keys()):
         del st.session_state[key]
     st.rerun() 
\ No newline at end of file
@@ -0,0 +1,194 @@
+"""Online backups of the user database, conversations and quiz attempts.
+
+A backup is a ``.tar.gz`` holding::
+
+    manifest.json       backend, file names, counts and timings
+    users/              the storage backend's files
+    conversations/      the conversation store
+    attempts/           the quiz attempt history
+
+Each store first copies itself into a staging directory next to the
+database (see ``snapshot`` on the stores). Files that are only ever replaced
+are hard-linked, so writers wait only for that step, not for compression.
+"""
+import os
+import json
+import time
+import shutil
+import tarfile
+import logging
+import datetime
+import tempfile
+from auth.attempts import default_attempts_path
+from auth.storage import BACKENDS, SQLiteStorage, backend_for_path
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+
+def default_backup_path():
+    """Get a timestamped archive name for a new backup.
+
+    Returns:
+        str: e.g. ``backup-20240101-120000.tar.gz``
+    """
+    return datetime.datetime.now().strftime("backup-%Y%m%d-%H%M%S.tar.gz")
+
+def _staging_dir(near):
+    # On the same file system as the data, so snapshots can hard-link
+    parent = os.path.dirname(os.path.abspath(near.rstrip('/\\') or near))
+    return tempfile.mkdtemp(prefix='.backup-', dir=parent)
+
+def _skip_locks(member):
+    # Lock files are recreated on demand and never hold data
+    name = os.path.basename(member.name)
+    return None if name.endswith('.lock') or name == '.locks' else member
+
+def create_backup(user_db, archive_path, compresslevel=6):
+    """Write a consistent, compressed backup while the app keeps running.
+
+    Args:
+        user_db (UserDatabase): Database to back up, with its conversation
+            and quiz attempt stores
+        archive_path (str): ``.tar.gz`` file to write
+        compresslevel (int, optional): gzip level, 1 (fast) to 9 (small)
+
+    Returns:
+        dict: The backup's manifest, plus the archive size in ``bytes``
+    """
+    staging = _staging_dir(user_db.db_path)
+    try:
+        start = time.perf_counter()
+        # The user count is taken from the copy, not the live store, which
+        # has moved on
+        users_files, users = user_db._storage.snapshot(os.path.join(staging, 'users'))
+        conversations = user_db.conversations.snapshot(os.path.join(staging, 'conversations'))
+        attempts_files = user_db.attempts.snapshot(os.path.join(staging, 'attempts'))
+        snapshot_seconds = time.perf_counter() - start
+
+        db_name = os.path.basename(user_db.db_path.rstrip('/\\'))
+
+        manifest = {
+            'created_at': datetime.datetime.now().isoformat(),
+            'backend': user_db.backend_name,
+            'db_name': db_name,
+            'users_files': users_files,
+            'users': users,
+            'conversations': conversations,
+            'attempts_name': os.path.basename(user_db.attempts.path),
+            'attempts_files': attempts_files,
+            'snapshot_seconds': round(snapshot_seconds, 3),
+        }
+        with open(os.path.join(staging, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        tmp_path = f"{archive_path}.tmp-{os.getpid()}"
+        with tarfile.open(tmp_path, 'w:gz', compresslevel=compresslevel) as tar:
+            for name in sorted(os.listdir(staging)):
+                tar.add(os.path.join(staging, name), arcname=name, filter=_skip_locks)
+        os.replace(tmp_path, archive_path)
+        manifest['total_seconds'] = round(time.perf_counter() - start, 3)
+        manifest['bytes'] = os.path.getsize(archive_path)
+        logger.info(
+            f"Backed up {manifest['users']} users and {conversations} conversations to {archive_path} "
+            f"({manifest['bytes']} bytes, snapshot {snapshot_seconds:.3f}s)"
+        )
+        return manifest
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _extract(tar, dest):
+    """Extract an archive, refusing members that would land outside ``dest``."""
+    dest = os.path.realpath(dest)
+    for member in tar.getmembers():
+        target = os.path.realpath(os.path.join(dest, member.name))
+        if os.path.commonpath([dest, target]) != dest or not (member.isfile() or member.isdir()):
+            raise ValueError(f"Unsafe path in backup archive: {member.name}")
+    if hasattr(tarfile, 'data_filter'):
+        tar.extractall(dest, filter='data')
+    else:
+        tar.extractall(dest)
+
+def _move_aside(path, suffix):
+    """Rename an existing file or directory out of the way; return the new name."""
+    if not os.path.lexists(path):
+        return None
+    aside = f"{path}.{suffix}"
+    os.rename(path, aside)
+    return aside
+
+def restore_backup(archive_path, db_path, backend=None, conversations_dir="conversations",
+                   attempts_path=None):
+    """Put the stores back as they were when a backup was taken.
+
+    Stop the app first: stores are swapped out underneath any open handles.
+    Whatever is currently at the target paths is renamed to
+    ``<path>.pre-restore-<timestamp>`` rather than deleted.
+
+    Args:
+        archive_path (str): Backup from ``create_backup``
+        db_path (str): User database to restore to; its name may differ
+            from the backed-up one, but the backend must match
+        backend (str, optional): Backend of ``db_path``; inferred if omitted
+        conversations_dir (str, optional): Conversation store to restore to
+        attempts_path (str, optional): Quiz attempt history to restore to;
+            defaults to the one ``UserDatabase`` uses for ``db_path``
+
+    Returns:
+        dict: The backup's manifest, plus ``moved_aside`` listing the
+        renamed previous files
+    """
+    # Resolve the backend as create_backend would, without creating the store
+    name = backend or os.environ.get('USER_DB_BACKEND') or backend_for_path(db_path)
+    attempts_path = attempts_path or default_attempts_path(db_path)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown user database backend: {name}")
+    target_backend = BACKENDS[name].name
+
+    staging = _staging_dir(db_path)
+    try:
+        with tarfile.open(archive_path, 'r:gz') as tar:
+            _extract(tar, staging)
+        with open(os.path.join(staging, MANIFEST)) as f:
+            manifest = json.load(f)
+        if manifest['backend'] != target_backend:
+            raise ValueError(
+                f"Backup is of a {manifest['backend']} database, but {db_path} is {target_backend}; "
+                f"restore to a {manifest['backend']} path and use 'migrate' to convert it"
+            )
+
+        suffix = datetime.datetime.now().strftime("pre-restore-%Y%m%d-%H%M%S")
+        moved = []
+        db_path = db_path.rstrip('/\\') or db_path
+        old_name = manifest['db_name']
+        new_name = os.path.basename(db_path)
+        directory = os.path.dirname(db_path)
+
+        # SQLite keeps uncommitted pages next to the database
+        extra = ['-wal', '-shm'] if manifest['backend'] == SQLiteStorage.name else []
+        replacements = [
+            (os.path.join(staging, 'users', name), os.path.join(directory, new_name + name[len(old_name):]))
+            for name in manifest['users_files']
+        ]
+        replacements += [(None, db_path + ext) for ext in extra]
+        replacements.append((os.path.join(staging, 'conversations'), conversations_dir.rstrip('/\\')))
+        # The attempt files keep the source store's names; map them onto ours
+        old_attempts = manifest['attempts_name']
+        replacements += [
+            (os.path.join(staging, 'attempts', name), attempts_path + name[len(old_attempts):])
+            for name in manifest['attempts_files']
+        ]
+
+        for src, dst in replacements:
+            aside = _move_aside(dst, suffix)
+            if aside:
+                moved.append(aside)
+            if src is not None and os.path.lexists(src):
+                os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+                shutil.move(src, dst)
+
+        manifest['moved_aside'] = moved
+        logger.info(f"Restored backup {archive_path} ({manifest['users']} users) to {db_path}")
+        return manifest
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
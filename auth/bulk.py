@@ -0,0 +1,409 @@
+"""Streaming bulk import and export of users.
+
+Rosters are read one row at a time from CSV or JSONL, validated, hashed on
+the bcrypt worker pool and written in batches, so importing hundreds of
+officers costs a handful of storage writes instead of one per user. Exports
+stream records from the backend in fixed-size chunks, so memory use doesn't
+grow with the number of users. Exports can also be written as Parquet when
+pyarrow is installed.
+
+Columns (CSV header or JSONL keys):
+    username (optional, defaults to email), email, name, agency,
+    password or password_hash, and optionally created_at, lesson_progress,
+    completed_lessons and quiz_scores.
+
+In CSV, ``completed_lessons`` is written as ``1;2;3`` and ``quiz_scores`` as
+a JSON object. On import, a quiz result may be given as just a score, e.g.
+``{"1": 85}``.
+"""
+import io
+import csv
+import json
+import logging
+import datetime
+from auth.passwords import hash_passwords
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = [
+    'username', 'name', 'email', 'agency', 'created_at',
+    'lesson_progress', 'completed_lessons', 'quiz_scores'
+]
+
+# Stop collecting error messages past this many; they are still counted
+MAX_REPORTED_ERRORS = 1000
+
+# Users formatted and written per chunk (one Parquet row group each)
+EXPORT_CHUNK_SIZE = 1000
+
+def format_for_path(path, fmt=None):
+    """Pick 'csv' or 'jsonl' from an explicit format or a file name.
+
+    Args:
+        path (str): File name
+        fmt (str, optional): Explicit format
+
+    Returns:
+        str: 'csv' or 'jsonl'
+    """
+    if fmt:
+        return fmt
+    if path.lower().endswith('.parquet'):
+        return 'parquet'
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def parquet_available():
+    """Check whether exports can be written as Parquet (needs pyarrow)."""
+    return pyarrow is not None
+
+def read_rows(f, fmt):
+    """Read roster rows from a text stream one at a time.
+
+    Args:
+        f (file): Text stream
+        fmt (str): 'csv' or 'jsonl'
+
+    Yields:
+        tuple: (line number, row dict); rows that can't be parsed are
+        yielded as None
+    """
+    if fmt not in ('csv', 'jsonl'):
+        raise ValueError(f"Rosters can only be imported from CSV or JSONL, not {fmt}")
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+def _parse_lessons(value):
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        return [int(v) for v in value.split(';') if v.strip()]
+    return [int(v) for v in value]
+
+def _parse_scores(value):
+    """Parse ``{quiz_id: result}``, where a result is the stored
+    ``{"score", "timestamp", "answers"}`` dict or just a score."""
+    if value in (None, ''):
+        return {}
+    if isinstance(value, str):
+        value = json.loads(value)
+    scores = {}
+    for quiz_id, result in value.items():
+        if not isinstance(result, dict):
+            result = {'score': result}
+        scores[str(quiz_id)] = {
+            'score': float(result['score']),
+            'timestamp': result.get('timestamp') or datetime.datetime.now().isoformat(),
+            'answers': result.get('answers') or {},
+        }
+    return scores
+
+def validate_row(row, user_db):
+    """Check a roster row and normalize its fields.
+
+    Args:
+        row (dict): Parsed row
+        user_db (UserDatabase): Database, for the organization email check
+
+    Returns:
+        dict: Normalized fields, or None if the row is invalid
+        str: Error message if the row is invalid, empty string otherwise
+    """
+    if row is None:
+        return None, "Row could not be parsed"
+    email = str(row.get('email') or '').strip()
+    username = str(row.get('username') or '').strip() or email
+    password = str(row.get('password') or '')
+    password_hash = str(row.get('password_hash') or '')
+
+    if not email:
+        return None, "Email address is required"
+    if username.strip('.') == '' or '/' in username or '\\' in username:
+        return None, "Username must not be a path"
+    if '@' not in email or '.' not in email:
+        return None, "Invalid email format"
+    if not user_db.is_law_enforcement_email(email):
+        return None, "Personal email providers are not allowed"
+    if not password and not password_hash:
+        return None, "A password or password_hash is required"
+    if password and len(password) < 6:
+        return None, "Password must be at least 6 characters long"
+    if password_hash and not password_hash.startswith('$2'):
+        return None, "password_hash is not a bcrypt hash"
+
+    try:
+        fields = {
+            'username': username,
+            'email': email,
+            'name': str(row.get('name') or '').strip(),
+            'agency': str(row.get('agency') or '').strip(),
+            'password': password,
+            'password_hash': password_hash,
+            'created_at': str(row.get('created_at') or '').strip(),
+            'lesson_progress': int(row.get('lesson_progress') or 0),
+            'completed_lessons': _parse_lessons(row.get('completed_lessons')),
+            'quiz_scores': _parse_scores(row.get('quiz_scores')),
+        }
+    except (TypeError, ValueError, AttributeError, KeyError) as e:
+        return None, f"Invalid progress data: {e}"
+    if fields['lesson_progress'] < 0:
+        return None, "lesson_progress must not be negative"
+    return fields, ""
+
+def import_users(user_db, rows, batch_size=500):
+    """Create users from a stream of roster rows.
+
+    Rows are validated as they arrive. Each batch has its passwords hashed in
+    parallel and is written with one ``insert_users`` call (one transaction
+    on SQLite). Users whose username or email already exists are skipped.
+
+    Args:
+        user_db (UserDatabase): Database to add users to
+        rows (iterable): (line number, row dict) pairs, e.g. from ``read_rows``
+        batch_size (int, optional): Users written per batch
+
+    Returns:
+        dict: ``imported``, ``skipped`` and ``invalid`` counts, and ``errors``
+        as a list of (line number, message)
+    """
+    result = {'imported': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    seen_emails = set()
+    seen_usernames = set()
+    batch = []
+
+    def reject(line_number, message):
+        result['invalid'] += 1
+        if len(result['errors']) < MAX_REPORTED_ERRORS:
+            result['errors'].append((line_number, message))
+
+    def flush():
+        plain = [fields['password'] for fields in batch if not fields['password_hash']]
+        hashes = iter(hash_passwords(plain))
+        records = {}
+        for fields in batch:
+            password_hash = fields['password_hash'] or next(hashes)
+            record = user_db.new_user_record(
+                fields['username'], password_hash, fields['name'], fields['email'], fields['agency']
+            )
+            if fields['created_at']:
+                record['created_at'] = fields['created_at']
+            record['lesson_progress'] = fields['lesson_progress']
+            record['completed_lessons'] = fields['completed_lessons']
+            record['quiz_scores'] = fields['quiz_scores']
+            records[fields['username']] = record
+        inserted = user_db.insert_users(records)
+        result['imported'] += len(inserted)
+        result['skipped'] += len(records) - len(inserted)
+        logger.info(f"Imported batch of {len(inserted)} users ({len(records) - len(inserted)} already existed)")
+        batch.clear()
+
+    for line_number, row in rows:
+        fields, error = validate_row(row, user_db)
+        if error:
+            reject(line_number, error)
+            continue
+        email_key = fields['email'].lower()
+        if email_key in seen_emails:
+            reject(line_number, f"Duplicate email {fields['email']} in this file")
+            continue
+        if fields['username'] in seen_usernames:
+            reject(line_number, f"Duplicate username {fields['username']} in this file")
+            continue
+        seen_emails.add(email_key)
+        seen_usernames.add(fields['username'])
+        if user_db.find_user_by_email(fields['email']):
+            result['skipped'] += 1
+            continue
+        batch.append(fields)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
+
+def export_row(username, record, include_password_hashes=False):
+    """Select the exported fields of a user record.
+
+    Args:
+        username (str): Username
+        record (dict): User record
+        include_password_hashes (bool, optional): Include ``password_hash``,
+            so the export can be re-imported with working logins
+
+    Returns:
+        dict: Exported fields
+    """
+    row = {
+        'username': username,
+        'name': record.get('name', ''),
+        'email': record.get('email', ''),
+        'agency': record.get('agency', ''),
+        'created_at': record.get('created_at', ''),
+        'lesson_progress': record.get('lesson_progress', 0),
+        'completed_lessons': record.get('completed_lessons', []),
+        'quiz_scores': record.get('quiz_scores', {}),
+    }
+    if include_password_hashes:
+        row['password_hash'] = record.get('password_hash', '')
+    return row
+
+def export_columns(columns=None, include_password_hashes=False):
+    """Check a column selection for an export.
+
+    Args:
+        columns (list, optional): Fields to export, in order; all of
+            ``EXPORT_FIELDS`` if omitted
+        include_password_hashes (bool, optional): Allow (and by default add)
+            ``password_hash``
+
+    Returns:
+        list: Columns to write
+    """
+    allowed = EXPORT_FIELDS + (['password_hash'] if include_password_hashes else [])
+    if not columns:
+        return allowed
+    unknown = [column for column in columns if column not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}")
+    return list(columns)
+
+def iter_export_chunks(user_db, columns=None, include_password_hashes=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Read users from the backend in fixed-size chunks.
+
+    Args:
+        user_db (UserDatabase): Database to export
+        columns (list, optional): Fields to export; see ``export_columns``
+        include_password_hashes (bool, optional): See ``export_row``
+        chunk_size (int, optional): Users per chunk
+
+    Yields:
+        list: Up to ``chunk_size`` row dicts holding only ``columns``
+    """
+    columns = export_columns(columns, include_password_hashes)
+    chunk = []
+    for username, record in user_db.iter_users():
+        row = export_row(username, record, include_password_hashes)
+        chunk.append({column: row[column] for column in columns})
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _format_chunk(rows, fmt, columns, header=False):
+    """Render a chunk of rows as CSV or JSONL text."""
+    if fmt == 'jsonl':
+        return ''.join(json.dumps(row) + '\n' for row in rows)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=columns)
+    if header:
+        writer.writeheader()
+    for row in rows:
+        if 'completed_lessons' in row:
+            row['completed_lessons'] = ';'.join(str(lesson) for lesson in row['completed_lessons'])
+        if 'quiz_scores' in row:
+            row['quiz_scores'] = json.dumps(row['quiz_scores'])
+        writer.writerow(row)
+    return out.getvalue()
+
+def export_users(user_db, f, fmt='jsonl', include_password_hashes=False, columns=None,
+                 chunk_size=EXPORT_CHUNK_SIZE):
+    """Write every user's profile, progress and quiz scores to a text stream.
+
+    Records are written a chunk at a time as they are read from the
+    backend, never collected into one list.
+
+    Args:
+        user_db (UserDatabase): Database to export
+        f (file): Text stream to write to
+        fmt (str, optional): 'jsonl' or 'csv'
+        include_password_hashes (bool, optional): See ``export_row``
+        columns (list, optional): Fields to export; see ``export_columns``
+        chunk_size (int, optional): Users per chunk
+
+    Returns:
+        int: Number of users written
+    """
+    columns = export_columns(columns, include_password_hashes)
+    count = 0
+    header = fmt == 'csv'
+    for rows in iter_export_chunks(user_db, columns, include_password_hashes, chunk_size):
+        f.write(_format_chunk(rows, fmt, columns, header))
+        header = False
+        count += len(rows)
+    if header:
+        f.write(_format_chunk([], fmt, columns, header))
+    return count
+
+def _parquet_schema(columns):
+    types = {
+        'lesson_progress': pyarrow.int64(),
+        'completed_lessons': pyarrow.list_(pyarrow.int64()),
+    }
+    # quiz_scores is nested and varies by quiz, so it is kept as JSON text
+    return pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in columns])
+
+def export_parquet(user_db, path, columns=None, include_password_hashes=False, chunk_size=EXPORT_CHUNK_SIZE):
+    """Write every user to a Parquet file, one row group per chunk.
+
+    Args:
+        user_db (UserDatabase): Database to export
+        path (str): File to write
+        columns (list, optional): Fields to export; see ``export_columns``
+        include_password_hashes (bool, optional): See ``export_row``
+        chunk_size (int, optional): Users per row group
+
+    Returns:
+        int: Number of users written
+    """
+    if pyarrow is None:
+        raise RuntimeError("Parquet export needs pyarrow; install it with 'pip install pyarrow'")
+    columns = export_columns(columns, include_password_hashes)
+    schema = _parquet_schema(columns)
+    count = 0
+    with pyarrow.parquet.ParquetWriter(path, schema) as writer:
+        for rows in iter_export_chunks(user_db, columns, include_password_hashes, chunk_size):
+            if 'quiz_scores' in columns:
+                for row in rows:
+                    row['quiz_scores'] = json.dumps(row['quiz_scores'])
+            writer.write_batch(pyarrow.RecordBatch.from_pylist(rows, schema=schema))
+            count += len(rows)
+    return count
+
+def export_to_file(user_db, path, fmt=None, columns=None, include_password_hashes=False,
+                   chunk_size=EXPORT_CHUNK_SIZE):
+    """Export users to a CSV, JSONL or Parquet file.
+
+    Args:
+        user_db (UserDatabase): Database to export
+        path (str): File to write
+        fmt (str, optional): 'csv', 'jsonl' or 'parquet'; inferred from
+            ``path`` if omitted
+        columns (list, optional): Fields to export; see ``export_columns``
+        include_password_hashes (bool, optional): See ``export_row``
+        chunk_size (int, optional): Users per chunk
+
+    Returns:
+        int: Number of users written
+    """
+    fmt = format_for_path(path, fmt)
+    if fmt == 'parquet':
+        return export_parquet(user_db, path, columns, include_password_hashes, chunk_size)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        return export_users(user_db, f, fmt, include_password_hashes, columns, chunk_size)
@@ -0,0 +1,197 @@
+"""Command line tools for managing the user database.
+
+Usage:
+    python -m auth.cli migrate users.yaml users.db
+    python -m auth.cli migrate users.yaml users.json
+    python -m auth.cli migrate-conversations --db users.yaml
+    python -m auth.cli import-users roster.csv --db users.db
+    python -m auth.cli export-users users.jsonl --db users.db
+    python -m auth.cli backup --db users.db
+    python -m auth.cli restore backup-20240101-120000.tar.gz --db users.db
+    python -m auth.cli item-analysis items.csv --db users.db
+"""
+import os
+import argparse
+import logging
+import sys
+from auth import bulk, backup
+from auth.storage import create_backend, backend_for_path, migrate_storage
+from auth.user_db import UserDatabase
+from auth.conversations import ConversationStore
+from auth.attempts import QuizAttemptStore, default_attempts_path
+from content.quiz_content import get_quiz, get_quiz_titles
+from utils.item_analysis import item_report
+
+logger = logging.getLogger(__name__)
+
+def cmd_migrate(args):
+    """Copy all users from one database to another (e.g. YAML to SQLite or JSON)."""
+    source = create_backend(
+        args.source, args.source_backend or backend_for_path(args.source), args.source_format
+    )
+    target = create_backend(
+        args.target, args.target_backend or backend_for_path(args.target), args.target_format
+    )
+    try:
+        copied = migrate_storage(source, target, overwrite=args.overwrite)
+    finally:
+        source.close()
+        target.close()
+    print(f"Migrated {copied} users from {args.source} to {args.target}")
+    return 0
+
+def cmd_migrate_conversations(args):
+    """Move flat conversation files into the per-user conversation store."""
+    user_db = UserDatabase(args.db, args.backend)
+    user_db.conversations = ConversationStore(args.dir)
+    migrated = user_db.migrate_legacy_conversations(remove=not args.keep)
+    print(f"Migrated {migrated} conversations in {args.dir}")
+    return 0
+
+def cmd_import_users(args):
+    """Create users from a CSV or JSONL roster."""
+    user_db = UserDatabase(args.db, args.backend)
+    fmt = bulk.format_for_path(args.roster, args.format)
+    with (sys.stdin if args.roster == '-' else open(args.roster, newline='', encoding='utf-8')) as f:
+        result = bulk.import_users(user_db, bulk.read_rows(f, fmt), batch_size=args.batch_size)
+    for line_number, message in result['errors']:
+        print(f"  line {line_number}: {message}", file=sys.stderr)
+    print(f"Imported {result['imported']} users, skipped {result['skipped']} existing, "
+          f"rejected {result['invalid']} invalid rows")
+    return 1 if result['invalid'] else 0
+
+def cmd_export_users(args):
+    """Write all users' profiles, progress and quiz scores to CSV, JSONL or Parquet."""
+    user_db = UserDatabase(args.db, args.backend)
+    columns = args.columns.split(',') if args.columns else None
+    if args.output == '-':
+        fmt = args.format or 'jsonl'
+        if fmt == 'parquet':
+            print("Parquet can't be written to stdout; give an output file", file=sys.stderr)
+            return 1
+        count = bulk.export_users(user_db, sys.stdout, fmt, args.include_password_hashes, columns)
+    else:
+        count = bulk.export_to_file(user_db, args.output, args.format, columns, args.include_password_hashes)
+    print(f"Exported {count} users to {args.output}", file=sys.stderr)
+    return 0
+
+def _open_user_db(args):
+    user_db = UserDatabase(args.db, args.backend)
+    if args.conversations_dir:
+        user_db.conversations = ConversationStore(args.conversations_dir)
+    if args.attempts:
+        user_db.attempts = QuizAttemptStore(args.attempts)
+    return user_db
+
+def cmd_backup(args):
+    """Write a compressed, point-in-time backup while the app keeps running."""
+    user_db = _open_user_db(args)
+    path = args.output or backup.default_backup_path()
+    manifest = backup.create_backup(user_db, path, compresslevel=args.level)
+    print(f"Backed up {manifest['users']} users and {manifest['conversations']} conversations to {path} "
+          f"({manifest['bytes'] / 1e6:.1f} MB; snapshot {manifest['snapshot_seconds']:.2f}s, "
+          f"total {manifest['total_seconds']:.2f}s)")
+    return 0
+
+def cmd_restore(args):
+    """Restore a backup, moving the current files aside."""
+    # Resolve paths the way UserDatabase does, without opening (and creating) the stores
+    manifest = backup.restore_backup(
+        args.archive,
+        args.db or os.environ.get('USER_DB_PATH', 'users.yaml'),
+        args.backend,
+        conversations_dir=args.conversations_dir or os.environ.get('CONVERSATIONS_DIR', 'conversations'),
+        attempts_path=args.attempts
+    )
+    print(f"Restored {manifest['users']} users from the backup taken {manifest['created_at']}")
+    for path in manifest['moved_aside']:
+        print(f"  previous data kept at {path}")
+    return 0
+
+def cmd_item_analysis(args):
+    """Write difficulty, discrimination or option choices per quiz question to CSV."""
+    db_path = args.db or os.environ.get('USER_DB_PATH', 'users.yaml')
+    attempts = QuizAttemptStore(args.attempts or default_attempts_path(db_path))
+    report = item_report(attempts, {quiz_id: get_quiz(quiz_id) for quiz_id, _ in get_quiz_titles()})
+    table = report['options' if args.options else 'items']
+    table.to_csv(sys.stdout if args.output == '-' else args.output, index=False)
+    print(f"Analyzed {report['rows']} quiz attempts in {report['seconds']:.2f}s", file=sys.stderr)
+    return 0
+
+def build_parser():
+    """Build the argument parser for all subcommands.
+
+    Returns:
+        argparse.ArgumentParser: Configured parser
+    """
+    parser = argparse.ArgumentParser(description="Manage the LEO AI Academy user database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Copy users between storage backends or file formats")
+    migrate.add_argument("source", help="Database to read from, e.g. users.yaml")
+    migrate.add_argument("target", help="Database to write to, e.g. users.db")
+    migrate.add_argument("--source-backend", help="Override the backend inferred from the source path")
+    migrate.add_argument("--target-backend", help="Override the backend inferred from the target path")
+    migrate.add_argument("--source-format", choices=["yaml", "json"], help="Override the format inferred from the source path")
+    migrate.add_argument("--target-format", choices=["yaml", "json"], help="Override the format inferred from the target path")
+    migrate.add_argument("--overwrite", action="store_true", help="Replace users that already exist in the target")
+    migrate.set_defaults(func=cmd_migrate)
+
+    conversations = subparsers.add_parser(
+        "migrate-conversations", help="Move flat conversation files into per-user directories"
+    )
+    conversations.add_argument("--db", help="User database whose conversation references are updated (default: USER_DB_PATH)")
+    conversations.add_argument("--backend", help="Override the backend inferred from the database path")
+    conversations.add_argument("--dir", default="conversations", help="Conversations directory")
+    conversations.add_argument("--keep", action="store_true", help="Leave the flat files in place after copying them")
+    conversations.set_defaults(func=cmd_migrate_conversations)
+
+    import_users = subparsers.add_parser("import-users", help="Create users in bulk from a CSV or JSONL roster")
+    import_users.add_argument("roster", help="Roster file, or - for stdin")
+    import_users.add_argument("--db", help="User database (default: USER_DB_PATH)")
+    import_users.add_argument("--backend", help="Override the backend inferred from the database path")
+    import_users.add_argument("--format", choices=["csv", "jsonl"], help="Override the format inferred from the file name")
+    import_users.add_argument("--batch-size", type=int, default=500, help="Users written per batch")
+    import_users.set_defaults(func=cmd_import_users)
+
+    export_users = subparsers.add_parser("export-users", help="Write users, progress and quiz scores to CSV, JSONL or Parquet")
+    export_users.add_argument("output", help="Output file, or - for stdout")
+    export_users.add_argument("--db", help="User database (default: USER_DB_PATH)")
+    export_users.add_argument("--backend", help="Override the backend inferred from the database path")
+    export_users.add_argument("--format", choices=["csv", "jsonl", "parquet"],
+                              help="Override the format inferred from the file name (parquet needs pyarrow)")
+    export_users.add_argument("--columns", help=f"Comma-separated fields to export (default: {','.join(bulk.EXPORT_FIELDS)})")
+    export_users.add_argument("--include-password-hashes", action="store_true",
+                              help="Include bcrypt hashes so the export can be re-imported with working logins")
+    export_users.set_defaults(func=cmd_export_users)
+
+    backup_parser = subparsers.add_parser("backup", help="Back up users, conversations and quiz attempts without stopping the app")
+    backup_parser.add_argument("output", nargs="?", help="Archive to write (default: backup-<timestamp>.tar.gz)")
+    backup_parser.add_argument("--level", type=int, default=6, choices=range(1, 10), metavar="1-9",
+                               help="gzip level: 1 is fastest, 9 is smallest")
+    restore = subparsers.add_parser("restore", help="Restore a backup; stop the app first")
+    restore.add_argument("archive", help="Backup archive to restore")
+    for sub in (backup_parser, restore):
+        sub.add_argument("--db", help="User database (default: USER_DB_PATH)")
+        sub.add_argument("--backend", help="Override the backend inferred from the database path")
+        sub.add_argument("--conversations-dir", help="Conversation store (default: CONVERSATIONS_DIR)")
+        sub.add_argument("--attempts", help="Quiz attempt history (default: QUIZ_ATTEMPTS_PATH or <db>.attempts)")
+    backup_parser.set_defaults(func=cmd_backup)
+    restore.set_defaults(func=cmd_restore)
+
+    items = subparsers.add_parser("item-analysis", help="Report difficulty, discrimination and option choices per quiz question")
+    items.add_argument("output", nargs="?", default="-", help="CSV file to write, or - for stdout")
+    items.add_argument("--db", help="User database whose attempt history to read (default: USER_DB_PATH)")
+    items.add_argument("--attempts", help="Quiz attempt history (default: QUIZ_ATTEMPTS_PATH or <db>.attempts)")
+    items.add_argument("--options", action="store_true", help="Report how often each option was picked instead")
+    items.set_defaults(func=cmd_item_analysis)
+
+    return parser
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+import os
+import re
+import json
+import hashlib
+import zlib
+import bisect
+import shutil
+import logging
+import datetime
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
+from auth.storage import file_lock, _write_atomic, _link_or_copy, _copy_prefix
+from auth.ids import new_id, is_id, id_floor
+
+logger = logging.getLogger(__name__)
+
+# Conversation ids become file names, so only allow a safe alphabet
+_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+# Files written before the store: conversations/conversation-<username>-<id>.json
+_FLAT_FILE_PATTERN = re.compile(r'^conversation-(.+)-([0-9A-Za-z_]+)\.json$')
+
+# Users whose sorted index is kept in memory per process
+CACHED_INDEXES = 1024
+
+class _SortedIndex:
+    """One user's index entries in sort order, oldest first.
+
+    Built from the index file and brought up to date by replaying only the
+    lines appended since, so paging doesn't re-read or re-sort the index.
+    """
+
+    def __init__(self, ino):
+        self.ino = ino
+        self.size = 0
+        self.keys = []
+        self.entries = []
+        self._key_of = {}
+        self.lock = threading.Lock()
+
+    def apply(self, op, entry):
+        old = self._key_of.pop(entry['id'], None)
+        if old is not None:
+            i = bisect.bisect_left(self.keys, old)
+            del self.keys[i]
+            del self.entries[i]
+        if op == '+':
+            key = (ConversationStore.sort_key(entry), entry['id'])
+            # New ids sort last, so this is almost always an append
+            i = bisect.bisect_left(self.keys, key)
+            self.keys.insert(i, key)
+            self.entries.insert(i, entry)
+            self._key_of[entry['id']] = key
+
+class ConversationStore:
+    """Saved playground conversations, kept apart from the user database.
+
+    Each user has a directory ``<root>/ab/cd/<username>/``, where ``abcd``
+    starts the SHA-1 of the username, so no directory grows with the number
+    of users and removing a user removes a single subtree. It holds one
+    zlib-compressed JSON file per conversation (``<id>.json.z``) and an
+    append-only ``index.jsonl`` of
+    ``{"op": "+", "id", "title", "timestamp", "messages"}`` and
+    ``{"op": "-", "id"}`` entries used for listing. A conversation is read
+    straight from its file by id, so lookups don't depend on how many a user
+    has saved, and saving never rewrites the user database.
+    """
+
+    def __init__(self, root="conversations", compress_level=6):
+        """Open a conversation store.
+
+        Args:
+            root (str, optional): Directory holding all users' conversations
+            compress_level (int, optional): zlib level for message bodies
+        """
+        self.root = root
+        self.compress_level = compress_level
+        self._indexes = OrderedDict()
+        self._indexes_lock = threading.Lock()
+
+    def _user_dir(self, username):
+        name = quote(username, safe='@.+-_')
+        if name in ('', '.', '..'):
+            # Would resolve to the hash bucket or its parent, shared with others
+            raise ValueError(f"Invalid username for the conversation store: {username!r}")
+        digest = hashlib.sha1(username.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, digest[:2], digest[2:4], name)
+
+    def _index_path(self, username):
+        return os.path.join(self._user_dir(username), 'index.jsonl')
+
+    def _body_path(self, username, conversation_id):
+        if not _ID_PATTERN.match(str(conversation_id)):
+            raise ValueError(f"Invalid conversation id: {conversation_id!r}")
+        return os.path.join(self._user_dir(username), f"{conversation_id}.json.z")
+
+    @staticmethod
+    def sort_key(entry):
+        """Get the key that orders conversations by when they were saved.
+
+        This is the id itself; conversations saved before sortable ids were
+        introduced are placed by their timestamp instead.
+
+        Args:
+            entry (dict): Index entry
+
+        Returns:
+            str: Sort key comparable with ids
+        """
+        if is_id(entry['id']):
+            return entry['id']
+        try:
+            return id_floor(datetime.datetime.fromisoformat(entry['timestamp']))
+        except (KeyError, TypeError, ValueError):
+            return ''
+
+    @classmethod
+    def cursor(cls, entry):
+        """Get the pagination cursor that resumes listing just after ``entry``."""
+        return f"{cls.sort_key(entry)}:{entry['id']}"
+
+    @classmethod
+    def paginate(cls, entries, cursor=None, limit=20):
+        """Take one page from entries sorted newest first.
+
+        Args:
+            entries (list): Index entries, newest first
+            cursor (str, optional): Cursor from the previous page
+            limit (int, optional): Maximum entries to return
+
+        Returns:
+            tuple: (page of entries, cursor for the next page or None)
+        """
+        if cursor:
+            key, _, after_id = cursor.partition(':')
+            entries = [e for e in entries if (cls.sort_key(e), e['id']) < (key, after_id)]
+        page = entries[:limit]
+        next_cursor = cls.cursor(page[-1]) if len(entries) > limit else None
+        return page, next_cursor
+
+    def save(self, username, title, messages, conversation_id=None, timestamp=None):
+        """Save a conversation.
+
+        Args:
+            username (str): Owner of the conversation
+            title (str): Conversation title
+            messages (list): Message dicts with ``role`` and ``content``
+            conversation_id (str, optional): Id to use; a new sortable id
+                (see ``auth.ids``) if omitted
+            timestamp (str, optional): ISO time saved; defaults to now
+
+        Returns:
+            dict: Index entry for the saved conversation
+        """
+        conversation_id = conversation_id or new_id()
+        entry = {
+            'id': conversation_id,
+            'title': title,
+            'timestamp': timestamp or datetime.datetime.now().isoformat(),
+            'messages': len(messages),
+        }
+        body = dict(entry, messages=messages)
+        body_path = self._body_path(username, conversation_id)
+        os.makedirs(os.path.dirname(body_path), exist_ok=True)
+        _write_atomic(
+            body_path,
+            zlib.compress(json.dumps(body, separators=(',', ':')).encode('utf-8'), self.compress_level)
+        )
+        self._append_index(username, dict(entry, op='+'))
+        return entry
+
+    def get(self, username, conversation_id):
+        """Load a conversation by id.
+
+        Args:
+            username (str): Owner of the conversation
+            conversation_id (str): Conversation id
+
+        Returns:
+            dict: Conversation with ``id``, ``title``, ``timestamp`` and
+            ``messages``, or None if it doesn't exist
+        """
+        try:
+            with open(self._body_path(username, conversation_id), 'rb') as f:
+                return json.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def delete(self, username, conversation_id):
+        """Delete a conversation.
+
+        Args:
+            username (str): Owner of the conversation
+            conversation_id (str): Conversation id
+
+        Returns:
+            bool: True if the conversation existed
+        """
+        try:
+            os.remove(self._body_path(username, conversation_id))
+        except (FileNotFoundError, ValueError):
+            return False
+        self._append_index(username, {'op': '-', 'id': conversation_id})
+        return True
+
+    def _sorted_index(self, username):
+        """Get a user's index entries in sort order, reading only what changed.
+
+        The index file is only appended to, or replaced when it is compacted,
+        so a cached copy is valid while the file keeps its inode, and catches
+        up by replaying the lines added since it was read.
+
+        Returns:
+            _SortedIndex: The user's entries, or None if they have none; hold
+            its ``lock`` while reading it
+        """
+        index_path = self._index_path(username)
+        if not os.path.exists(index_path):
+            return None
+        with file_lock(index_path):
+            try:
+                f = open(index_path, 'rb')
+            except FileNotFoundError:
+                return None
+            with f:
+                st = os.fstat(f.fileno())
+                with self._indexes_lock:
+                    index = self._indexes.get(username)
+                    if index is None or index.ino != st.st_ino or index.size > st.st_size:
+                        index = self._indexes[username] = _SortedIndex(st.st_ino)
+                    self._indexes.move_to_end(username)
+                    while len(self._indexes) > CACHED_INDEXES:
+                        self._indexes.popitem(last=False)
+                with index.lock:
+                    if index.size < st.st_size:
+                        f.seek(index.size)
+                        for op, entry, length in self._read_ops(f):
+                            index.apply(op, entry)
+                            index.size += length
+        return index
+
+    def list(self, username, start=None, end=None):
+        """List a user's conversations without loading their messages.
+
+        Time bounds are turned into id bounds, so filtering compares ids
+        rather than parsing timestamps.
+
+        Args:
+            username (str): Owner of the conversations
+            start (datetime, optional): Only conversations saved at or after this time
+            end (datetime, optional): Only conversations saved before this time
+
+        Returns:
+            list: Index entries, newest first
+        """
+        index = self._sorted_index(username)
+        if index is None:
+            return []
+        with index.lock:
+            low = bisect.bisect_left(index.keys, (id_floor(start),)) if start is not None else 0
+            high = bisect.bisect_left(index.keys, (id_floor(end),)) if end is not None else len(index.keys)
+            return [dict(e) for e in reversed(index.entries[low:high])]
+
+    def page(self, username, cursor=None, limit=20):
+        """Take one page of a user's conversations, newest first.
+
+        Seeks to the cursor in the cached sorted index, so a page costs the
+        same however many conversations the user has.
+
+        Args:
+            username (str): Owner of the conversations
+            cursor (str, optional): Cursor from the previous page
+            limit (int, optional): Maximum entries to return
+
+        Returns:
+            tuple: (page of entries, cursor for the next page or None)
+        """
+        index = self._sorted_index(username)
+        if index is None:
+            return [], None
+        with index.lock:
+            end = len(index.keys)
+            if cursor:
+                key, _, after_id = cursor.partition(':')
+                end = bisect.bisect_left(index.keys, (key, after_id))
+            first = max(0, end - limit)
+            page = [dict(e) for e in reversed(index.entries[first:end])]
+        return page, (self.cursor(page[-1]) if first > 0 and page else None)
+
+    def delete_user(self, username):
+        """Remove all of a user's conversations.
+
+        Args:
+            username (str): User whose conversations are removed
+
+        Returns:
+            bool: True if the user had any stored conversations
+        """
+        with self._indexes_lock:
+            self._indexes.pop(username, None)
+        user_dir = self._user_dir(username)
+        if not os.path.isdir(user_dir):
+            return False
+        shutil.rmtree(user_dir)
+        return True
+
+    def snapshot(self, dest):
+        """Copy every user's conversations into a directory.
+
+        Each user's directory is copied under a shared lock on its index, so
+        every index is complete and consistent with the bodies; conversation
+        bodies are only ever replaced, so they are hard-linked rather than
+        copied. Conversations saved while the copy runs may or may not be
+        included.
+
+        Args:
+            dest (str): Directory to copy into; it mirrors the store's root
+
+        Returns:
+            int: Number of conversation files copied
+        """
+        copied = 0
+        if not os.path.isdir(self.root):
+            return copied
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            target = os.path.join(dest, os.path.relpath(dirpath, self.root))
+            os.makedirs(target, exist_ok=True)
+            if 'index.jsonl' not in filenames:
+                # The root (legacy flat files) or a shard directory
+                for filename in filenames:
+                    if _FLAT_FILE_PATTERN.match(filename):
+                        _link_or_copy(os.path.join(dirpath, filename), os.path.join(target, filename))
+                        copied += 1
+                continue
+            index_path = os.path.join(dirpath, 'index.jsonl')
+            with file_lock(index_path):
+                _copy_prefix(index_path, os.path.join(target, 'index.jsonl'), os.path.getsize(index_path))
+                for filename in filenames:
+                    if not filename.endswith('.json.z'):
+                        continue
+                    try:
+                        _link_or_copy(os.path.join(dirpath, filename), os.path.join(target, filename))
+                        copied += 1
+                    except FileNotFoundError:
+                        # Deleted since the directory was listed
+                        continue
+        return copied
+
+    def migrate_flat_files(self, remove=True):
+        """Move conversations saved before the store into it.
+
+        Picks up ``conversation-<username>-<id>.json`` files written before
+        the store existed. The root is listed once; nothing else is scanned.
+
+        Args:
+            remove (bool, optional): Delete each flat file once it is stored
+
+        Returns:
+            dict: ``{username: [conversation ids]}`` for migrated flat files
+        """
+        migrated = {}
+        if not os.path.isdir(self.root):
+            return migrated
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                match = _FLAT_FILE_PATTERN.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
+                username, conversation_id = match.groups()
+                try:
+                    with open(entry.path, 'r') as f:
+                        conversation = json.load(f)
+                    self.save(
+                        username,
+                        conversation.get('title', ''),
+                        conversation.get('messages', []),
+                        conversation_id=conversation_id,
+                        timestamp=conversation.get('timestamp')
+                    )
+                except Exception as e:
+                    logger.error(f"Error migrating conversation file {entry.path}: {e}")
+                    continue
+                if remove:
+                    os.remove(entry.path)
+                migrated.setdefault(username, []).append(conversation_id)
+        logger.info(f"Migrated {sum(map(len, migrated.values()))} conversation files in {self.root}")
+        return migrated
+
+    @staticmethod
+    def _read_ops(f):
+        """Yield ``(op, entry, bytes)`` for each complete line from an index file."""
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            entry = json.loads(line)
+            yield entry.pop('op'), entry, len(line)
+
+    @classmethod
+    def _read_index(cls, index_path):
+        """Replay an index file; the caller holds a lock.
+
+        Returns:
+            tuple: (``{id: entry}``, number of lines read)
+        """
+        entries = {}
+        lines = 0
+        with open(index_path, 'rb') as f:
+            for op, entry, _ in cls._read_ops(f):
+                lines += 1
+                if op == '+':
+                    entries[entry['id']] = entry
+                else:
+                    entries.pop(entry['id'], None)
+        return entries, lines
+
+    def _append_index(self, username, entry):
+        index_path = self._index_path(username)
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with file_lock(index_path, exclusive=True):
+            with open(index_path, 'ab') as f:
+                f.write(json.dumps(entry, separators=(',', ':')).encode('utf-8') + b'\n')
+            if entry['op'] == '-':
+                entries, lines = self._read_index(index_path)
+                # Drop deleted conversations once they make up most of the index
+                if lines > 2 * len(entries) + 50:
+                    _write_atomic(index_path, b''.join(
+                        json.dumps(dict(e, op='+'), separators=(',', ':')).encode('utf-8') + b'\n'
+                        for e in entries.values()
+                    ))
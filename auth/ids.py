@@ -0,0 +1,139 @@
+"""Sortable, collision-free ids.
+
+An id packs a 48-bit millisecond timestamp, a 16-bit node id and a 16-bit
+per-millisecond counter into 80 bits, written as 16 Crockford base32
+characters. Ids from one generator are strictly increasing, and ids from
+different processes sort by creation time to the millisecond, so a plain
+string comparison orders them and time ranges map to id ranges.
+"""
+import os
+import time
+import zlib
+import socket
+import datetime
+import threading
+
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+ID_LENGTH = 16
+
+_NODE_BITS = 16
+_SEQUENCE_BITS = 16
+_DECODE = {c: i for i, c in enumerate(ALPHABET)}
+
+def _encode(value):
+    chars = []
+    for _ in range(ID_LENGTH):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+def _decode(text):
+    value = 0
+    for c in text:
+        value = (value << 5) | _DECODE[c]
+    return value
+
+def default_node_id():
+    """Get this process's node id.
+
+    Uses ``NODE_ID`` if set; otherwise derives one from the host name and
+    process id, so separate server processes use different ids.
+
+    Returns:
+        int: Node id in ``[0, 65536)``
+    """
+    if os.environ.get('NODE_ID'):
+        return int(os.environ['NODE_ID']) % (1 << _NODE_BITS)
+    return zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode('utf-8')) % (1 << _NODE_BITS)
+
+class IdGenerator:
+    """Thread-safe generator of monotonic ids for one node."""
+
+    def __init__(self, node_id=None):
+        """Create a generator.
+
+        Args:
+            node_id (int, optional): Node id; defaults to ``default_node_id()``
+        """
+        self.node_id = default_node_id() if node_id is None else node_id
+        self._lock = threading.Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def new_id(self):
+        """Generate the next id.
+
+        Returns:
+            str: 16-character id, greater than any previously returned
+        """
+        with self._lock:
+            now = int(time.time() * 1000)
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            else:
+                # Same millisecond, or the clock stepped back: keep counting
+                # from the last timestamp so ids never go backwards
+                self._sequence += 1
+                if self._sequence >= 1 << _SEQUENCE_BITS:
+                    self._last_ms += 1
+                    self._sequence = 0
+            value = (self._last_ms << (_NODE_BITS + _SEQUENCE_BITS)) | (self.node_id << _SEQUENCE_BITS) | self._sequence
+        return _encode(value)
+
+def is_id(value):
+    """Check whether a string is an id from this module.
+
+    Args:
+        value (str): Candidate id
+
+    Returns:
+        bool: True if it has the right length and alphabet
+    """
+    return isinstance(value, str) and len(value) == ID_LENGTH and all(c in _DECODE for c in value)
+
+def id_time(value):
+    """Get the creation time encoded in an id.
+
+    Args:
+        value (str): Id from ``new_id``
+
+    Returns:
+        datetime.datetime: Local creation time, to the millisecond
+    """
+    ms = _decode(value) >> (_NODE_BITS + _SEQUENCE_BITS)
+    return datetime.datetime.fromtimestamp(ms / 1000)
+
+def id_floor(when):
+    """Get the smallest id that could be generated at a given time.
+
+    ``id_floor(start) <= id < id_floor(end)`` selects ids created in
+    ``[start, end)``.
+
+    Args:
+        when (datetime.datetime or float): Time as a datetime or Unix timestamp
+
+    Returns:
+        str: Lower-bound id
+    """
+    if isinstance(when, datetime.datetime):
+        when = when.timestamp()
+    return _encode(int(when * 1000) << (_NODE_BITS + _SEQUENCE_BITS))
+
+_generator = IdGenerator()
+
+def _reset_after_fork():
+    global _generator
+    _generator = IdGenerator()
+
+if hasattr(os, 'register_at_fork'):
+    # A forked worker must not reuse its parent's node id and counter
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+def new_id():
+    """Generate an id with the process-wide generator.
+
+    Returns:
+        str: 16-character sortable id
+    """
+    return _generator.new_id()
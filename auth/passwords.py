@@ -0,0 +1,156 @@
+import os
+import time
+import logging
+import threading
+import bcrypt
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Never calibrate below this cost, however slow the host is; it was the
+# fixed cost before calibration, so no existing hash is weaker
+MIN_ROUNDS = 12
+MAX_ROUNDS = 16
+
+# Time one hash should take unless BCRYPT_TARGET_MS says otherwise
+DEFAULT_TARGET_MS = 250
+
+# bcrypt releases the GIL while hashing, so a small pool lets hashes run in
+# parallel while capping how many cores a login storm can occupy
+_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BCRYPT_WORKERS', 0)) or min(4, os.cpu_count() or 1),
+    thread_name_prefix='bcrypt'
+)
+
+_rounds = None
+_rounds_lock = threading.Lock()
+
+def calibrate_rounds(target_ms, minimum=MIN_ROUNDS, maximum=MAX_ROUNDS):
+    """Find the highest bcrypt cost whose hash time stays within a target.
+
+    Each extra round doubles the work, so one timing at ``minimum`` is enough
+    to extrapolate.
+
+    Args:
+        target_ms (float): Target time for one hash in milliseconds
+        minimum (int, optional): Lowest cost to return
+        maximum (int, optional): Highest cost to return
+
+    Returns:
+        int: bcrypt cost factor
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(minimum))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = minimum
+    while rounds < maximum and elapsed_ms * 2 <= target_ms:
+        elapsed_ms *= 2
+        rounds += 1
+    logger.info(f"Calibrated bcrypt cost to {rounds} (~{elapsed_ms:.0f} ms per hash)")
+    return rounds
+
+def _resolve_rounds():
+    if os.environ.get('BCRYPT_ROUNDS'):
+        return int(os.environ['BCRYPT_ROUNDS'])
+    return calibrate_rounds(float(os.environ.get('BCRYPT_TARGET_MS') or DEFAULT_TARGET_MS))
+
+def warm_up():
+    """Start working out the bcrypt cost in the background.
+
+    Call this at startup, once the environment is loaded, so the
+    calibration hash runs before the first login rather than inside it.
+    Later calls do nothing.
+    """
+    global _rounds
+    with _rounds_lock:
+        if _rounds is None:
+            _rounds = _executor.submit(_resolve_rounds)
+
+def get_rounds():
+    """Get the bcrypt cost used for new hashes.
+
+    Uses ``BCRYPT_ROUNDS`` if set, otherwise calibrates to ``BCRYPT_TARGET_MS``
+    (default ``DEFAULT_TARGET_MS``). This is worked out once per process, by
+    ``warm_up`` or else on first use, and waits for a calibration still
+    running.
+
+    Returns:
+        int: bcrypt cost factor
+    """
+    warm_up()
+    return _rounds.result()
+
+def hash_password(password, rounds=None):
+    """Hash a password on the bcrypt worker pool.
+
+    Args:
+        password (str): Plain-text password
+        rounds (int, optional): bcrypt cost; defaults to ``get_rounds()``
+
+    Returns:
+        str: bcrypt hash
+    """
+    salt = bcrypt.gensalt(rounds or get_rounds())
+    return _executor.submit(bcrypt.hashpw, password.encode('utf-8'), salt).result().decode('utf-8')
+
+def hash_passwords(passwords, rounds=None):
+    """Hash several passwords in parallel on the bcrypt worker pool.
+
+    Args:
+        passwords (list): Plain-text passwords
+        rounds (int, optional): bcrypt cost; defaults to ``get_rounds()``
+
+    Returns:
+        list: bcrypt hashes, in the same order as ``passwords``
+    """
+    rounds = rounds or get_rounds()
+    futures = [
+        _executor.submit(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(rounds))
+        for password in passwords
+    ]
+    return [future.result().decode('utf-8') for future in futures]
+
+def check_password(password, password_hash):
+    """Check a password against a bcrypt hash on the worker pool.
+
+    Args:
+        password (str): Plain-text password
+        password_hash (str): Stored bcrypt hash
+
+    Returns:
+        bool: True if the password matches
+    """
+    if not password_hash:
+        return False
+    return _executor.submit(
+        bcrypt.checkpw, password.encode('utf-8'), password_hash.encode('utf-8')
+    ).result()
+
+def hash_rounds(password_hash):
+    """Read the cost factor out of a bcrypt hash.
+
+    Args:
+        password_hash (str): bcrypt hash such as ``$2b$12$...``
+
+    Returns:
+        int: Cost factor, or 0 if the hash isn't in bcrypt format
+    """
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
+def needs_rehash(password_hash):
+    """Check whether a hash was made with a lower cost than configured.
+
+    Hashes are only ever upgraded, so a process that calibrated lower never
+    weakens a stored hash, and processes can't rehash an account back and
+    forth.
+
+    Args:
+        password_hash (str): Stored bcrypt hash
+
+    Returns:
+        bool: True if the hash should be replaced on the next successful login
+    """
+    return hash_rounds(password_hash) < get_rounds()
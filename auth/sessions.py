@@ -0,0 +1,244 @@
+import os
+import json
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import secrets
+import threading
+from auth.storage import file_lock, _write_atomic
+
+logger = logging.getLogger(__name__)
+
+SESSION_COOKIE = "leo_session"
+
+# Length of a generated signing secret
+SECRET_BYTES = 32
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def load_secret(path):
+    """Load the signing secret from a file, creating it on first use.
+
+    The key is written and synced to a temporary file before being linked
+    into place, so another process never reads a partly written secret.
+
+    Args:
+        path (str): Secret file path
+
+    Returns:
+        bytes: Signing secret
+
+    Raises:
+        ValueError: If the file holds a secret shorter than ``SECRET_BYTES``
+    """
+    if not os.path.exists(path):
+        secret = secrets.token_bytes(SECRET_BYTES)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(secret.hex())
+                f.flush()
+                os.fsync(f.fileno())
+            os.link(tmp_path, path)
+            logger.info(f"Created session secret {path}")
+            return secret
+        except FileExistsError:
+            # Another process created it first; use theirs
+            pass
+        finally:
+            os.unlink(tmp_path)
+    with open(path, 'r') as f:
+        secret = bytes.fromhex(f.read().strip())
+    if len(secret) < SECRET_BYTES:
+        raise ValueError(f"Session secret {path} is shorter than {SECRET_BYTES} bytes; delete it to generate a new one")
+    return secret
+
+class RevocationList:
+    """Revoked token ids shared between processes through an append-only file.
+
+    Each line is ``<token id> <expiry>``. The file is read incrementally, so
+    checking a token costs one ``stat`` unless someone revoked a token since
+    the last check. Expired entries are dropped when the file is rewritten.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._revoked = {}
+        self._offset = 0
+        self._ino = None
+        self._lock = threading.Lock()
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            self._revoked, self._offset, self._ino = {}, 0, None
+            return
+        if st.st_ino != self._ino or st.st_size < self._offset:
+            # The file was rewritten; start over
+            self._revoked, self._offset, self._ino = {}, 0, st.st_ino
+        if st.st_size == self._offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            data = f.read()
+        # Ignore a partially written last line until it is complete
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            try:
+                jti, exp = line.decode('ascii').split()
+                self._revoked[jti] = int(exp)
+            except ValueError:
+                continue
+        self._offset += end
+
+    def is_revoked(self, jti):
+        """Check whether a token id has been revoked.
+
+        Args:
+            jti (str): Token id
+
+        Returns:
+            bool: True if revoked
+        """
+        with self._lock:
+            self._refresh()
+            return jti in self._revoked
+
+    def revoke(self, jti, exp):
+        """Revoke a token id until it would have expired anyway.
+
+        Args:
+            jti (str): Token id
+            exp (int): Token expiry as a Unix timestamp
+        """
+        with self._lock, file_lock(self.path, exclusive=True):
+            with open(self.path, 'a') as f:
+                f.write(f"{jti} {int(exp)}\n")
+            self._refresh()
+            now = time.time()
+            live = {k: v for k, v in self._revoked.items() if v > now}
+            if len(self._revoked) > 2 * len(live) + 1000:
+                _write_atomic(self.path, ''.join(f"{k} {v}\n" for k, v in live.items()).encode('ascii'))
+                self._refresh()
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._revoked)
+
+class SessionTokens:
+    """Issue and check HMAC-signed, expiring session tokens.
+
+    A token is ``<payload>.<signature>``, both base64url. The payload holds the
+    username, display name, expiry and a random token id used for
+    revocation. Checking a token needs no password hash or user lookup.
+    """
+
+    def __init__(self, secret, revocation_path, ttl=7 * 24 * 3600):
+        """Create a token issuer.
+
+        Args:
+            secret (bytes): HMAC key
+            revocation_path (str): File that records revoked token ids
+            ttl (int, optional): Token lifetime in seconds
+        """
+        self._secret = secret
+        self.ttl = ttl
+        self.revoked = RevocationList(revocation_path)
+
+    def _sign(self, payload):
+        return _b64encode(hmac.new(self._secret, payload.encode('ascii'), hashlib.sha256).digest())
+
+    def issue(self, username, name=None):
+        """Create a token for a logged-in user.
+
+        Args:
+            username (str): Username
+            name (str, optional): Display name
+
+        Returns:
+            tuple: (token, expiry as a Unix timestamp)
+        """
+        exp = int(time.time()) + self.ttl
+        claims = {'u': username, 'n': name or username, 'exp': exp, 'jti': secrets.token_hex(8)}
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        return f"{payload}.{self._sign(payload)}", exp
+
+    def verify(self, token):
+        """Check a token's signature, expiry and revocation.
+
+        Args:
+            token (str): Token from the session cookie
+
+        Returns:
+            dict: Claims (``u``, ``n``, ``exp``, ``jti``) or None if invalid
+        """
+        try:
+            payload, signature = token.split('.')
+            if not hmac.compare_digest(signature, self._sign(payload)):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (AttributeError, ValueError, UnicodeError):
+            return None
+        if claims.get('exp', 0) <= time.time():
+            return None
+        if self.revoked.is_revoked(claims.get('jti')):
+            return None
+        return claims
+
+    def revoke(self, token):
+        """Revoke a token so it can't restore a session again.
+
+        Args:
+            token (str): Token to revoke
+
+        Returns:
+            bool: True if the token was valid and is now revoked
+        """
+        claims = self.verify(token)
+        if not claims:
+            return False
+        try:
+            self.revoked.revoke(claims['jti'], claims['exp'])
+            return True
+        except Exception as e:
+            logger.error(f"Error revoking session for user {claims.get('u')}: {e}")
+            return False
+
+_tokens = None
+_tokens_lock = threading.Lock()
+
+def get_session_tokens():
+    """Get the process-wide session token issuer.
+
+    The key comes from ``SESSION_SECRET``, or from ``SESSION_SECRET_FILE``
+    (default ``.session_secret``), which is generated on first use. Revoked
+    tokens are recorded in ``SESSION_REVOCATION_PATH`` (default
+    ``revoked_sessions.log``). ``SESSION_TTL_HOURS`` sets the lifetime.
+
+    Returns:
+        SessionTokens: Shared issuer
+    """
+    global _tokens
+    if _tokens is None:
+        with _tokens_lock:
+            if _tokens is None:
+                secret = os.environ.get('SESSION_SECRET')
+                if secret:
+                    secret = secret.encode('utf-8')
+                else:
+                    secret = load_secret(os.environ.get('SESSION_SECRET_FILE', '.session_secret'))
+                _tokens = SessionTokens(
+                    secret,
+                    os.environ.get('SESSION_REVOCATION_PATH', 'revoked_sessions.log'),
+                    ttl=int(float(os.environ.get('SESSION_TTL_HOURS', 168)) * 3600)
+                )
+    return _tokens
@@ -0,0 +1,2205 @@
+import os
+import copy
+import contextlib
+import json
+import yaml
+import zlib
+import time
+import queue
+import sqlite3
+import logging
+import threading
+import weakref
+import hashlib
+import bisect
+import collections
+import heapq
+import random
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no fcntl
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Use the libyaml bindings when PyYAML was built with them; they parse and
+# emit the same documents several times faster than the pure-Python classes
+try:
+    from yaml import CSafeLoader as YamlLoader, CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeLoader as YamlLoader, SafeDumper as YamlDumper
+
+logger = logging.getLogger(__name__)
+
+# Attempts at an optimistic update before giving up (see StorageBackend.mutate)
+CAS_RETRIES = 50
+
+# Columns users can be sorted by in query_users; all but username follow
+# the order of UserIndex.fields
+QUERY_SORTS = ('username', 'email', 'agency', 'created_at', 'lesson_progress')
+
+class VersionConflict(Exception):
+    """An optimistic update kept losing to concurrent writers."""
+
+def record_version(record):
+    """Get a record's version stamp; records written before versioning count as 0."""
+    return record.get('version', 0)
+
+class YamlFormat:
+    """Serialize a database as YAML (readable, slowest)."""
+
+    name = "yaml"
+
+    @staticmethod
+    def loads(data):
+        return yaml.load(data, Loader=YamlLoader) or {}
+
+    @staticmethod
+    def dumps(db):
+        return yaml.dump(db, Dumper=YamlDumper).encode('utf-8')
+
+class JsonFormat:
+    """Serialize a database as compact JSON, using orjson when installed."""
+
+    name = "json"
+
+    @staticmethod
+    def loads(data):
+        if orjson is not None:
+            return orjson.loads(data) or {}
+        return json.loads(data) or {}
+
+    @staticmethod
+    def dumps(db):
+        if orjson is not None:
+            return orjson.dumps(db, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(db, separators=(',', ':')).encode('utf-8')
+
+FORMATS = {
+    'yaml': YamlFormat,
+    'json': JsonFormat,
+}
+
+def format_for_path(path, fmt=None):
+    """Pick the serialization format for a database file.
+
+    The format is chosen from the ``fmt`` argument, then the
+    ``USER_DB_FORMAT`` environment variable, then the file extension.
+
+    Args:
+        path (str): Path to the database file
+        fmt (str, optional): Format name (see ``FORMATS``)
+
+    Returns:
+        type: Format class with ``loads`` and ``dumps``
+    """
+    name = fmt or os.environ.get('USER_DB_FORMAT')
+    if not name:
+        name = 'json' if path.endswith('.json') else 'yaml'
+    if name not in FORMATS:
+        raise ValueError(f"Unknown user database format: {name}")
+    return FORMATS[name]
+
+class StorageBackend:
+    """Base class for user database storage backends.
+
+    A backend stores one record (a plain dict) per username. UserDatabase only
+    talks to its backend through the methods below, so backends can be swapped
+    without touching the rest of the application.
+    """
+
+    name = "base"
+
+    def load_all(self):
+        """Load every user record.
+
+        Returns:
+            dict: Mapping of username to user record
+        """
+        raise NotImplementedError
+
+    def save_all(self, db):
+        """Replace the stored database with the given mapping.
+
+        Args:
+            db (dict): Mapping of username to user record
+        """
+        raise NotImplementedError
+
+    def get(self, username):
+        """Get a single user record.
+
+        Args:
+            username (str): Username to look up
+
+        Returns:
+            dict: User record or None if the user doesn't exist
+        """
+        raise NotImplementedError
+
+    def exists(self, username):
+        """Check if a user record exists.
+
+        Args:
+            username (str): Username to check
+
+        Returns:
+            bool: True if the user exists, False otherwise
+        """
+        return self.get(username) is not None
+
+    def insert(self, username, record):
+        """Insert a new user record.
+
+        Args:
+            username (str): Username of the new user
+            record (dict): User record to store
+
+        Returns:
+            bool: True if inserted, False if the user already exists
+        """
+        raise NotImplementedError
+
+    def insert_many(self, records):
+        """Insert several new user records.
+
+        Backends that can write a batch in one operation override this.
+
+        Args:
+            records (dict): Mapping of username to user record
+
+        Returns:
+            list: Usernames that were inserted (existing users are skipped)
+        """
+        return [username for username, record in records.items() if self.insert(username, record)]
+
+    def compare_and_swap(self, username, version, record):
+        """Replace a user record if nobody has written it since it was read.
+
+        Args:
+            username (str): Username of the record to replace
+            version (int): Version of the record when it was read
+            record (dict): New record; its ``version`` is set to ``version + 1``
+
+        Returns:
+            bool: True if written, False if the stored version has moved on,
+            or None if the user doesn't exist
+        """
+        raise NotImplementedError
+
+    def mutate(self, username, fn):
+        """Apply an in-place modification to a single user record.
+
+        The update is optimistic: the record is read without holding a write
+        lock, ``fn`` modifies a copy, and ``compare_and_swap`` writes it back.
+        If another writer got there first, the record is read again and
+        ``fn`` re-applied, so ``fn`` must only depend on the record it is given.
+
+        Args:
+            username (str): Username of the record to modify
+            fn (callable): Function called with the record dict; it modifies the
+                record in place
+
+        Returns:
+            dict: The updated record, or None if the user doesn't exist
+
+        Raises:
+            VersionConflict: If every attempt lost to a concurrent write
+        """
+        for attempt in range(CAS_RETRIES):
+            record = self.get(username)
+            if record is None:
+                return None
+            version = record_version(record)
+            fn(record)
+            written = self.compare_and_swap(username, version, record)
+            if written is None:
+                return None
+            if written:
+                return record
+            lock_metrics(self.path).record_conflict()
+            # Back off so the writers that collided don't collide again
+            time.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 6)))
+        raise VersionConflict(f"Gave up updating user {username} after {CAS_RETRIES} conflicting writes")
+
+    def delete(self, username):
+        """Delete a user record.
+
+        Args:
+            username (str): Username to delete
+
+        Returns:
+            bool: True if a record was deleted, False if it didn't exist
+        """
+        raise NotImplementedError
+
+    def iter_users(self):
+        """Iterate over all user records.
+
+        Yields:
+            tuple: (username, record) pairs
+        """
+        for username, record in self.load_all().items():
+            yield username, record
+
+    def count(self):
+        """Count the stored users.
+
+        Returns:
+            int: Number of users
+        """
+        return len(self.load_all())
+
+    def find_by_email(self, email):
+        """Find the user registered with an email address.
+
+        Emails are compared case-insensitively.
+
+        Args:
+            email (str): Email address to look up
+
+        Returns:
+            str: Username, or None if no user has that email
+        """
+        key = UserIndex.key(email)
+        for username, record in self.iter_users():
+            if UserIndex.key(record.get('email')) == key:
+                return username
+        return None
+
+    def find_by_agency(self, agency):
+        """Find all users registered with an agency.
+
+        Agency names are compared case-insensitively.
+
+        Args:
+            agency (str): Agency name
+
+        Returns:
+            list: Usernames, sorted
+        """
+        key = UserIndex.key(agency)
+        return sorted(
+            username for username, record in self.iter_users()
+            if UserIndex.key(record.get('agency')) == key
+        )
+
+    def created_between(self, start=None, end=None):
+        """Find users whose ``created_at`` falls in ``[start, end)``.
+
+        Users without a ``created_at`` are never returned.
+
+        Args:
+            start (str or datetime, optional): Inclusive lower bound
+            end (str or datetime, optional): Exclusive upper bound
+
+        Returns:
+            list: Usernames, oldest registration first
+        """
+        start, end = UserIndex.bound(start), UserIndex.bound(end)
+        matches = sorted(
+            (record['created_at'], username)
+            for username, record in self.iter_users() if record.get('created_at')
+        )
+        return [
+            username for created, username in matches
+            if (start is None or created >= start) and (end is None or created < end)
+        ]
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        """Get one page of the users matching some filters.
+
+        Backends answer this from their indexes, reading only the records on
+        the requested page.
+
+        Args:
+            agency (str, optional): Only users of this agency, compared
+                case-insensitively
+            min_progress (int, optional): Only users whose lesson progress
+                (the highest lesson id reached) is at least this
+            max_progress (int, optional): Only users whose lesson progress
+                is at most this
+            start (str or datetime, optional): Only users registered at or
+                after this time
+            end (str or datetime, optional): Only users registered before
+                this time
+            sort (str, optional): One of ``QUERY_SORTS``; ties are broken by
+                username
+            descending (bool, optional): Sort largest first
+            offset (int, optional): Matching users to skip
+            limit (int, optional): Maximum users to return; 0 just counts
+
+        Returns:
+            tuple: (list of (username, record) pairs, total number of
+            matching users)
+        """
+        db = dict(self.iter_users())
+        usernames, total = UserIndex.build(db).query(
+            agency, min_progress, max_progress, start, end, sort, descending, offset, limit
+        )
+        return [(username, db[username]) for username in usernames], total
+
+    def aggregates(self):
+        """Get running counts over all users for the admin dashboard.
+
+        Backends keep these up to date as records are written, so reading
+        them doesn't depend on the number of users; this default counts
+        every record.
+
+        Returns:
+            UserAggregates: Counts as of now
+        """
+        return UserAggregates.build(record for _, record in self.iter_users())
+
+    def data_version(self):
+        """Get a token that changes whenever any user record is written.
+
+        Results computed over every user can be cached against it.
+
+        Returns:
+            object: Hashable token, or None if the backend can't tell, in
+            which case nothing should be cached
+        """
+        return None
+
+    def snapshot(self, dest):
+        """Copy the store's files, as of one point in time, into a directory.
+
+        Writers are held off only while files are hard-linked or a few
+        appended bytes are copied, never while a backup is compressed.
+
+        Args:
+            dest (str): Directory to create the copy in
+
+        Returns:
+            tuple: Names of the top-level files and directories written to
+            ``dest``, and the number of users in the copy
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """Get backend statistics for the debug page.
+
+        Returns:
+            dict: Backend-specific counters
+        """
+        return {}
+
+    def close(self):
+        """Release any resources held by the backend."""
+        pass
+
+class UserIndex:
+    """In-memory secondary indexes over user records.
+
+    Maps email to username, agency to a set of usernames, and keeps
+    ``(created_at, username)`` pairs in a sorted list for range queries.
+    Each user's lesson progress is kept alongside, so ``query`` can filter,
+    sort and count users without touching their records. Emails and
+    agencies are indexed case-insensitively. Backends that hold their
+    records (or an index log) in memory keep one of these up to date as
+    records are added, changed and removed.
+    """
+
+    def __init__(self):
+        self._fields = {}
+        self._emails = {}
+        self._agencies = {}
+        self._created = []
+
+    @staticmethod
+    def key(value):
+        """Normalize an email or agency for lookups."""
+        return (value or '').strip().lower()
+
+    @staticmethod
+    def bound(value):
+        """Turn a datetime range bound into the ISO string stored in records."""
+        if value is None or isinstance(value, str):
+            return value
+        return value.isoformat()
+
+    @classmethod
+    def fields(cls, record):
+        """Get the indexed fields of a record.
+
+        Args:
+            record (dict): User record
+
+        Returns:
+            tuple: (email, agency, created_at, lesson_progress) as stored in the index
+        """
+        return (
+            record.get('email') or '', record.get('agency') or '', record.get('created_at') or '',
+            int(record.get('lesson_progress') or 0)
+        )
+
+    @classmethod
+    def build(cls, db):
+        """Index every record in a ``{username: record}`` dict.
+
+        Args:
+            db (dict): User records
+
+        Returns:
+            UserIndex: New index
+        """
+        index = cls()
+        for username, record in db.items():
+            email, agency, created_at, _ = fields = cls.fields(record)
+            index._fields[username] = fields
+            if email:
+                index._emails[cls.key(email)] = username
+            index._agencies.setdefault(cls.key(agency), set()).add(username)
+            if created_at:
+                index._created.append((created_at, username))
+        index._created.sort()
+        return index
+
+    def add(self, username, email, agency, created_at, lesson_progress=0):
+        """Add or replace a user's entry.
+
+        Args:
+            username (str): Username
+            email (str): Email address
+            agency (str): Agency name
+            created_at (str): ISO registration time
+            lesson_progress (int, optional): Highest lesson id reached
+        """
+        if username in self._fields:
+            self.remove(username)
+        self._fields[username] = (email, agency, created_at, lesson_progress)
+        if email:
+            self._emails[self.key(email)] = username
+        self._agencies.setdefault(self.key(agency), set()).add(username)
+        if created_at:
+            bisect.insort(self._created, (created_at, username))
+
+    def remove(self, username):
+        """Remove a user's entry if present.
+
+        Args:
+            username (str): Username
+        """
+        fields = self._fields.pop(username, None)
+        if fields is None:
+            return
+        email, agency, created_at, _ = fields
+        if email and self._emails.get(self.key(email)) == username:
+            del self._emails[self.key(email)]
+        members = self._agencies.get(self.key(agency))
+        if members is not None:
+            members.discard(username)
+            if not members:
+                del self._agencies[self.key(agency)]
+        i = bisect.bisect_left(self._created, (created_at, username))
+        if i < len(self._created) and self._created[i] == (created_at, username):
+            del self._created[i]
+
+    def usernames(self):
+        """Get all indexed usernames."""
+        return list(self._fields)
+
+    def items(self):
+        """Get ``(username, (email, agency, created_at, lesson_progress))`` pairs."""
+        return self._fields.items()
+
+    def by_email(self, email):
+        return self._emails.get(self.key(email))
+
+    def by_agency(self, agency):
+        return sorted(self._agencies.get(self.key(agency), ()))
+
+    def created_between(self, start=None, end=None):
+        start, end = self.bound(start), self.bound(end)
+        lo = 0 if start is None else bisect.bisect_left(self._created, (start,))
+        hi = len(self._created) if end is None else bisect.bisect_left(self._created, (end,))
+        return [username for _, username in self._created[lo:hi]]
+
+    def query(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+              sort='created_at', descending=False, offset=0, limit=50):
+        """Filter, sort and page users using only the index.
+
+        Arguments are as for ``StorageBackend.query_users``.
+
+        Returns:
+            tuple: (usernames on the requested page, number of matching users)
+        """
+        if sort not in QUERY_SORTS:
+            raise ValueError(f"Cannot sort users by {sort!r}")
+        start, end = self.bound(start), self.bound(end)
+        # Start from the narrowest index available, then check the rest
+        if agency is not None:
+            candidates = self._agencies.get(self.key(agency), ())
+        elif start is not None or end is not None:
+            candidates = self.created_between(start, end)
+        else:
+            candidates = self._fields
+        matches = []
+        for username in candidates:
+            fields = self._fields[username]
+            created_at, progress = fields[2], fields[3]
+            if min_progress is not None and progress < min_progress:
+                continue
+            if max_progress is not None and progress > max_progress:
+                continue
+            if start is not None or end is not None:
+                if not created_at or (start is not None and created_at < start) or (end is not None and created_at >= end):
+                    continue
+            matches.append(username)
+
+        if sort == 'username':
+            sort_key = None
+        else:
+            column = QUERY_SORTS.index(sort) - 1
+            normalize = self.key if sort in ('email', 'agency') else (lambda value: value)
+            fields = self._fields
+            sort_key = lambda username: (normalize(fields[username][column]), username)
+        # Only the rows up to the end of the page need to be ordered
+        wanted = max(offset, 0) + max(limit, 0)
+        pick = heapq.nlargest if descending else heapq.nsmallest
+        return pick(wanted, matches, key=sort_key)[max(offset, 0):], len(matches)
+
+    def __contains__(self, username):
+        return username in self._fields
+
+    def __len__(self):
+        return len(self._fields)
+
+def _write_atomic(path, data):
+    """Write bytes to a file so readers see either the old or the new contents.
+
+    Args:
+        path (str): Destination file
+        data (bytes): New file contents
+    """
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _link_or_copy(src, dst):
+    """Put a file into a snapshot by hard-linking it, or copying if that fails.
+
+    Only use this for files that are replaced with ``_write_atomic`` rather
+    than modified in place: the link keeps the old contents after a writer
+    swaps in a new file. The destination directory must exist.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _copy_prefix(src, dst, size):
+    """Copy the first ``size`` bytes of an append-only file into a snapshot."""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while size > 0:
+            chunk = fin.read(min(size, 1024 * 1024))
+            if not chunk:
+                break
+            fout.write(chunk)
+            size -= len(chunk)
+
+class UserAggregates:
+    """Running counts over all user records, for the admin dashboard.
+
+    Counts are kept as a flat ``{key: count}`` mapping so any backend can
+    store and combine them: ``users``, ``agency:<agency>``,
+    ``progress:<lesson progress>`` (the highest lesson id reached),
+    ``lesson:<lesson id>`` (users who completed it) and
+    ``quiz:<quiz id>:<bucket>`` (users whose best score falls in that
+    tenth; 100 has a bucket of its own). Writes add
+    ``delta(old, new)``, so keeping the counts current costs O(record), not
+    a pass over every user. Backends that store the counts also keep
+    ``changes``, the number of writes since they were first counted, which
+    serves as their ``data_version``.
+    """
+
+    # Score buckets per quiz: 0-9, 10-19, ..., 90-99 and 100
+    SCORE_BUCKETS = 11
+
+    def __init__(self, counts=None):
+        self.counts = collections.Counter(counts or {})
+
+    @classmethod
+    def keys(cls, record):
+        """Get the counters a record contributes one to.
+
+        Args:
+            record (dict): User record
+
+        Returns:
+            list: Counter keys
+        """
+        keys = [
+            'users',
+            f"agency:{UserIndex.key(record.get('agency'))}",
+            f"progress:{int(record.get('lesson_progress') or 0)}",
+        ]
+        keys += [f"lesson:{lesson}" for lesson in set(record.get('completed_lessons') or [])]
+        for quiz_id, result in (record.get('quiz_scores') or {}).items():
+            score = result.get('score', 0) if isinstance(result, dict) else result
+            bucket = min(max(int(float(score or 0) // 10), 0), cls.SCORE_BUCKETS - 1)
+            keys.append(f"quiz:{quiz_id}:{bucket}")
+        return keys
+
+    @classmethod
+    def delta(cls, old, new):
+        """Get the change in counts when a record is replaced.
+
+        Args:
+            old (dict): Previous record, or None for a new user
+            new (dict): New record, or None for a deleted user
+
+        Returns:
+            dict: ``{key: change}`` for counters that changed
+        """
+        delta = collections.Counter(cls.keys(new) if new is not None else ())
+        if old is not None:
+            delta.subtract(cls.keys(old))
+        return {key: change for key, change in delta.items() if change}
+
+    @classmethod
+    def build(cls, records):
+        """Count every record from scratch.
+
+        Args:
+            records (iterable): User records
+
+        Returns:
+            UserAggregates: New counts
+        """
+        aggregates = cls()
+        for record in records:
+            aggregates.counts.update(cls.keys(record))
+        return aggregates
+
+    def apply(self, delta):
+        """Add a ``delta`` to the counts."""
+        self.counts.update(delta)
+
+    def copy(self):
+        return UserAggregates(self.counts)
+
+    def summary(self, lesson_count):
+        """Group the counts for display.
+
+        Args:
+            lesson_count (int): Number of lessons in the course
+
+        Returns:
+            dict: ``users``, ``active`` (at least one lesson), ``completed``
+            (every lesson), ``agencies`` (``{agency: users}``, lower-cased),
+            ``lessons`` (``{lesson id: users who completed it}``) and
+            ``quizzes`` (``{quiz id: list of users per score bucket}``)
+        """
+        summary = {'users': self.counts['users'], 'active': 0, 'completed': 0, 'agencies': {}, 'lessons': {}, 'quizzes': {}}
+        for key, count in self.counts.items():
+            if count <= 0:
+                continue
+            kind, _, rest = key.partition(':')
+            if kind == 'progress':
+                if int(rest) > 0:
+                    summary['active'] += count
+                if int(rest) >= lesson_count:
+                    summary['completed'] += count
+            elif kind == 'agency':
+                summary['agencies'][rest] = count
+            elif kind == 'lesson':
+                summary['lessons'][int(rest) if rest.isdigit() else rest] = count
+            elif kind == 'quiz':
+                quiz_id, _, bucket = rest.rpartition(':')
+                histogram = summary['quizzes'].setdefault(quiz_id, [0] * self.SCORE_BUCKETS)
+                histogram[int(bucket)] += count
+        return summary
+
+class _LockMetrics:
+    """Wait and hold times for one lock file, shared by everything in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = {'shared': 0, 'exclusive': 0}
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+        self.conflicts = 0
+
+    def record(self, mode, waited, held):
+        """Record one lock acquisition.
+
+        Args:
+            mode (str): 'shared' or 'exclusive'
+            waited (float): Seconds spent waiting for the lock
+            held (float): Seconds the lock was held
+        """
+        with self._lock:
+            self.acquisitions[mode] += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            self.hold_total += held
+            self.hold_max = max(self.hold_max, held)
+
+    def record_conflict(self):
+        """Record an optimistic update that lost to a concurrent write and was retried."""
+        with self._lock:
+            self.conflicts += 1
+
+    def snapshot(self):
+        """Get the current counters.
+
+        Returns:
+            dict: Acquisition counts and wait/hold times in milliseconds
+        """
+        with self._lock:
+            total = sum(self.acquisitions.values()) or 1
+            return {
+                'lock_shared': self.acquisitions['shared'],
+                'lock_exclusive': self.acquisitions['exclusive'],
+                'lock_wait_avg_ms': round(self.wait_total / total * 1000, 3),
+                'lock_wait_max_ms': round(self.wait_max * 1000, 3),
+                'lock_hold_avg_ms': round(self.hold_total / total * 1000, 3),
+                'lock_hold_max_ms': round(self.hold_max * 1000, 3),
+                'version_conflicts': self.conflicts,
+            }
+
+_lock_metrics = {}
+_lock_metrics_guard = threading.Lock()
+
+def lock_metrics(path):
+    """Get the lock metrics for a database path.
+
+    Args:
+        path (str): Database path
+
+    Returns:
+        _LockMetrics: Metrics shared by all locks on that path in this process
+    """
+    with _lock_metrics_guard:
+        return _lock_metrics.setdefault(path, _LockMetrics())
+
+@contextlib.contextmanager
+def file_lock(path, exclusive=False, metrics_key=None):
+    """Hold an advisory lock on ``<path>.lock`` for the duration of a block.
+
+    Uses ``flock`` on a freshly opened descriptor, so the lock excludes other
+    threads in this process as well as other processes. Without fcntl (e.g. on
+    Windows) the block runs unlocked.
+
+    Args:
+        path (str): Database path to lock
+        exclusive (bool, optional): Take an exclusive (write) lock instead of a
+            shared (read) lock
+        metrics_key (str, optional): Path to record lock metrics under;
+            defaults to ``path``
+    """
+    metrics = lock_metrics(metrics_key or path)
+    start = time.perf_counter()
+    fd = os.open(f"{path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        acquired = time.perf_counter()
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            metrics.record(
+                'exclusive' if exclusive else 'shared',
+                acquired - start,
+                time.perf_counter() - acquired
+            )
+    finally:
+        os.close(fd)
+
+class _ParsedFileCache:
+    """Process-wide cache of parsed database files.
+
+    Entries are keyed by path and validated against the file's inode, mtime
+    and size, so a change made by another process is picked up on the next
+    read. Writers in this process call ``invalidate`` after saving.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, parse):
+        """Get the parsed contents of a file, parsing it only if it changed.
+
+        The returned object is shared; callers must copy it before modifying.
+
+        Args:
+            path (str): File to read
+            parse (callable): Function that takes the file's bytes and returns its contents
+
+        Returns:
+            object: Parsed file contents
+        """
+        with open(path, 'rb') as f:
+            # fstat the open file so the key always matches what would be parsed
+            st = os.fstat(f.fileno())
+            key = (st.st_ino, st.st_mtime_ns, st.st_size)
+            with self._lock:
+                entry = self._entries.get(path)
+                if entry is not None and entry[0] == key:
+                    self.hits += 1
+                    return entry[1]
+                self.misses += 1
+            data = parse(f.read())
+        with self._lock:
+            self._entries[path] = (key, data)
+        return data
+
+    def invalidate(self, path):
+        """Drop the cached contents of a file.
+
+        Args:
+            path (str): File whose entry should be dropped
+        """
+        with self._lock:
+            self._entries.pop(path, None)
+
+    def stats(self):
+        """Get cache hit/miss counters.
+
+        Returns:
+            dict: Hits, misses and number of cached files
+        """
+        with self._lock:
+            return {
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cached_files': len(self._entries),
+            }
+
+_file_cache = _ParsedFileCache()
+
+class FileStorage(StorageBackend):
+    """Store all users in a single YAML or JSON file.
+
+    Every write rewrites the whole file, so this is only suitable for small
+    deployments and local development. Parsed contents are cached per process
+    and only re-parsed when the file changes on disk.
+
+    Reads hold a shared lock and read-modify-write cycles an exclusive lock on
+    ``<path>.lock``; the file is replaced atomically, so several server
+    processes can share one database without losing updates.
+    """
+
+    name = "file"
+
+    def __init__(self, path, fmt=None):
+        """Open (or create) a single-file user store.
+
+        Args:
+            path (str): Path to the database file
+            fmt (str, optional): 'yaml' or 'json'; see ``format_for_path``
+        """
+        self.path = path
+        self.format = format_for_path(path, fmt)
+        self._indexed_db = None
+        self._user_index = None
+        self._aggregated_db = None
+        self._aggregates = None
+        self._user_index_lock = threading.Lock()
+        if not os.path.exists(self.path):
+            with file_lock(self.path, exclusive=True):
+                if not os.path.exists(self.path):
+                    _write_atomic(self.path, self.format.dumps({}))
+                    logger.info(f"Created new user database at {self.path}")
+
+    def _read(self):
+        """Get the shared parsed database; the caller must hold a lock."""
+        return _file_cache.get(self.path, self.format.loads)
+
+    def _get_index(self):
+        """Get indexes for the current file contents; the caller must hold a lock.
+
+        The index is rebuilt only when the parsed file changes, i.e. after a
+        write, at no more than the cost of the re-parse that came before it.
+        """
+        db = self._read()
+        with self._user_index_lock:
+            if db is not self._indexed_db:
+                self._user_index = UserIndex.build(db)
+                self._indexed_db = db
+            return self._user_index
+
+    def _get_aggregates(self):
+        """Get counts for the current file contents; the caller must hold a lock.
+
+        Like the index, they are recounted only after the file changes.
+        """
+        db = self._read()
+        with self._user_index_lock:
+            if db is not self._aggregated_db:
+                self._aggregates = UserAggregates.build(db.values())
+                self._aggregated_db = db
+            return self._aggregates
+
+    def _write(self, db):
+        """Atomically replace the database file; the caller must hold the exclusive lock."""
+        try:
+            _write_atomic(self.path, self.format.dumps(db))
+        finally:
+            _file_cache.invalidate(self.path)
+
+    def load_all(self):
+        with file_lock(self.path):
+            return copy.deepcopy(self._read())
+
+    def save_all(self, db):
+        with file_lock(self.path, exclusive=True):
+            self._write(db)
+
+    def get(self, username):
+        with file_lock(self.path):
+            record = self._read().get(username)
+            return copy.deepcopy(record) if record is not None else None
+
+    def exists(self, username):
+        with file_lock(self.path):
+            return username in self._read()
+
+    def count(self):
+        with file_lock(self.path):
+            return len(self._read())
+
+    def iter_users(self):
+        # The cached dict is replaced, never modified, on write, so it can be
+        # walked after the lock is released; records are copied one at a time
+        with file_lock(self.path):
+            db = self._read()
+        for username, record in db.items():
+            yield username, copy.deepcopy(record)
+
+    def find_by_email(self, email):
+        with file_lock(self.path):
+            return self._get_index().by_email(email)
+
+    def find_by_agency(self, agency):
+        with file_lock(self.path):
+            return self._get_index().by_agency(agency)
+
+    def created_between(self, start=None, end=None):
+        with file_lock(self.path):
+            return self._get_index().created_between(start, end)
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        with file_lock(self.path):
+            db = self._read()
+            usernames, total = self._get_index().query(
+                agency, min_progress, max_progress, start, end, sort, descending, offset, limit
+            )
+        return [(username, copy.deepcopy(db[username])) for username in usernames], total
+
+    def aggregates(self):
+        with file_lock(self.path):
+            return self._get_aggregates().copy()
+
+    def data_version(self):
+        # Every write replaces the file; the same key as _ParsedFileCache
+        with file_lock(self.path):
+            st = os.stat(self.path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def stats(self):
+        stats = _file_cache.stats()
+        stats.update(lock_metrics(self.path).snapshot())
+        stats['format'] = self.format.name
+        return stats
+
+    def snapshot(self, dest):
+        # Writes replace the file, so linking it under the shared lock
+        # captures one complete version
+        name = os.path.basename(self.path)
+        os.makedirs(dest, exist_ok=True)
+        with file_lock(self.path):
+            _link_or_copy(self.path, os.path.join(dest, name))
+            users = len(self._read())
+        return [name], users
+
+    def insert(self, username, record):
+        with file_lock(self.path, exclusive=True):
+            db = copy.deepcopy(self._read())
+            if username in db:
+                return False
+            db[username] = record
+            self._write(db)
+            return True
+
+    def insert_many(self, records):
+        with file_lock(self.path, exclusive=True):
+            db = copy.deepcopy(self._read())
+            inserted = [username for username in records if username not in db]
+            for username in inserted:
+                db[username] = records[username]
+            if inserted:
+                self._write(db)
+            return inserted
+
+    def compare_and_swap(self, username, version, record):
+        with file_lock(self.path, exclusive=True):
+            db = self._read()
+            if username not in db:
+                return None
+            if record_version(db[username]) != version:
+                return False
+            record['version'] = version + 1
+            # The cached dict is never modified in place, so a shallow copy
+            # with the one record replaced is enough
+            db = dict(db)
+            db[username] = record
+            self._write(db)
+            return True
+
+    def mutate(self, username, fn):
+        # Every write rewrites the whole file under the exclusive lock anyway,
+        # so applying fn under that lock costs nothing extra, whereas retrying
+        # optimistically would re-parse the file on every conflict
+        with file_lock(self.path, exclusive=True):
+            db = self._read()
+            if username not in db:
+                return None
+            record = copy.deepcopy(db[username])
+            fn(record)
+            record['version'] = record_version(db[username]) + 1
+            db = dict(db)
+            db[username] = record
+            self._write(db)
+            return record
+
+    def delete(self, username):
+        with file_lock(self.path, exclusive=True):
+            db = copy.deepcopy(self._read())
+            if username not in db:
+                return False
+            del db[username]
+            self._write(db)
+            return True
+
+class JournaledFileStorage(StorageBackend):
+    """YAML/JSON snapshot plus an append-only journal of per-user changes.
+
+    Each mutation appends one line to ``<path>.journal`` holding the full new
+    record for that user (or a deletion marker), so a write costs O(record)
+    instead of re-dumping every user. A background thread periodically folds
+    the journal into the snapshot, which stays a plain file that the ``file``
+    backend can read.
+
+    Journal lines look like ``<crc32 hex> <json>``. Replay stops at the first
+    line that is incomplete or fails its checksum, so a crash mid-append only
+    loses the record being written. Appends and compaction hold an exclusive
+    lock on ``<path>.lock`` and reads a shared one, as in FileStorage.
+    """
+
+    name = "journal"
+
+    def __init__(self, path, fmt=None, compact_bytes=1024 * 1024, fsync=False):
+        """Open (or create) a journaled store.
+
+        Args:
+            path (str): Path to the snapshot file
+            fmt (str, optional): Snapshot format, 'yaml' or 'json'
+            compact_bytes (int, optional): Journal size that triggers compaction
+            fsync (bool, optional): fsync the journal after every append
+        """
+        self.path = path
+        self.format = format_for_path(path, fmt)
+        self.journal_path = f"{path}.journal"
+        self.compact_bytes = compact_bytes
+        self.fsync = fsync
+        self._lock = threading.RLock()
+        self._db = {}
+        self._user_index = UserIndex()
+        self._aggregates = UserAggregates()
+        self._journal_ino = None
+        self._journal_offset = 0
+        with self._locked(exclusive=True):
+            if not os.path.exists(self.path):
+                _write_atomic(self.path, self.format.dumps({}))
+                logger.info(f"Created new user database at {self.path}")
+            if not os.path.exists(self.journal_path):
+                open(self.journal_path, 'ab').close()
+            self._reload(recover=True)
+        _Compactor.register(self)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive=False):
+        """Hold the in-process lock and the cross-process file lock."""
+        with self._lock, file_lock(self.path, exclusive):
+            yield
+
+    @staticmethod
+    def _encode(entry):
+        payload = json.dumps(entry, separators=(',', ':')).encode('utf-8')
+        return b'%08x %s\n' % (zlib.crc32(payload), payload)
+
+    def _apply(self, entry):
+        if entry['op'] == 'put':
+            old = self._db.get(entry['user'])
+            self._db[entry['user']] = entry['record']
+            self._user_index.add(entry['user'], *UserIndex.fields(entry['record']))
+            self._aggregates.apply(UserAggregates.delta(old, entry['record']))
+        elif entry['op'] == 'del':
+            old = self._db.pop(entry['user'], None)
+            self._user_index.remove(entry['user'])
+            self._aggregates.apply(UserAggregates.delta(old, None))
+
+    def _replay(self, f):
+        """Apply complete journal records from the current file position.
+
+        Args:
+            f (file): Journal opened in binary mode
+
+        Returns:
+            int: Offset just past the last valid record
+        """
+        offset = f.tell()
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                checksum, payload = line[:-1].split(b' ', 1)
+                if int(checksum, 16) != zlib.crc32(payload):
+                    break
+                entry = json.loads(payload)
+            except ValueError:
+                break
+            self._apply(entry)
+            offset += len(line)
+        return offset
+
+    def _reload(self, recover=False):
+        """Rebuild the in-memory state from the snapshot and the journal.
+
+        Args:
+            recover (bool, optional): Truncate a torn or corrupt journal tail
+        """
+        with open(self.path, 'rb') as f:
+            self._db = self.format.loads(f.read())
+        self._user_index = UserIndex.build(self._db)
+        self._aggregates = UserAggregates.build(self._db.values())
+        with open(self.journal_path, 'rb') as f:
+            self._journal_ino = os.fstat(f.fileno()).st_ino
+            self._journal_offset = self._replay(f)
+            size = os.fstat(f.fileno()).st_size
+        if recover and size > self._journal_offset:
+            logger.warning(
+                f"Discarding {size - self._journal_offset} bytes of incomplete journal "
+                f"data in {self.journal_path}"
+            )
+            with open(self.journal_path, 'r+b') as f:
+                f.truncate(self._journal_offset)
+
+    def _refresh(self):
+        """Pick up journal records appended since the last read."""
+        try:
+            st = os.stat(self.journal_path)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != self._journal_ino or st.st_size < self._journal_offset:
+            # The journal was compacted and replaced
+            self._reload()
+        elif st.st_size > self._journal_offset:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                self._journal_offset = self._replay(f)
+
+    def _append(self, *entries):
+        data = b''.join(self._encode(entry) for entry in entries)
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            if self.fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        # Replay from our last offset rather than applying the entry directly;
+        # another process may have appended just before us
+        self._refresh()
+
+    def compact(self):
+        """Fold the journal into the snapshot and start a fresh journal."""
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._write_snapshot(self._db)
+
+    def _write_snapshot(self, db):
+        _write_atomic(self.path, self.format.dumps(db))
+        # Replace rather than truncate the journal so other readers notice the new inode
+        _write_atomic(self.journal_path, b'')
+        if db is not self._db:
+            self._db = db
+            self._user_index = UserIndex.build(db)
+            self._aggregates = UserAggregates.build(db.values())
+        self._journal_ino = os.stat(self.journal_path).st_ino
+        self._journal_offset = 0
+        logger.info(f"Compacted user database journal into {self.path}")
+
+    def needs_compaction(self):
+        """Check whether the journal has grown past the compaction threshold.
+
+        Returns:
+            bool: True if the journal should be compacted
+        """
+        try:
+            return os.path.getsize(self.journal_path) >= self.compact_bytes
+        except OSError:
+            return False
+
+    def load_all(self):
+        with self._locked():
+            self._refresh()
+            return copy.deepcopy(self._db)
+
+    def save_all(self, db):
+        with self._locked(exclusive=True):
+            self._write_snapshot(copy.deepcopy(db))
+
+    def get(self, username):
+        with self._locked():
+            self._refresh()
+            record = self._db.get(username)
+            return copy.deepcopy(record) if record is not None else None
+
+    def exists(self, username):
+        with self._locked():
+            self._refresh()
+            return username in self._db
+
+    def insert(self, username, record):
+        with self._locked(exclusive=True):
+            self._refresh()
+            if username in self._db:
+                return False
+            self._append({'op': 'put', 'user': username, 'record': record})
+            return True
+
+    def insert_many(self, records):
+        with self._locked(exclusive=True):
+            self._refresh()
+            inserted = [username for username in records if username not in self._db]
+            if inserted:
+                self._append(*(
+                    {'op': 'put', 'user': username, 'record': records[username]}
+                    for username in inserted
+                ))
+            return inserted
+
+    def compare_and_swap(self, username, version, record):
+        with self._locked(exclusive=True):
+            self._refresh()
+            if username not in self._db:
+                return None
+            if record_version(self._db[username]) != version:
+                return False
+            record['version'] = version + 1
+            self._append({'op': 'put', 'user': username, 'record': record})
+            return True
+
+    def delete(self, username):
+        with self._locked(exclusive=True):
+            self._refresh()
+            if username not in self._db:
+                return False
+            self._append({'op': 'del', 'user': username})
+            return True
+
+    def count(self):
+        with self._locked():
+            self._refresh()
+            return len(self._db)
+
+    def iter_users(self):
+        # Replay replaces records rather than modifying them, so a snapshot of
+        # the (username, record) pairs stays valid after the lock is released
+        with self._locked():
+            self._refresh()
+            items = list(self._db.items())
+        for username, record in items:
+            yield username, copy.deepcopy(record)
+
+    def find_by_email(self, email):
+        with self._locked():
+            self._refresh()
+            return self._user_index.by_email(email)
+
+    def find_by_agency(self, agency):
+        with self._locked():
+            self._refresh()
+            return self._user_index.by_agency(agency)
+
+    def created_between(self, start=None, end=None):
+        with self._locked():
+            self._refresh()
+            return self._user_index.created_between(start, end)
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        with self._locked():
+            self._refresh()
+            usernames, total = self._user_index.query(
+                agency, min_progress, max_progress, start, end, sort, descending, offset, limit
+            )
+            page = [(username, self._db[username]) for username in usernames]
+        return [(username, copy.deepcopy(record)) for username, record in page], total
+
+    def aggregates(self):
+        with self._locked():
+            self._refresh()
+            return self._aggregates.copy()
+
+    def data_version(self):
+        # Writes append to the journal; compaction replaces both files
+        with self._locked():
+            snapshot, journal = os.stat(self.path), os.stat(self.journal_path)
+        return (snapshot.st_ino, snapshot.st_mtime_ns, journal.st_ino, journal.st_size)
+
+    def stats(self):
+        stats = lock_metrics(self.path).snapshot()
+        try:
+            stats['journal_bytes'] = os.path.getsize(self.journal_path)
+        except OSError:
+            pass
+        return stats
+
+    def snapshot(self, dest):
+        # The snapshot file is only ever replaced, and the journal is appended
+        # to under the exclusive lock, so the shared lock pins both; the
+        # journal is small (see compact_bytes)
+        name = os.path.basename(self.path)
+        os.makedirs(dest, exist_ok=True)
+        with self._locked():
+            self._refresh()
+            _link_or_copy(self.path, os.path.join(dest, name))
+            _copy_prefix(
+                self.journal_path, os.path.join(dest, name + '.journal'),
+                os.path.getsize(self.journal_path)
+            )
+            users = len(self._db)
+        return [name, name + '.journal'], users
+
+class _Compactor:
+    """Single daemon thread that compacts journaled stores in the background."""
+
+    interval = 30
+    _stores = weakref.WeakSet()
+    _thread = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def register(cls, store):
+        """Add a store to the set checked by the compactor thread.
+
+        Args:
+            store (JournaledFileStorage): Store to compact periodically
+        """
+        with cls._lock:
+            cls._stores.add(store)
+            if cls._thread is None:
+                cls._thread = threading.Thread(target=cls._run, name="user-db-compactor", daemon=True)
+                cls._thread.start()
+
+    @classmethod
+    def _run(cls):
+        while True:
+            time.sleep(cls.interval)
+            for store in list(cls._stores):
+                try:
+                    if store.needs_compaction():
+                        store.compact()
+                except Exception as e:
+                    logger.error(f"Error compacting {store.path}: {e}")
+
+class SQLiteStorage(StorageBackend):
+    """Store users as one row each in a SQLite database running in WAL mode.
+
+    Point reads and updates only touch the affected row, and WAL lets readers
+    proceed while a writer is active. Records are kept as JSON documents so
+    the schema doesn't need to change when a user record gains a field.
+
+    Streamlit runs every rerun on a fresh thread, so connections are kept in
+    a small pool shared by all threads instead of one per thread.
+
+    Email, agency, registration time and lesson progress are indexed with
+    expression indexes over the JSON document, so lookups, filters and sorts
+    by them don't scan the table.
+
+    The ``version`` column mirrors the record's version stamp, so an
+    optimistic update is a single ``UPDATE ... WHERE version = ?``.
+
+    The ``aggregates`` table holds the dashboard counts (see
+    ``UserAggregates``), updated in the same transaction as each write.
+    """
+
+    EMAIL = "lower(trim(json_extract(data, '$.email')))"
+    AGENCY = "lower(trim(json_extract(data, '$.agency')))"
+    CREATED_AT = "json_extract(data, '$.created_at')"
+    PROGRESS = "coalesce(json_extract(data, '$.lesson_progress'), 0)"
+
+    name = "sqlite"
+
+    def __init__(self, path, pool_size=8):
+        """Open (or create) a SQLite user store.
+
+        Args:
+            path (str): Path to the SQLite database file
+            pool_size (int, optional): Maximum number of idle connections kept open
+        """
+        self.path = path
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "username TEXT PRIMARY KEY, "
+                "data TEXT NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS users_email ON users ({self.EMAIL})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS users_agency ON users ({self.AGENCY})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS users_created_at ON users ({self.CREATED_AT})")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS users_progress ON users ({self.PROGRESS})")
+            conn.execute("CREATE TABLE IF NOT EXISTS aggregates (key TEXT PRIMARY KEY, count INTEGER NOT NULL)")
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """Borrow a connection from the pool for the duration of a block.
+
+        Yields:
+            sqlite3.Connection: Connection in autocommit mode
+        """
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        """Run a block inside a write transaction.
+
+        ``BEGIN IMMEDIATE`` takes SQLite's write lock up front, so a
+        read-modify-write inside the block is atomic across processes. Time
+        spent waiting for and holding the lock is recorded in the lock metrics.
+
+        Yields:
+            sqlite3.Connection: Connection with the transaction open
+        """
+        with self._connection() as conn:
+            start = time.perf_counter()
+            conn.execute("BEGIN IMMEDIATE")
+            acquired = time.perf_counter()
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                lock_metrics(self.path).record('exclusive', acquired - start, time.perf_counter() - acquired)
+
+    @staticmethod
+    def _add_counts(conn, delta, changes=1):
+        """Add to the aggregate counts and count the write; the caller holds a transaction."""
+        conn.executemany(
+            "INSERT INTO aggregates (key, count) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET count = count + excluded.count",
+            list(delta.items()) + [('changes', changes)]
+        )
+
+    def load_all(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT username, data FROM users")
+            return {username: json.loads(data) for username, data in rows}
+
+    def save_all(self, db):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany(
+                "INSERT INTO users (username, data, version) VALUES (?, ?, ?)",
+                ((username, json.dumps(record), record_version(record)) for username, record in db.items())
+            )
+            # Keep counting changes, so data_version never repeats
+            conn.execute("DELETE FROM aggregates WHERE key != 'changes'")
+            self._add_counts(conn, UserAggregates.build(db.values()).counts)
+
+    def get(self, username):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT data FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def exists(self, username):
+        with self._connection() as conn:
+            row = conn.execute(
+                "SELECT 1 FROM users WHERE username = ?", (username,)
+            ).fetchone()
+        return row is not None
+
+    def insert(self, username, record):
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT INTO users (username, data, version) VALUES (?, ?, ?)",
+                    (username, json.dumps(record), record_version(record))
+                )
+                self._add_counts(conn, UserAggregates.delta(None, record))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def insert_many(self, records):
+        # One transaction for the whole batch
+        inserted = []
+        with self._transaction() as conn:
+            for username, record in records.items():
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO users (username, data, version) VALUES (?, ?, ?)",
+                    (username, json.dumps(record), record_version(record))
+                )
+                if cursor.rowcount:
+                    inserted.append(username)
+            if inserted:
+                self._add_counts(conn, UserAggregates.build(records[username] for username in inserted).counts)
+        return inserted
+
+    def compare_and_swap(self, username, version, record):
+        data = json.dumps(dict(record, version=version + 1))
+        with self._transaction() as conn:
+            # Read the current record in the transaction to count the change
+            row = conn.execute("SELECT data, version FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return None
+            if row[1] != version:
+                return False
+            conn.execute(
+                "UPDATE users SET data = ?, version = ? WHERE username = ?", (data, version + 1, username)
+            )
+            self._add_counts(conn, UserAggregates.delta(json.loads(row[0]), record))
+        record['version'] = version + 1
+        return True
+
+    def delete(self, username):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+            if row is None:
+                return False
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
+            self._add_counts(conn, UserAggregates.delta(json.loads(row[0]), None))
+        return True
+
+    def iter_users(self):
+        # The borrowed connection stays checked out until iteration finishes
+        with self._connection() as conn:
+            cursor = conn.execute("SELECT username, data FROM users ORDER BY username")
+            for username, data in cursor:
+                yield username, json.loads(data)
+
+    def count(self):
+        with self._connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def find_by_email(self, email):
+        with self._connection() as conn:
+            row = conn.execute(
+                f"SELECT username FROM users WHERE {self.EMAIL} = ? LIMIT 1", (UserIndex.key(email),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def find_by_agency(self, agency):
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT username FROM users WHERE {self.AGENCY} = ? ORDER BY username",
+                (UserIndex.key(agency),)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def created_between(self, start=None, end=None):
+        conditions, params = [f"{self.CREATED_AT} IS NOT NULL"], []
+        if start is not None:
+            conditions.append(f"{self.CREATED_AT} >= ?")
+            params.append(UserIndex.bound(start))
+        if end is not None:
+            conditions.append(f"{self.CREATED_AT} < ?")
+            params.append(UserIndex.bound(end))
+        with self._connection() as conn:
+            rows = conn.execute(
+                f"SELECT username FROM users WHERE {' AND '.join(conditions)} ORDER BY {self.CREATED_AT}, username", params
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        columns = {
+            'username': 'username', 'email': self.EMAIL, 'agency': self.AGENCY,
+            'created_at': self.CREATED_AT, 'lesson_progress': self.PROGRESS,
+        }
+        if sort not in columns:
+            raise ValueError(f"Cannot sort users by {sort!r}")
+        conditions, params = [], []
+        if agency is not None:
+            conditions.append(f"{self.AGENCY} = ?")
+            params.append(UserIndex.key(agency))
+        if min_progress is not None:
+            conditions.append(f"{self.PROGRESS} >= ?")
+            params.append(min_progress)
+        if max_progress is not None:
+            conditions.append(f"{self.PROGRESS} <= ?")
+            params.append(max_progress)
+        if start is not None:
+            conditions.append(f"{self.CREATED_AT} >= ?")
+            params.append(UserIndex.bound(start))
+        if end is not None:
+            conditions.append(f"{self.CREATED_AT} < ?")
+            params.append(UserIndex.bound(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "DESC" if descending else "ASC"
+        with self._connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM users {where}", params).fetchone()[0]
+            rows = conn.execute(
+                f"SELECT username, data FROM users {where} "
+                f"ORDER BY {columns[sort]} {direction}, username {direction} LIMIT ? OFFSET ?",
+                params + [max(limit, 0), max(offset, 0)]
+            ).fetchall() if limit > 0 else []
+        return [(username, json.loads(data)) for username, data in rows], total
+
+    def aggregates(self):
+        with self._connection() as conn:
+            rows = conn.execute("SELECT key, count FROM aggregates WHERE count != 0")
+            return UserAggregates(dict(rows))
+
+    def data_version(self):
+        with self._connection() as conn:
+            row = conn.execute("SELECT count FROM aggregates WHERE key = 'changes'").fetchone()
+        return row[0] if row else 0
+
+    def stats(self):
+        return lock_metrics(self.path).snapshot()
+
+    def snapshot(self, dest):
+        # The online backup API copies every page inside one read
+        # transaction; in WAL mode writers carry on meanwhile
+        name = os.path.basename(self.path)
+        os.makedirs(dest, exist_ok=True)
+        target = sqlite3.connect(os.path.join(dest, name))
+        try:
+            with self._connection() as conn:
+                conn.backup(target)
+            users = target.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        finally:
+            target.close()
+        return [name], users
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+class ShardedFileStorage(StorageBackend):
+    """Store each user in its own small JSON file under a hashed directory tree.
+
+    A user's record lives at ``<dir>/ab/cd/<sha1 of username>.json``, so
+    updating one officer never rewrites anyone else's data. Writes lock one of
+    256 lock stripes (chosen by hash) instead of the whole store, letting
+    independent users be written concurrently from different processes.
+
+    ``<dir>/index.log`` is an append-only log of
+    ``["+", username, email, agency, created_at, lesson_progress]`` and ``["-", username]``
+    entries, replayed into a ``UserIndex`` for counting, listing and lookups.
+    It is only appended to when a user is created or deleted or an indexed
+    field changes, and is rewritten once it holds mostly stale entries.
+
+    ``<dir>/stats.log`` is an append-only log of ``UserAggregates`` deltas,
+    folded into a single line of totals once it grows large.
+    """
+
+    # stats.log size that triggers folding it into one line of totals
+    STATS_REWRITE_BYTES = 512 * 1024
+
+    name = "sharded"
+
+    def __init__(self, path):
+        self.path = path.rstrip('/\\') or path
+        self.index_path = os.path.join(self.path, 'index.log')
+        self._lock = threading.RLock()
+        self._user_index = UserIndex()
+        self._index_ino = None
+        self._index_offset = 0
+        self._index_lines = 0
+        self.stats_path = os.path.join(self.path, 'stats.log')
+        self._aggregates = UserAggregates()
+        self._stats_file = None
+        self._stats_offset = 0
+        self._stats_lines = 0
+        os.makedirs(os.path.join(self.path, '.locks'), exist_ok=True)
+        if not os.path.exists(self.index_path):
+            open(self.index_path, 'ab').close()
+            logger.info(f"Created new sharded user database at {self.path}")
+        if not os.path.exists(self.stats_path):
+            self._build_aggregates()
+
+    @staticmethod
+    def _hash(username):
+        return hashlib.sha1(username.encode('utf-8')).hexdigest()
+
+    def _record_path(self, username):
+        digest = self._hash(username)
+        return os.path.join(self.path, digest[:2], digest[2:4], f"{digest}.json")
+
+    def _user_lock(self, username):
+        """Exclusive lock on the stripe that guards this user's record."""
+        stripe = os.path.join(self.path, '.locks', self._hash(username)[:2])
+        return file_lock(stripe, exclusive=True, metrics_key=self.path)
+
+    def _index_lock(self, exclusive=False):
+        return file_lock(self.index_path, exclusive, metrics_key=self.path)
+
+    def _stats_lock(self, exclusive=False):
+        return file_lock(self.stats_path, exclusive, metrics_key=self.path)
+
+    def _hold_all_stripes(self, stack):
+        """Take every stripe lock shared, holding off all record writes."""
+        for stripe in range(256):
+            stack.enter_context(file_lock(
+                os.path.join(self.path, '.locks', f"{stripe:02x}"), metrics_key=self.path
+            ))
+
+    def _read_record(self, username):
+        try:
+            with open(self._record_path(username), 'rb') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _write_record(self, username, record):
+        record_path = self._record_path(username)
+        os.makedirs(os.path.dirname(record_path), exist_ok=True)
+        _write_atomic(record_path, json.dumps(record, separators=(',', ':')).encode('utf-8'))
+
+    def _refresh_index(self):
+        """Apply index entries appended since the last read; the caller holds ``_lock``."""
+        try:
+            st = os.stat(self.index_path)
+        except FileNotFoundError:
+            return
+        if st.st_ino != self._index_ino or st.st_size < self._index_offset:
+            # The index was rewritten; start over
+            self._user_index = UserIndex()
+            self._index_ino = st.st_ino
+            self._index_offset = 0
+            self._index_lines = 0
+        if st.st_size == self._index_offset:
+            return
+        with open(self.index_path, 'rb') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                entry = json.loads(line)
+                if entry[0] == '+':
+                    self._user_index.add(*entry[1:])
+                else:
+                    self._user_index.remove(entry[1])
+                self._index_offset += len(line)
+                self._index_lines += 1
+
+    def _append_index(self, *entries):
+        """Append index entries; the caller holds the exclusive index lock."""
+        data = b''.join(json.dumps(list(entry)).encode('utf-8') + b'\n' for entry in entries)
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._refresh_index()
+            if self._index_lines > 2 * len(self._user_index) + 1000:
+                self._rewrite_index()
+
+    def _rewrite_index(self):
+        """Drop stale index entries; the caller holds both index locks."""
+        data = b''.join(
+            json.dumps(['+', username, *fields]).encode('utf-8') + b'\n'
+            for username, fields in self._user_index.items()
+        )
+        _write_atomic(self.index_path, data)
+        st = os.stat(self.index_path)
+        self._index_ino = st.st_ino
+        self._index_offset = st.st_size
+        self._index_lines = len(self._user_index)
+
+    def _build_aggregates(self):
+        """Count every record into a new ``stats.log``.
+
+        Runs when a store without one is opened: a new store, or one restored
+        from a snapshot, which leaves ``stats.log`` out. Record files are
+        counted straight from disk with every stripe locked, so no write can
+        be missed or counted twice.
+        """
+        def records():
+            for dirpath, dirnames, filenames in os.walk(self.path):
+                dirnames[:] = [d for d in dirnames if d != '.locks']
+                for filename in filenames:
+                    if filename.endswith('.json'):
+                        with open(os.path.join(dirpath, filename), 'rb') as f:
+                            yield json.loads(f.read())
+
+        with contextlib.ExitStack() as stack:
+            self._hold_all_stripes(stack)
+            stack.enter_context(self._stats_lock(exclusive=True))
+            if os.path.exists(self.stats_path):
+                return
+            counts = UserAggregates.build(records()).counts
+            _write_atomic(self.stats_path, json.dumps(dict(counts)).encode('utf-8') + b'\n')
+            logger.info(f"Counted {counts['users']} users into {self.stats_path}")
+
+    def _refresh_aggregates(self):
+        """Apply stats deltas appended since the last read; the caller holds ``_lock``."""
+        try:
+            st = os.stat(self.stats_path)
+        except FileNotFoundError:
+            return
+        if self._stats_file is None or os.fstat(self._stats_file.fileno()).st_ino != st.st_ino:
+            # New, or folded into totals; start over. The log is kept open so
+            # a later fold can't reuse its inode number unnoticed
+            self._open_stats()
+            self._aggregates = UserAggregates()
+            self._stats_offset = 0
+            self._stats_lines = 0
+        f = self._stats_file
+        f.seek(self._stats_offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            self._aggregates.apply(json.loads(line))
+            self._stats_offset += len(line)
+            self._stats_lines += 1
+
+    def _open_stats(self):
+        if self._stats_file is not None:
+            self._stats_file.close()
+        self._stats_file = open(self.stats_path, 'rb')
+
+    def _count_change(self, old, new):
+        """Log the change in aggregates; the caller holds the user's stripe lock.
+
+        Every write is logged, if only to count it in ``changes``. A change
+        made before ``stats.log`` exists is skipped, as ``_build_aggregates``
+        will count the record once it gets the lock.
+        """
+        self._log_counts(dict(UserAggregates.delta(old, new), changes=1))
+
+    def _log_counts(self, delta):
+        """Append a delta to ``stats.log``, if it exists, and fold the log when it is large."""
+        with self._stats_lock(exclusive=True):
+            try:
+                fd = os.open(self.stats_path, os.O_WRONLY | os.O_APPEND)
+            except FileNotFoundError:
+                return
+            try:
+                os.write(fd, json.dumps(delta).encode('utf-8') + b'\n')
+                size = os.fstat(fd).st_size
+            finally:
+                os.close(fd)
+            if size > self.STATS_REWRITE_BYTES:
+                with self._lock:
+                    self._refresh_aggregates()
+                    totals = {key: count for key, count in self._aggregates.counts.items() if count}
+                    _write_atomic(self.stats_path, json.dumps(totals).encode('utf-8') + b'\n')
+                    self._open_stats()
+                    self._stats_offset = os.fstat(self._stats_file.fileno()).st_size
+                    self._stats_lines = 1
+
+    def _usernames(self):
+        # Always take the file lock before the thread lock (see _append_index)
+        with self._index_lock(), self._lock:
+            self._refresh_index()
+            return self._user_index.usernames()
+
+    def load_all(self):
+        db = {}
+        for username, record in self.iter_users():
+            db[username] = record
+        return db
+
+    def save_all(self, db):
+        # Each record is replaced atomically, but not the set as a whole
+        for username in set(self._usernames()) - set(db):
+            self.delete(username)
+        for username, record in db.items():
+            if not self.insert(username, record):
+                self.mutate(username, lambda r, new=record: (r.clear(), r.update(new)))
+
+    def get(self, username):
+        return self._read_record(username)
+
+    def exists(self, username):
+        return os.path.exists(self._record_path(username))
+
+    def insert(self, username, record):
+        with self._user_lock(username):
+            if os.path.exists(self._record_path(username)):
+                return False
+            self._write_record(username, record)
+            self._count_change(None, record)
+        with self._index_lock(exclusive=True):
+            self._append_index(('+', username, *UserIndex.fields(record)))
+        return True
+
+    def insert_many(self, records):
+        inserted = []
+        counted = []
+        for username, record in records.items():
+            with self._user_lock(username):
+                if os.path.exists(self._record_path(username)):
+                    continue
+                self._write_record(username, record)
+                # Once stats.log exists it always will, so the batch's
+                # counts can be logged together afterwards
+                if os.path.exists(self.stats_path):
+                    counted.append(record)
+            inserted.append(username)
+        if counted:
+            self._log_counts(dict(UserAggregates.build(counted).counts, changes=len(counted)))
+        # One index append for the whole batch
+        if inserted:
+            with self._index_lock(exclusive=True):
+                self._append_index(*(
+                    ('+', username, *UserIndex.fields(records[username])) for username in inserted
+                ))
+        return inserted
+
+    def compare_and_swap(self, username, version, record):
+        with self._user_lock(username):
+            current = self._read_record(username)
+            if current is None:
+                return None
+            if record_version(current) != version:
+                return False
+            record['version'] = version + 1
+            self._write_record(username, record)
+            self._count_change(current, record)
+        if UserIndex.fields(record) != UserIndex.fields(current):
+            with self._index_lock(exclusive=True):
+                self._append_index(('+', username, *UserIndex.fields(record)))
+        return True
+
+    def delete(self, username):
+        with self._user_lock(username):
+            old = self._read_record(username)
+            if old is None:
+                return False
+            os.remove(self._record_path(username))
+            self._count_change(old, None)
+        with self._index_lock(exclusive=True):
+            self._append_index(('-', username))
+        return True
+
+    def iter_users(self):
+        for username in self._usernames():
+            record = self._read_record(username)
+            if record is not None:
+                yield username, record
+
+    def count(self):
+        return len(self._usernames())
+
+    def find_by_email(self, email):
+        with self._index_lock(), self._lock:
+            self._refresh_index()
+            return self._user_index.by_email(email)
+
+    def find_by_agency(self, agency):
+        with self._index_lock(), self._lock:
+            self._refresh_index()
+            return self._user_index.by_agency(agency)
+
+    def created_between(self, start=None, end=None):
+        with self._index_lock(), self._lock:
+            self._refresh_index()
+            return self._user_index.created_between(start, end)
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        with self._index_lock(), self._lock:
+            self._refresh_index()
+            usernames, total = self._user_index.query(
+                agency, min_progress, max_progress, start, end, sort, descending, offset, limit
+            )
+        page = []
+        for username in usernames:
+            record = self._read_record(username)
+            if record is not None:
+                page.append((username, record))
+        return page, total
+
+    def aggregates(self):
+        with self._stats_lock(), self._lock:
+            self._refresh_aggregates()
+            return self._aggregates.copy()
+
+    def data_version(self):
+        with self._stats_lock(), self._lock:
+            self._refresh_aggregates()
+            return self._aggregates.counts['changes']
+
+    def close(self):
+        with self._lock:
+            if self._stats_file is not None:
+                self._stats_file.close()
+                self._stats_file = None
+
+    def stats(self):
+        stats = lock_metrics(self.path).snapshot()
+        stats['index_entries'] = self._index_lines
+        stats['stats_entries'] = self._stats_lines
+        return stats
+
+    def snapshot(self, dest):
+        # The shared index lock holds off creating and deleting users
+        # throughout; shared locks on every stripe hold off updates only
+        # while the record files, which are only ever replaced, are linked
+        name = os.path.basename(self.path)
+        root = os.path.join(dest, name)
+        with contextlib.ExitStack() as stack:
+            stack.enter_context(self._index_lock())
+            with self._lock:
+                self._refresh_index()
+                usernames = self._user_index.usernames()
+            os.makedirs(root)
+            _copy_prefix(self.index_path, os.path.join(root, 'index.log'), os.path.getsize(self.index_path))
+            links = []
+            for username in usernames:
+                digest = self._hash(username)
+                links.append((
+                    os.path.join(self.path, digest[:2], digest[2:4], f"{digest}.json"),
+                    os.path.join(root, digest[:2], digest[2:4], f"{digest}.json"),
+                ))
+            for directory in {os.path.dirname(target) for _, target in links}:
+                os.makedirs(directory, exist_ok=True)
+
+            self._hold_all_stripes(stack)
+            users = 0
+            for source, target in links:
+                try:
+                    _link_or_copy(source, target)
+                except FileNotFoundError:
+                    # Deleted, with its index entry not yet appended
+                    continue
+                users += 1
+        # stats.log is left out: a user created just before the snapshot may
+        # be counted but not yet indexed, so the copy recounts its own records
+        # when it is first opened
+        return [name], users
+
+BACKENDS = {
+    'file': FileStorage,
+    'journal': JournaledFileStorage,
+    'sqlite': SQLiteStorage,
+    'sharded': ShardedFileStorage,
+}
+
+def backend_for_path(db_path):
+    """Guess the backend name from a database path.
+
+    Args:
+        db_path (str): Path to the database
+
+    Returns:
+        str: Backend name
+    """
+    if db_path.endswith(('.db', '.sqlite', '.sqlite3')):
+        return 'sqlite'
+    if db_path.endswith(('/', os.sep)) or os.path.isdir(db_path):
+        return 'sharded'
+    return 'file'
+
+def create_backend(db_path, backend=None, fmt=None):
+    """Create the storage backend for a database path.
+
+    The backend is chosen from the ``backend`` argument, then the
+    ``USER_DB_BACKEND`` environment variable, then the file extension.
+
+    Args:
+        db_path (str): Path to the database
+        backend (str, optional): Backend name (see ``BACKENDS``)
+        fmt (str, optional): Serialization format for the single-file and
+            journal backends (see ``format_for_path``)
+
+    Returns:
+        StorageBackend: Backend instance
+    """
+    name = backend or os.environ.get('USER_DB_BACKEND') or backend_for_path(db_path)
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown user database backend: {name}")
+    if fmt and BACKENDS[name] in (FileStorage, JournaledFileStorage):
+        return BACKENDS[name](db_path, fmt=fmt)
+    return BACKENDS[name](db_path)
+
+def migrate_storage(source, target, overwrite=False, batch_size=1000):
+    """Copy every user record from one backend to another.
+
+    Args:
+        source (StorageBackend): Backend to read from
+        target (StorageBackend): Backend to write to
+        overwrite (bool, optional): Replace records that already exist in the target
+        batch_size (int, optional): Records written per ``insert_many`` call
+
+    Returns:
+        int: Number of records copied
+    """
+    copied = 0
+    batch = {}
+
+    def flush():
+        nonlocal copied
+        inserted = set(target.insert_many(batch))
+        copied += len(inserted)
+        for username, record in batch.items():
+            if username in inserted:
+                continue
+            if overwrite:
+                target.mutate(username, lambda r, new=record: (r.clear(), r.update(new)))
+                copied += 1
+            else:
+                logger.warning(f"Skipping {username}: already present in target database")
+        batch.clear()
+
+    for username, record in source.iter_users():
+        batch[username] = record
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    logger.info(f"Migrated {copied} users from {source.name} to {target.name}")
+    return copied
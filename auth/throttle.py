@@ -0,0 +1,174 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class TokenBucketLimiter:
+    """Token buckets keyed by an arbitrary string, held in one dict.
+
+    Each key maps to a ``(tokens, timestamp)`` tuple. A bucket that would have
+    refilled completely is indistinguishable from a missing one, so such
+    entries are dropped whenever the table grows past ``max_keys``. The
+    limiter is not thread-safe on its own; callers hold a lock.
+    """
+
+    def __init__(self, capacity, refill_per_sec, max_keys=100000):
+        """Create a limiter.
+
+        Args:
+            capacity (float): Burst size, i.e. attempts allowed back to back
+            refill_per_sec (float): Tokens regained per second
+            max_keys (int, optional): Table size that triggers pruning
+        """
+        self.capacity = float(capacity)
+        self.refill_per_sec = float(refill_per_sec)
+        self.max_keys = max_keys
+        self._buckets = {}
+
+    def _tokens(self, key, now):
+        entry = self._buckets.get(key)
+        if entry is None:
+            return self.capacity
+        tokens, stamp = entry
+        return min(self.capacity, tokens + (now - stamp) * self.refill_per_sec)
+
+    def wait_time(self, key, now):
+        """Get how long until ``key`` has a token available.
+
+        Args:
+            key (str): Bucket key
+            now (float): Current monotonic time
+
+        Returns:
+            float: Seconds to wait, 0 if a token is available now
+        """
+        missing = 1.0 - self._tokens(key, now)
+        if missing <= 0:
+            return 0.0
+        return missing / self.refill_per_sec
+
+    def consume(self, key, now):
+        """Take one token from ``key``'s bucket; callers check ``wait_time`` first."""
+        self._buckets[key] = (self._tokens(key, now) - 1.0, now)
+        if len(self._buckets) > self.max_keys:
+            self.prune(now)
+
+    def prune(self, now):
+        """Drop buckets that have refilled, then the oldest ones if still too many.
+
+        Args:
+            now (float): Current monotonic time
+
+        Returns:
+            int: Number of buckets removed
+        """
+        before = len(self._buckets)
+        full_after = self.capacity / self.refill_per_sec
+        self._buckets = {
+            key: (tokens, stamp) for key, (tokens, stamp) in self._buckets.items()
+            if now - stamp < full_after
+        }
+        # Under a flood of distinct keys, forget the least recently inserted
+        overflow = len(self._buckets) - self.max_keys
+        if overflow > 0:
+            for key in list(self._buckets)[:overflow]:
+                del self._buckets[key]
+        return before - len(self._buckets)
+
+    def __len__(self):
+        return len(self._buckets)
+
+class LoginThrottle:
+    """Per-username and per-client login rate limits.
+
+    An attempt is allowed only if both the account's and the client's bucket
+    have a token, and then takes one from each. Checking happens before any
+    password hashing, so rejected attempts cost almost nothing.
+    """
+
+    def __init__(self, user_burst=5, user_per_min=2, client_burst=20, client_per_min=30, max_keys=100000):
+        """Create a throttle.
+
+        Args:
+            user_burst (int, optional): Attempts allowed back to back per username
+            user_per_min (float, optional): Sustained attempts per minute per username
+            client_burst (int, optional): Attempts allowed back to back per client
+            client_per_min (float, optional): Sustained attempts per minute per client
+            max_keys (int, optional): Buckets kept per table before pruning
+        """
+        self._users = TokenBucketLimiter(user_burst, user_per_min / 60.0, max_keys)
+        self._clients = TokenBucketLimiter(client_burst, client_per_min / 60.0, max_keys)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.throttled_user = 0
+        self.throttled_client = 0
+
+    def acquire(self, username, client_id=None):
+        """Record a login attempt if the limits allow it.
+
+        Args:
+            username (str): Username being logged into
+            client_id (str, optional): Client address or session id
+
+        Returns:
+            float: 0 if the attempt may proceed, otherwise seconds to wait
+        """
+        user_key = (username or '').strip().lower()
+        now = time.monotonic()
+        with self._lock:
+            wait = self._users.wait_time(user_key, now)
+            if wait:
+                self.throttled_user += 1
+                logger.debug(f"Throttled login attempt for user {user_key}")
+                return wait
+            if client_id:
+                wait = self._clients.wait_time(client_id, now)
+                if wait:
+                    self.throttled_client += 1
+                    logger.debug(f"Throttled login attempt from client {client_id}")
+                    return wait
+                self._clients.consume(client_id, now)
+            self._users.consume(user_key, now)
+            self.allowed += 1
+        return 0.0
+
+    def stats(self):
+        """Get throttling counters.
+
+        Returns:
+            dict: Allowed and throttled attempt counts and tracked bucket counts
+        """
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'throttled_user': self.throttled_user,
+                'throttled_client': self.throttled_client,
+                'tracked_users': len(self._users),
+                'tracked_clients': len(self._clients),
+            }
+
+_throttle = None
+_throttle_lock = threading.Lock()
+
+def get_login_throttle():
+    """Get the process-wide login throttle.
+
+    Limits can be tuned with ``LOGIN_USER_BURST``, ``LOGIN_USER_PER_MIN``,
+    ``LOGIN_CLIENT_BURST`` and ``LOGIN_CLIENT_PER_MIN``.
+
+    Returns:
+        LoginThrottle: Shared throttle instance
+    """
+    global _throttle
+    if _throttle is None:
+        with _throttle_lock:
+            if _throttle is None:
+                _throttle = LoginThrottle(
+                    user_burst=int(os.environ.get('LOGIN_USER_BURST', 5)),
+                    user_per_min=float(os.environ.get('LOGIN_USER_PER_MIN', 2)),
+                    client_burst=int(os.environ.get('LOGIN_CLIENT_BURST', 20)),
+                    client_per_min=float(os.environ.get('LOGIN_CLIENT_PER_MIN', 30)),
+                )
+    return _throttle
@@ -1,59 +1,307 @@
 import os
-import yaml
+import copy
 import logging
 import datetime
-import time
-import bcrypt
 import json
+import threading
+import contextlib
 from pathlib import Path
+from auth.storage import UserAggregates, create_backend, record_version
+from auth.conversations import ConversationStore
+from auth.attempts import QuizAttemptStore, default_attempts_path
+from auth import backup
+from auth.passwords import hash_password, check_password, needs_rehash
 
 logger = logging.getLogger(__name__)
 
+class UserSession:
+    """Unit of work for a single user record.
+    
+    Holds the record loaded at the start of the session, the set of fields
+    changed since and the changes themselves, in order. Obtain one through
+    ``UserDatabase.session``; the changes are written back in a single save
+    when the outermost session exits.
+    """
+    
+    def __init__(self, username, record):
+        self.username = username
+        self.record = record
+        self.version = record_version(record) if record is not None else 0
+        self.dirty = set()
+        self.changes = []
+        self.after_flush = []
+    
+    def apply(self, fn, fields):
+        """Apply a change to the record and remember it for replay.
+        
+        Args:
+            fn (callable): Function that modifies the record in place
+            fields (iterable): Top-level fields ``fn`` may change
+        """
+        fn(self.record)
+        self.changes.append(fn)
+        self.dirty.update(fields)
+    
+    def replay(self, record):
+        """Apply this session's changes, in order, to a fresher copy of the record.
+        
+        Args:
+            record (dict): Record as currently stored
+        """
+        for fn in self.changes:
+            fn(record)
+    
+    def _set_fields(self, fields):
+        values = {field: copy.deepcopy(self.record[field]) for field in fields}
+        return lambda record: record.update(copy.deepcopy(values))
+    
+    @property
+    def exists(self):
+        """bool: True if the user exists in the database."""
+        return self.record is not None
+    
+    def get(self, field, default=None):
+        return self.record.get(field, default) if self.record is not None else default
+    
+    def __getitem__(self, field):
+        return self.record[field]
+    
+    def __setitem__(self, field, value):
+        self.record[field] = value
+        self.dirty.add(field)
+        self.changes.append(self._set_fields([field]))
+    
+    def __contains__(self, field):
+        return self.record is not None and field in self.record
+    
+    def on_flush(self, fn):
+        """Run a function once this session's changes have been saved.
+        
+        It is dropped if the changes are discarded or can't be saved, so
+        side effects such as history entries only follow changes that landed.
+        
+        Args:
+            fn (callable): Function taking no arguments
+        """
+        self.after_flush.append(fn)
+    
+    def touch(self, *fields):
+        """Mark fields as changed after modifying them in place.
+        
+        On a conflicting save these fields overwrite the stored ones; prefer
+        ``apply`` so the change itself is replayed.
+        
+        Args:
+            *fields (str): Names of the modified fields
+        """
+        self.dirty.update(fields)
+        self.changes.append(self._set_fields(fields))
+
 class UserDatabase:
-    """User database handler using YAML file storage for simplicity.
+    """User database handler backed by a pluggable storage backend.
     
-    In a production environment, this would be replaced with a proper database.
+    The default backend keeps everything in a YAML file for simplicity. Larger
+    deployments can switch to SQLite by pointing ``db_path`` (or the
+    ``USER_DB_PATH`` environment variable) at a ``.db`` file, or by setting
+    ``USER_DB_BACKEND=sqlite`` (see ``auth/storage.py``).
     """
     
-    def __init__(self, db_path='users.yaml'):
+    def __init__(self, db_path=None, backend=None):
         """Initialize the user database.
         
         Args:
-            db_path (str): Path to the YAML file storing user data
+            db_path (str, optional): Path to the database file storing user data.
+                Defaults to ``USER_DB_PATH`` or ``users.yaml``
+            backend (str, optional): Storage backend name; inferred from the
+                environment or ``db_path`` if not given
+        """
+        self.db_path = db_path or os.environ.get('USER_DB_PATH', 'users.yaml')
+        self._storage = create_backend(self.db_path, backend)
+        self._local = threading.local()
+        self.conversations = ConversationStore(os.environ.get('CONVERSATIONS_DIR', 'conversations'))
+        self.attempts = QuizAttemptStore(default_attempts_path(self.db_path))
+    
+    @property
+    def backend_name(self):
+        """str: Name of the storage backend in use."""
+        return self._storage.name
+    
+    def create_backup(self, archive_path, compresslevel=6):
+        """Back up users, conversations and quiz attempts without stopping writes.
+        
+        See ``auth/backup.py``; restore with ``python -m auth.cli restore``.
+        
+        Args:
+            archive_path (str): ``.tar.gz`` file to write
+            compresslevel (int, optional): gzip level, 1 (fast) to 9 (small)
+            
+        Returns:
+            dict: Backup manifest (counts, timings, size), or None on failure
         """
-        self.db_path = db_path
-        self._ensure_db_exists()
+        try:
+            return backup.create_backup(self, archive_path, compresslevel)
+        except Exception as e:
+            logger.error(f"Error backing up user database to {archive_path}: {e}")
+            return None
+    
+    def storage_stats(self):
+        """Get storage backend statistics (cache hits, lock timings, ...).
+        
+        Returns:
+            dict: Backend-specific counters
+        """
+        try:
+            return self._storage.stats()
+        except Exception as e:
+            logger.error(f"Error reading storage statistics: {e}")
+            return {}
+    
+    def _active_sessions(self):
+        """Get the sessions open on the current thread, keyed by username."""
+        sessions = getattr(self._local, 'sessions', None)
+        if sessions is None:
+            sessions = self._local.sessions = {}
+        return sessions
+    
+    @contextlib.contextmanager
+    def session(self, username):
+        """Load a user record once and batch all changes into one write.
+        
+        While the session is open on this thread, ``get_user_data``,
+        ``update_lesson_progress``, ``update_quiz_score`` and the other per-user
+        methods read and modify the session's record instead of the store.
+        Nested sessions for the same user share the outer one. Changes are
+        flushed when the outermost session exits normally or through a
+        Streamlit rerun/stop, and discarded if an error is raised.
+        
+        Args:
+            username (str): Username of the record to load
+            
+        Yields:
+            UserSession: Session wrapping the user's record
+        """
+        sessions = self._active_sessions()
+        if username in sessions:
+            yield sessions[username]
+            return
+        
+        try:
+            record = self._storage.get(username)
+        except Exception as e:
+            logger.error(f"Error loading data for user {username}: {e}")
+            record = None
+        session = sessions[username] = UserSession(username, record)
+        flush = True
+        try:
+            yield session
+        except Exception:
+            flush = False
+            raise
+        finally:
+            del sessions[username]
+            if flush:
+                self._flush(session)
+    
+    def _flush(self, session):
+        """Write a session's changes back to the store in one update.
+        
+        The record is saved with a compare-and-swap against the version it
+        was loaded at. If someone else saved the user in the meantime (another
+        tab, an admin), the session's changes are replayed on the stored
+        record instead, so neither side's update is lost.
+        
+        Args:
+            session (UserSession): Session to flush
+            
+        Returns:
+            bool: True if the changes were saved (or there were none)
+        """
+        if not session.exists:
+            session.after_flush.clear()
+            return True
+        if not session.dirty:
+            self._run_after_flush(session)
+            return True
+        try:
+            record = copy.deepcopy(session.record)
+            written = self._storage.compare_and_swap(session.username, session.version, record)
+            if written is False:
+                logger.info(f"User {session.username} changed during the session; replaying its changes")
+                record = self._storage.mutate(session.username, session.replay)
+                written = record is not None
+            if not written:
+                logger.warning(f"User {session.username} not found")
+                session.after_flush.clear()
+                return False
+            session.version = record_version(record)
+            session.dirty.clear()
+            session.changes.clear()
+            self._run_after_flush(session)
+            return True
+        except Exception as e:
+            logger.error(f"Error saving session for user {session.username}: {e}")
+            session.after_flush.clear()
+            return False
     
-    def _ensure_db_exists(self):
-        """Create the database file if it doesn't exist."""
-        if not os.path.exists(self.db_path):
-            with open(self.db_path, 'w') as f:
-                yaml.dump({}, f)
-            logger.info(f"Created new user database at {self.db_path}")
+    @staticmethod
+    def _run_after_flush(session):
+        callbacks, session.after_flush = session.after_flush, []
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                logger.error(f"Error after saving session for user {session.username}: {e}")
+    
+    def _modify(self, username, fn, fields, after=None):
+        """Apply a change to a user record, deferring the write if a session is open.
+        
+        Args:
+            username (str): Username of the record to modify
+            fn (callable): Function that modifies the record in place
+            fields (iterable): Top-level fields ``fn`` may change
+            after (callable, optional): Run once the change is saved: right
+                away without a session, otherwise when the session is flushed
+            
+        Returns:
+            bool: True if the user exists and the change was applied
+        """
+        session = self._active_sessions().get(username)
+        if session is None:
+            if self._storage.mutate(username, fn) is None:
+                return False
+            if after is not None:
+                after()
+            return True
+        if not session.exists:
+            return False
+        session.apply(fn, fields)
+        if after is not None:
+            session.on_flush(after)
+        return True
     
     def _load_db(self):
-        """Load the user database from file.
+        """Load the whole user database.
+        
+        Prefer the per-user methods where possible; with the SQLite backend
+        this reads every row.
         
         Returns:
             dict: User database
         """
         try:
-            with open(self.db_path, 'r') as f:
-                db = yaml.safe_load(f) or {}
-            return db
+            return self._storage.load_all()
         except Exception as e:
             logger.error(f"Error loading user database: {e}")
             return {}
     
     def _save_db(self, db):
-        """Save the user database to file.
+        """Replace the whole user database.
         
         Args:
             db (dict): User database to save
         """
         try:
-            with open(self.db_path, 'w') as f:
-                yaml.dump(db, f)
+            self._storage.save_all(db)
         except Exception as e:
             logger.error(f"Error saving user database: {e}")
     
@@ -66,8 +314,14 @@ class UserDatabase:
         Returns:
             bool: True if user exists, False otherwise
         """
-        db = self._load_db()
-        return username in db
+        session = self._active_sessions().get(username)
+        if session is not None:
+            return session.exists
+        try:
+            return self._storage.exists(username)
+        except Exception as e:
+            logger.error(f"Error checking user {username}: {e}")
+            return False
     
     def is_law_enforcement_email(self, email):
         """Check if the email is from an organization (non-public email provider).
@@ -107,6 +361,60 @@ class UserDatabase:
         # Must have @ and . to be valid
         return '@' in email and '.' in email
     
+    @staticmethod
+    def new_user_record(username, password_hash, name="", email="", agency=""):
+        """Build the record stored for a newly registered user.
+        
+        Args:
+            username (str): Username
+            password_hash (str): bcrypt hash of the user's password
+            name (str, optional): Full name of the user
+            email (str, optional): Email address of the user
+            agency (str, optional): Organization name
+            
+        Returns:
+            dict: New user record with empty progress
+        """
+        return {
+            'username': username,
+            'password_hash': password_hash,
+            'name': name,
+            'email': email,
+            'agency': agency,
+            'created_at': datetime.datetime.now().isoformat(),
+            'lesson_progress': 0,
+            'completed_lessons': [],
+            'quiz_scores': {},
+            'saved_conversations': []
+        }
+    
+    def insert_users(self, records):
+        """Add a batch of complete user records in one storage operation.
+        
+        On SQLite the batch is written in a single transaction. Existing
+        usernames are skipped, not overwritten.
+        
+        Args:
+            records (dict): Mapping of username to user record
+            
+        Returns:
+            list: Usernames that were inserted
+        """
+        try:
+            return self._storage.insert_many(records)
+        except Exception as e:
+            logger.error(f"Error inserting {len(records)} users: {e}")
+            return []
+    
+    def iter_users(self):
+        """Iterate over all user records without loading them all at once
+        where the backend allows it.
+        
+        Yields:
+            tuple: (username, record) pairs
+        """
+        return self._storage.iter_users()
+    
     def create_user(self, username, password, name="", email="", agency=""):
         """Create a new user in the database.
         
@@ -134,32 +442,24 @@ class UserDatabase:
             if not self.is_law_enforcement_email(email):
                 return False, "Registration is restricted to organization email addresses. Personal email providers (Gmail, Yahoo, etc.) are not allowed"
             
-            db = self._load_db()
-            
             # Check if user already exists
-            if username in db:
+            if self._storage.exists(username):
                 logger.warning(f"User {username} already exists")
                 return False, "Username already exists"
             
+            if self._storage.find_by_email(email):
+                logger.warning(f"Email {email} is already registered")
+                return False, "An account with this email address already exists"
+            
             # Hash the password
-            salt = bcrypt.gensalt()
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
+            hashed_password = hash_password(password)
             
             # Create user
-            db[username] = {
-                'username': username,
-                'password_hash': hashed_password.decode('utf-8'),
-                'name': name,
-                'email': email,
-                'agency': agency,
-                'created_at': datetime.datetime.now().isoformat(),
-                'lesson_progress': 0,
-                'completed_lessons': [],
-                'quiz_scores': {},
-                'saved_conversations': []
-            }
-            
-            self._save_db(db)
+            record = self.new_user_record(username, hashed_password, name, email, agency)
+            
+            if not self._storage.insert(username, record):
+                logger.warning(f"User {username} already exists")
+                return False, "Username already exists"
             logger.info(f"Created new user: {username}")
             return True, ""
         
@@ -170,6 +470,9 @@ class UserDatabase:
     def verify_user(self, username, password):
         """Verify user credentials.
         
+        If the stored hash was made with a different bcrypt cost than the one
+        currently configured, it is replaced after a successful check.
+        
         Args:
             username (str): Username to verify
             password (str): Password to verify
@@ -183,15 +486,42 @@ class UserDatabase:
                 return True
 
             # Regular user verification
-            db = self._load_db()
-            if username in db:
-                stored_password_hash = db[username].get('password_hash', '')
-                return bcrypt.checkpw(password.encode('utf-8'), stored_password_hash.encode('utf-8'))
-            return False
+            user = self._storage.get(username)
+            if not user:
+                return False
+            
+            stored_password_hash = user.get('password_hash', '')
+            if not check_password(password, stored_password_hash):
+                return False
+            
+            if needs_rehash(stored_password_hash):
+                self._rehash_password(username, password, stored_password_hash)
+            return True
         except Exception as e:
             logger.error(f"Error verifying user: {str(e)}")
             return False
     
+    def _rehash_password(self, username, password, old_hash):
+        """Upgrade a user's password hash to the configured bcrypt cost.
+        
+        Args:
+            username (str): Username whose hash is upgraded
+            password (str): The user's verified plain-text password
+            old_hash (str): Hash the password was verified against
+        """
+        new_hash = hash_password(password)
+        
+        def apply(user):
+            # Leave the record alone if the password changed meanwhile
+            if user.get('password_hash') == old_hash:
+                user['password_hash'] = new_hash
+        
+        try:
+            self._modify(username, apply, ('password_hash',))
+            logger.info(f"Upgraded password hash for user {username}")
+        except Exception as e:
+            logger.error(f"Error upgrading password hash for user {username}: {e}")
+    
     def get_user_data(self, username):
         """Get data for a specific user.
         
@@ -201,42 +531,185 @@ class UserDatabase:
         Returns:
             dict: User data or None if user doesn't exist
         """
-        db = self._load_db()
-        return db.get(username, None)
+        session = self._active_sessions().get(username)
+        if session is not None:
+            return copy.deepcopy(session.record)
+        try:
+            return self._storage.get(username)
+        except Exception as e:
+            logger.error(f"Error loading data for user {username}: {e}")
+            return None
     
-    def update_lesson_progress(self, username, lesson_id):
-        """Update a user's lesson progress.
+    def find_user_by_email(self, email):
+        """Find the user registered with an email address.
+        
+        Args:
+            email (str): Email address, compared case-insensitively
+            
+        Returns:
+            str: Username, or None if no user has that email
+        """
+        try:
+            return self._storage.find_by_email(email)
+        except Exception as e:
+            logger.error(f"Error looking up email {email}: {e}")
+            return None
+    
+    def get_users_by_agency(self, agency):
+        """Get all users registered with an agency.
+        
+        Args:
+            agency (str): Agency name, compared case-insensitively
+            
+        Returns:
+            list: Usernames, sorted
+        """
+        try:
+            return self._storage.find_by_agency(agency)
+        except Exception as e:
+            logger.error(f"Error looking up agency {agency}: {e}")
+            return []
+    
+    def get_users_created_between(self, start=None, end=None):
+        """Get users who registered in a time range.
+        
+        Args:
+            start (datetime or str, optional): Inclusive start; open-ended if None
+            end (datetime or str, optional): Exclusive end; open-ended if None
+            
+        Returns:
+            list: Usernames, oldest registration first
+        """
+        try:
+            return self._storage.created_between(start, end)
+        except Exception as e:
+            logger.error(f"Error looking up users registered between {start} and {end}: {e}")
+            return []
+
+    def query_users(self, agency=None, min_progress=None, max_progress=None, start=None, end=None,
+                    sort='created_at', descending=False, offset=0, limit=50):
+        """Get one page of users, filtered and sorted by the backend's indexes.
+        
+        Only the records on the page are read, and the total comes from the
+        indexes, so paging through a large roster stays cheap.
+        
+        Args:
+            agency (str, optional): Only users of this agency
+            min_progress (int, optional): Only users whose lesson progress (highest lesson id reached) is at least this
+            max_progress (int, optional): Only users whose lesson progress is at most this
+            start (datetime or str, optional): Only users registered at or after this time
+            end (datetime or str, optional): Only users registered before this time
+            sort (str, optional): 'username', 'email', 'agency', 'created_at' or 'lesson_progress'
+            descending (bool, optional): Sort largest first
+            offset (int, optional): Matching users to skip
+            limit (int, optional): Page size; 0 only counts
+        
+        Returns:
+            tuple: (list of (username, record) pairs, total number of matching users)
+        """
+        try:
+            return self._storage.query_users(
+                agency, min_progress, max_progress, start, end, sort, descending, offset, limit
+            )
+        except Exception as e:
+            logger.error(f"Error querying users: {e}")
+            return [], 0
+    
+    def get_user_stats(self, lesson_count):
+        """Get the dashboard counts the storage backend keeps up to date.
+        
+        Reading them costs the same however many users there are.
+        
+        Args:
+            lesson_count (int): Lessons in the course, for the completed count
+        
+        Returns:
+            dict: ``users``, ``active``, ``completed``, ``agencies``,
+            ``lessons`` and ``quizzes``; see ``UserAggregates.summary``
+        """
+        try:
+            return self._storage.aggregates().summary(lesson_count)
+        except Exception as e:
+            logger.error(f"Error reading user statistics: {e}")
+            return UserAggregates().summary(lesson_count)
+    
+    def data_version(self):
+        """Get a token that changes whenever any user record is written.
+        
+        Returns:
+            object: Hashable token, or None if it isn't known (don't cache)
+        """
+        try:
+            return self._storage.data_version()
+        except Exception as e:
+            logger.error(f"Error reading user database version: {e}")
+            return None
+    
+    def count_users(self):
+        """Count all registered users.
+        
+        Returns:
+            int: Number of users
+        """
+        try:
+            return self._storage.count()
+        except Exception as e:
+            logger.error(f"Error counting users: {e}")
+            return 0
+    
+    def update_user_fields(self, username, fields):
+        """Overwrite top-level fields of a user record.
+        
+        A new ``email`` is refused if another user is registered with it,
+        as ``create_user`` does.
         
         Args:
             username (str): Username to update
-            lesson_id (int): ID of the completed lesson
+            fields (dict): Field names and their new values
             
         Returns:
             bool: True if update was successful, False otherwise
         """
         try:
-            db = self._load_db()
+            if fields.get('email'):
+                owner = self._storage.find_by_email(fields['email'])
+                if owner is not None and owner != username:
+                    logger.warning(f"Email {fields['email']} is already registered to another user")
+                    return False
             
-            # Check if user exists
-            if username not in db:
+            if not self._modify(username, lambda user: user.update(fields), fields.keys()):
                 logger.warning(f"User {username} not found")
                 return False
+            return True
+        except Exception as e:
+            logger.error(f"Error updating user {username}: {e}")
+            return False
+    
+    def update_lesson_progress(self, username, lesson_id):
+        """Update a user's lesson progress.
+        
+        Args:
+            username (str): Username to update
+            lesson_id (int): ID of the completed lesson
             
-            # Update lesson progress
-            current_progress = db[username].get('lesson_progress', 0)
-            
+        Returns:
+            bool: True if update was successful, False otherwise
+        """
+        def apply(user):
             # Only update if this is higher than the current progress
-            if lesson_id > current_progress:
-                db[username]['lesson_progress'] = lesson_id
+            if lesson_id > user.get('lesson_progress', 0):
+                user['lesson_progress'] = lesson_id
             
             # Add to completed lessons if not already there
-            if 'completed_lessons' not in db[username]:
-                db[username]['completed_lessons'] = []
-                
-            if lesson_id not in db[username]['completed_lessons']:
-                db[username]['completed_lessons'].append(lesson_id)
+            completed = user.setdefault('completed_lessons', [])
+            if lesson_id not in completed:
+                completed.append(lesson_id)
+        
+        try:
+            if not self._modify(username, apply, ('lesson_progress', 'completed_lessons')):
+                logger.warning(f"User {username} not found")
+                return False
             
-            self._save_db(db)
             logger.info(f"Updated lesson progress for user {username}: completed lesson {lesson_id}")
             return True
         
@@ -244,44 +717,55 @@ class UserDatabase:
             logger.error(f"Error updating lesson progress for user {username}: {e}")
             return False
     
-    def update_quiz_score(self, username, quiz_id, score, answers=None):
+    def update_quiz_score(self, username, quiz_id, score, answers=None, correct=None, responses=None):
         """Update a user's quiz score.
         
+        The record keeps the best score per quiz; every attempt is also
+        appended to the quiz attempt history (see ``auth/attempts.py``).
+        Inside a ``session`` the attempt is appended only once the session's
+        changes are saved, so the history never holds an attempt whose score
+        was lost.
+        
         Args:
             username (str): Username to update
             quiz_id (int): ID of the quiz
             score (float): Quiz score (percentage)
             answers (dict, optional): User's answers to quiz questions
+            correct (list, optional): Per-question correctness, in question order
+            responses (list, optional): Options picked per question, as
+                bitmasks (see ``auth.attempts.pack_responses``); kept only
+                in the attempt history
             
         Returns:
             bool: True if update was successful, False otherwise
         """
-        try:
-            db = self._load_db()
-            
-            # Check if user exists
-            if username not in db:
-                logger.warning(f"User {username} not found")
-                return False
-            
-            # Initialize quiz scores if needed
-            if 'quiz_scores' not in db[username]:
-                db[username]['quiz_scores'] = {}
-            
-            # Convert quiz_id to string for YAML storage
-            quiz_id_str = str(quiz_id)
+        # Convert quiz_id to string for YAML storage
+        quiz_id_str = str(quiz_id)
+        
+        def apply(user):
+            quiz_scores = user.setdefault('quiz_scores', {})
             
-            # Update quiz score
             # Only overwrite if new score is higher
-            current_score = db[username]['quiz_scores'].get(quiz_id_str, {}).get('score', 0)
+            current_score = quiz_scores.get(quiz_id_str, {}).get('score', 0)
             if score >= current_score:
-                db[username]['quiz_scores'][quiz_id_str] = {
+                quiz_scores[quiz_id_str] = {
                     'score': score,
                     'timestamp': datetime.datetime.now().isoformat(),
                     'answers': answers or {}
                 }
+        
+        def record_attempt():
+            try:
+                self.attempts.record(username, quiz_id, score, correct or [], responses=responses)
+            except Exception as e:
+                # The score itself was saved; only the history entry is missing
+                logger.error(f"Error recording quiz attempt for user {username}: {e}")
+        
+        try:
+            if not self._modify(username, apply, ('quiz_scores',), after=record_attempt):
+                logger.warning(f"User {username} not found")
+                return False
             
-            self._save_db(db)
             logger.info(f"Updated quiz score for user {username}: quiz {quiz_id}, score {score}%")
             return True
         
@@ -289,7 +773,7 @@ class UserDatabase:
             logger.error(f"Error updating quiz score for user {username}: {e}")
             return False
     
-    def save_quiz_score(self, username, quiz_id, score, answers=None):
+    def save_quiz_score(self, username, quiz_id, score, answers=None, correct=None, responses=None):
         """Save a user's quiz score (alias for update_quiz_score).
         
         Args:
@@ -297,15 +781,54 @@ class UserDatabase:
             quiz_id (int or str): ID of the quiz
             score (float): Quiz score (percentage)
             answers (dict, optional): User's answers to quiz questions
+            correct (list, optional): Per-question correctness, in question order
+            responses (list, optional): Options picked per question, as
+                bitmasks (see ``auth.attempts.pack_responses``); kept only
+                in the attempt history
             
         Returns:
             bool: True if update was successful, False otherwise
         """
-        return self.update_quiz_score(username, quiz_id, score, answers)
+        return self.update_quiz_score(username, quiz_id, score, answers, correct, responses)
+    
+    def get_quiz_attempts(self, username, quiz_id=None):
+        """Get every attempt a user has made at the quizzes.
+        
+        Args:
+            username (str): Username to look up
+            quiz_id (int, optional): Only attempts at this quiz
+            
+        Returns:
+            list: Attempts (``quiz_id``, ``timestamp``, ``score``, ``correct``),
+            oldest first
+        """
+        try:
+            return self.attempts.user_attempts(username, quiz_id)
+        except Exception as e:
+            logger.error(f"Error loading quiz attempts for user {username}: {e}")
+            return []
+    
+    def get_attempts_for_quiz(self, quiz_id):
+        """Get every attempt at a quiz, across all users.
+        
+        Args:
+            quiz_id (int): ID of the quiz
+            
+        Returns:
+            list: Attempts, oldest first
+        """
+        try:
+            return self.attempts.quiz_attempts(quiz_id)
+        except Exception as e:
+            logger.error(f"Error loading attempts for quiz {quiz_id}: {e}")
+            return []
     
     def save_conversation(self, username, title, messages):
         """Save a user's playground conversation.
         
+        The conversation goes to the conversation store; the user record is
+        not modified.
+        
         Args:
             username (str): Username to update
             title (str): Title of the conversation
@@ -315,45 +838,13 @@ class UserDatabase:
             str: ID of the saved conversation, or False if saving failed
         """
         try:
-            db = self._load_db()
-            
             # Check if user exists
-            if username not in db:
+            if not self.user_exists(username):
                 logger.warning(f"User {username} not found")
                 return False
             
-            # Initialize saved conversations if needed
-            if 'saved_conversations' not in db[username]:
-                db[username]['saved_conversations'] = []
-            
-            # Generate a unique ID based on timestamp
-            conversation_id = str(int(time.time()))
-            
-            # Create the conversation entry
-            conversation = {
-                'id': conversation_id,
-                'title': title,
-                'timestamp': datetime.datetime.now().isoformat(),
-                'messages': messages
-            }
-            
-            # Save conversation to separate file to avoid large YAML database
-            conversations_dir = Path("conversations")
-            conversations_dir.mkdir(exist_ok=True)
-            
-            conversation_file = conversations_dir / f"conversation-{username}-{conversation_id}.json"
-            with open(conversation_file, 'w') as f:
-                json.dump(conversation, f)
-            
-            # Add reference to user data
-            db[username]['saved_conversations'].append({
-                'id': conversation_id,
-                'title': title,
-                'timestamp': datetime.datetime.now().isoformat(),
-                'file_path': str(conversation_file)
-            })
-            
-            self._save_db(db)
+            conversation_id = self.conversations.save(username, title, messages)['id']
+            
             logger.info(f"Saved conversation for user {username}: {title} ({conversation_id})")
             return conversation_id
         
@@ -372,15 +863,21 @@ class UserDatabase:
             dict: Conversation data or None if not found
         """
         try:
-            db = self._load_db()
+            conversation = self.conversations.get(username, conversation_id)
+            if conversation is not None:
+                return conversation
+            
+            # Fall back to conversations saved before the conversation store,
+            # which are referenced from the user record
+            user = self.get_user_data(username)
             
             # Check if user exists
-            if username not in db:
+            if user is None:
                 logger.warning(f"User {username} not found")
                 return None
             
             # Find the conversation reference
-            conversation_refs = db[username].get('saved_conversations', [])
+            conversation_refs = user.get('saved_conversations', [])
             conversation_ref = next((c for c in conversation_refs if c['id'] == conversation_id), None)
             
             if not conversation_ref:
@@ -409,33 +906,34 @@ class UserDatabase:
         Returns:
             bool: True if deletion was successful, False otherwise
         """
+        removed = []
+        
+        def apply(user):
+            conversation_refs = user.get('saved_conversations', [])
+            removed.extend(c for c in conversation_refs if c['id'] == conversation_id)
+            user['saved_conversations'] = [
+                c for c in conversation_refs if c['id'] != conversation_id
+            ]
+        
         try:
-            db = self._load_db()
+            if self.conversations.delete(username, conversation_id):
+                logger.info(f"Deleted conversation for user {username}: {conversation_id}")
+                return True
             
-            # Check if user exists
-            if username not in db:
+            # Older conversations are referenced from the user record
+            if not self._modify(username, apply, ('saved_conversations',)):
                 logger.warning(f"User {username} not found")
                 return False
             
-            # Find the conversation reference
-            conversation_refs = db[username].get('saved_conversations', [])
-            conversation_ref = next((c for c in conversation_refs if c['id'] == conversation_id), None)
-            
-            if not conversation_ref:
+            if not removed:
                 logger.warning(f"Conversation {conversation_id} not found for user {username}")
                 return False
             
             # Delete the separate file
-            file_path = conversation_ref.get('file_path')
+            file_path = removed[0].get('file_path')
             if file_path and os.path.exists(file_path):
                 os.remove(file_path)
             
-            # Remove from user data
-            db[username]['saved_conversations'] = [
-                c for c in conversation_refs if c['id'] != conversation_id
-            ]
-            
-            self._save_db(db)
             logger.info(f"Deleted conversation for user {username}: {conversation_id}")
             return True
         
@@ -443,6 +941,70 @@ class UserDatabase:
             logger.error(f"Error deleting conversation for user {username}: {e}")
             return False
     
+    def list_conversations(self, username, cursor=None, limit=20):
+        """List one page of a user's saved conversations, newest first.
+        
+        Only the per-user index is read; message bodies are loaded with
+        ``get_conversation`` when a conversation is opened.
+        
+        Args:
+            username (str): Username to list conversations for
+            cursor (str, optional): Cursor returned with the previous page;
+                starts from the newest conversation if omitted
+            limit (int, optional): Maximum conversations per page
+            
+        Returns:
+            list: Dicts with ``id``, ``title`` and ``timestamp``
+            str: Cursor for the next page, or None if this is the last page
+        """
+        try:
+            user = self.get_user_data(username) or {}
+            if not user.get('saved_conversations'):
+                return self.conversations.page(username, cursor, limit)
+            
+            # Merge in conversations saved before the conversation store
+            conversations = self.conversations.list(username)
+            stored_ids = {c['id'] for c in conversations}
+            legacy = [c for c in user['saved_conversations'] if c['id'] not in stored_ids]
+            conversations = sorted(
+                conversations + legacy,
+                key=lambda c: (ConversationStore.sort_key(c), c['id']),
+                reverse=True
+            )
+            return ConversationStore.paginate(conversations, cursor, limit)
+        
+        except Exception as e:
+            logger.error(f"Error listing conversations for user {username}: {e}")
+            return [], None
+    
+    def migrate_legacy_conversations(self, remove=True):
+        """Move conversations saved before the conversation store into it.
+        
+        Flat ``conversation-<username>-<id>.json`` files are stored under
+        their owner's directory, and the references to them are dropped from
+        the user records.
+        
+        Args:
+            remove (bool, optional): Delete the flat files once migrated
+            
+        Returns:
+            int: Number of conversations migrated
+        """
+        migrated = self.conversations.migrate_flat_files(remove=remove)
+        for username, conversation_ids in migrated.items():
+            ids = set(conversation_ids)
+            
+            def apply(user):
+                user['saved_conversations'] = [
+                    c for c in user.get('saved_conversations', []) if c['id'] not in ids
+                ]
+            
+            try:
+                self._modify(username, apply, ('saved_conversations',))
+            except Exception as e:
+                logger.error(f"Error updating conversation references for user {username}: {e}")
+        return sum(len(ids) for ids in migrated.values())
+    
     def delete_user(self, username):
         """Delete a user from the database.
         
@@ -453,10 +1015,8 @@ class UserDatabase:
             bool: True if deletion was successful, False otherwise
         """
         try:
-            db = self._load_db()
-            
             # Check if user exists
-            if username not in db:
+            if not self.user_exists(username):
                 logger.warning(f"User {username} not found")
                 return False
             
@@ -465,22 +1025,60 @@ class UserDatabase:
                 logger.warning("Cannot delete admin user")
                 return False
             
-            # Delete user's saved conversations
-            conversations_dir = Path("conversations")
-            if conversations_dir.exists():
-                for file in conversations_dir.glob(f"conversation-{username}-*.json"):
+            # Delete user's saved conversations: one subtree in the store,
+            # plus any not-yet-migrated files the user record points to
+            self.conversations.delete_user(username)
+            user = self.get_user_data(username) or {}
+            for reference in user.get('saved_conversations', []):
+                file_path = reference.get('file_path')
+                if file_path:
                     try:
-                        file.unlink()
+                        Path(file_path).unlink(missing_ok=True)
                     except Exception as e:
-                        logger.error(f"Error deleting conversation file {file}: {e}")
+                        logger.error(f"Error deleting conversation file {file_path}: {e}")
             
             # Delete user from database
-            del db[username]
-            self._save_db(db)
+            self._storage.delete(username)
+            # Their quiz attempts still count in the question statistics, but
+            # no longer under their username
+            self.attempts.forget_user(username)
+            session = self._active_sessions().get(username)
+            if session is not None:
+                session.record = None
+                session.dirty.clear()
             
             logger.info(f"Deleted user: {username}")
             return True
         
         except Exception as e:
             logger.error(f"Error deleting user {username}: {e}")
-            return False 
\ No newline at end of file
+            return False
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+def get_user_db(db_path=None, backend=None):
+    """Get the shared UserDatabase for a database path.
+    
+    One instance (and therefore one set of caches, locks and connections) is
+    kept per path for the lifetime of the process. Components should use this
+    instead of constructing UserDatabase on every rerun.
+    
+    Args:
+        db_path (str, optional): Path to the database file. Defaults to
+            ``USER_DB_PATH`` or ``users.yaml``
+        backend (str, optional): Storage backend name
+        
+    Returns:
+        UserDatabase: Shared database handle
+    """
+    db_path = db_path or os.environ.get('USER_DB_PATH', 'users.yaml')
+    key = (os.path.abspath(db_path), backend)
+    user_db = _registry.get(key)
+    if user_db is None:
+        with _registry_lock:
+            user_db = _registry.get(key)
+            if user_db is None:
+                user_db = UserDatabase(db_path, backend)
+                _registry[key] = user_db
+    return user_db
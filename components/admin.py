@@ -1,9 +1,56 @@
 import streamlit as st
+import io
+import os
 import logging
-from auth.user_db import UserDatabase
+import datetime
+import tempfile
+from auth.user_db import get_user_db
+from auth.bulk import EXPORT_FIELDS, format_for_path, read_rows, import_users, export_to_file, parquet_available
+from content.lesson_content import get_lesson_count, get_lesson_titles
+from content.quiz_content import get_quiz, get_quiz_titles
+from utils.analytics import cohort_report
+from utils.item_analysis import item_report
 
 logger = logging.getLogger(__name__)
 
+# Sort choices for the user table, mapped to query_users sort keys
+SORT_OPTIONS = {
+    "Registration Date": "created_at",
+    "Username": "username",
+    "Email": "email",
+    "Agency": "agency",
+    "Lesson Progress": "lesson_progress",
+}
+
+PAGE_SIZES = [25, 50, 100]
+
+# Lower bounds of the quiz score histogram buckets (see UserAggregates)
+SCORE_BUCKETS = list(range(0, 101, 10))
+
+EXPORT_MIME_TYPES = {
+    "csv": "text/csv",
+    "jsonl": "application/jsonl",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def _user_row(username, data):
+    """Get a user's row for the admin tables."""
+    return {
+        "Username": username,
+        "Name": data.get("name", ""),
+        "Email": data.get("email", ""),
+        "Agency": data.get("agency", "Not specified"),
+        "Lesson Progress": data.get("lesson_progress", 0),
+        "Registration Date": data.get("created_at", "Unknown")
+    }
+
+def _day_bounds(start, end):
+    """Turn an inclusive date range into a ``[start, end)`` datetime range."""
+    return (
+        datetime.datetime.combine(start, datetime.time.min),
+        datetime.datetime.combine(end + datetime.timedelta(days=1), datetime.time.min)
+    )
+
 def display_admin():
     """Display the admin panel with user management features."""
     st.header("👤 Admin Panel")
@@ -19,29 +66,65 @@ def display_admin():
         return
     
     # Initialize user database
-    user_db = UserDatabase()
+    user_db = get_user_db()
     
-    # Display registered users
+    users_tab, analytics_tab, questions_tab = st.tabs(["Users", "Analytics", "Questions"])
+    with users_tab:
+        _display_users(user_db)
+    with analytics_tab:
+        _display_analytics(user_db)
+    with questions_tab:
+        _display_item_analysis(user_db)
+
+def _display_users(user_db):
+    """Display the user table, statistics and management tools."""
+    # Display registered users, one page at a time
     st.subheader("Registered Users")
     
-    # Get all users
-    db = user_db._load_db()
-    
-    # Create a table of users
-    user_data = []
-    for username, data in db.items():
-        user_data.append({
-            "Username": username,
-            "Name": data.get("name", ""),
-            "Email": data.get("email", ""),
-            "Agency": data.get("agency", "Not specified"),
-            "Lesson Progress": data.get("lesson_progress", 0),
-            "Registration Date": data.get("created_at", "Unknown")
-        })
-    
-    if user_data:
+    filter_col, progress_col, date_col = st.columns(3)
+    with filter_col:
+        agency = st.text_input("Agency:", key="users_filter_agency").strip()
+    with progress_col:
+        total_lessons = get_lesson_count()
+        min_progress, max_progress = st.slider(
+            "Lesson progress:", 0, total_lessons, (0, total_lessons), key="users_filter_progress"
+        )
+    with date_col:
+        date_range = st.date_input("Registered between:", (), key="users_filter_dates")
+    
+    sort_col, order_col, size_col = st.columns(3)
+    with sort_col:
+        sort_label = st.selectbox("Sort by:", list(SORT_OPTIONS), key="users_sort")
+    with order_col:
+        descending = st.checkbox("Newest / largest first", value=True, key="users_descending")
+    with size_col:
+        page_size = st.selectbox("Users per page:", PAGE_SIZES, key="users_page_size")
+    
+    filters = {
+        "agency": agency or None,
+        "min_progress": min_progress if min_progress > 0 else None,
+        "max_progress": max_progress if max_progress < total_lessons else None,
+    }
+    if len(date_range) == 2:
+        filters["start"], filters["end"] = _day_bounds(*date_range)
+    
+    page = st.session_state.get("users_page", 1)
+    rows, total = user_db.query_users(
+        sort=SORT_OPTIONS[sort_label], descending=descending,
+        offset=(page - 1) * page_size, limit=page_size, **filters
+    )
+    pages = max(1, -(-total // page_size))
+    if page > pages:
+        # The filters changed and the page no longer exists
+        page = st.session_state.users_page = pages
+        rows, total = user_db.query_users(
+            sort=SORT_OPTIONS[sort_label], descending=descending,
+            offset=(page - 1) * page_size, limit=page_size, **filters
+        )
+    
+    if rows:
         st.dataframe(
-            user_data,
+            [_user_row(found, data) for found, data in rows],
             column_config={
                 "Username": st.column_config.TextColumn("Username"),
                 "Name": st.column_config.TextColumn("Full Name"),
@@ -52,40 +135,117 @@ def display_admin():
             },
             hide_index=True
         )
+        first = (page - 1) * page_size + 1
+        st.caption(f"Showing {first}-{first + len(rows) - 1} of {total} matching users")
+        st.number_input("Page:", min_value=1, max_value=pages, step=1, key="users_page")
     else:
         st.info("No registered users found.")
     
-    # User Statistics
+    # User Statistics, from counts the store keeps as users change
     st.subheader("User Statistics")
     
+    stats = user_db.get_user_stats(get_lesson_count())
     col1, col2, col3 = st.columns(3)
     
     with col1:
-        st.metric("Total Users", len(user_data))
+        st.metric("Total Users", stats["users"])
     
     with col2:
-        active_users = sum(1 for user in user_data if user["Lesson Progress"] > 0)
-        st.metric("Active Users", active_users)
+        st.metric("Active Users", stats["active"])
     
     with col3:
-        completed_users = sum(1 for user in user_data if user["Lesson Progress"] >= 8)
-        st.metric("Completed Course", completed_users)
+        st.metric("Completed Course", stats["completed"])
+    
+    with st.expander("Progress Breakdown"):
+        st.write("**Users who completed each lesson**")
+        lesson_ids = list(get_lesson_titles())
+        st.bar_chart(
+            {"Lesson": lesson_ids, "Users": [stats["lessons"].get(lesson_id, 0) for lesson_id in lesson_ids]},
+            x="Lesson", y="Users"
+        )
+        
+        st.write("**Users per agency**")
+        st.dataframe(
+            [{"Agency": agency or "Not specified", "Users": count}
+             for agency, count in sorted(stats["agencies"].items(), key=lambda item: -item[1])],
+            hide_index=True
+        )
+        
+        st.write("**Best quiz scores**")
+        quiz_titles = dict(get_quiz_titles())
+        stats_quiz = st.selectbox("Quiz:", list(quiz_titles.values()), key="stats_quiz")
+        quiz_id = next(quiz_id for quiz_id, title in quiz_titles.items() if title == stats_quiz)
+        histogram = stats["quizzes"].get(str(quiz_id), [0] * len(SCORE_BUCKETS))
+        st.bar_chart({"Best score (%)": SCORE_BUCKETS, "Users": histogram}, x="Best score (%)", y="Users")
     
     # User Management
     st.subheader("User Management")
     
+    # Indexed lookups
+    with st.expander("Find Users"):
+        search_by = st.radio(
+            "Search by:",
+            ["Email", "Agency", "Registration Date"],
+            horizontal=True,
+            key="find_users_by"
+        )
+        
+        matches = None
+        if search_by == "Email":
+            email = st.text_input("Email address:", key="find_users_email")
+            if email:
+                found = user_db.find_user_by_email(email)
+                matches = [found] if found else []
+        elif search_by == "Agency":
+            agency = st.text_input("Agency name:", key="find_users_agency")
+            if agency:
+                matches = user_db.get_users_by_agency(agency)
+        else:
+            today = datetime.date.today()
+            date_range = st.date_input(
+                "Registered between:",
+                (today - datetime.timedelta(days=7), today),
+                key="find_users_dates"
+            )
+            if len(date_range) == 2:
+                matches = user_db.get_users_created_between(*_day_bounds(*date_range))
+        
+        if matches is not None:
+            found_users = [_user_row(found, user_db.get_user_data(found) or {}) for found in matches]
+            st.write(f"{len(found_users)} matching users")
+            if found_users:
+                st.dataframe(found_users, hide_index=True)
+    
+    # Bulk import
+    with st.expander("Bulk Import Users"):
+        st.write("Upload a CSV or JSONL roster with email, name, agency and password (or password_hash) columns. "
+                 "Existing users are skipped.")
+        roster = st.file_uploader("Roster file", type=["csv", "jsonl"], key="bulk_import_file")
+        if st.button("Import Users", key="bulk_import_btn") and roster is not None:
+            fmt = format_for_path(roster.name)
+            with st.spinner("Importing users..."):
+                result = import_users(user_db, read_rows(io.TextIOWrapper(roster, encoding="utf-8", newline=""), fmt))
+            st.success(
+                f"Imported {result['imported']} users, skipped {result['skipped']} existing, "
+                f"rejected {result['invalid']} invalid rows."
+            )
+            if result["errors"]:
+                st.dataframe(
+                    [{"Line": line_number, "Error": message} for line_number, message in result["errors"]],
+                    hide_index=True
+                )
+    
     # User deletion
     with st.expander("Delete User"):
-        user_to_delete = st.selectbox(
-            "Select user to delete:",
-            [user["Username"] for user in user_data if user["Username"] != "admin"],
-            key="user_to_delete"
-        )
+        user_to_delete = st.text_input("Username to delete:", key="user_to_delete").strip()
         
         if st.button("Delete User", key="delete_user_btn", type="primary"):
-            if user_to_delete:
-                # Add user deletion logic to UserDatabase class
-                if hasattr(user_db, 'delete_user') and user_db.delete_user(user_to_delete):
+            if user_to_delete == "admin":
+                st.error("The admin account cannot be deleted.")
+            elif user_to_delete and not user_db.user_exists(user_to_delete):
+                st.error(f"No user named {user_to_delete}.")
+            elif user_to_delete:
+                if user_db.delete_user(user_to_delete):
                     st.success(f"User {user_to_delete} has been deleted.")
                     st.rerun()
                 else:
@@ -93,16 +253,109 @@ def display_admin():
     
     # Export user data
     with st.expander("Export User Data"):
-        if st.button("Download User Data (CSV)", key="export_users_btn"):
-            # Create CSV from user_data
-            import pandas as pd
-            df = pd.DataFrame(user_data)
-            csv = df.to_csv(index=False)
-            
-            st.download_button(
-                "Click to Download",
-                csv,
-                "user_data.csv",
-                "text/csv",
-                key="download_users_csv"
-            ) 
\ No newline at end of file
+        export_columns = st.multiselect("Columns:", EXPORT_FIELDS, default=EXPORT_FIELDS, key="export_columns")
+        export_format = st.selectbox(
+            "Format:", ["CSV", "JSONL"] + (["Parquet"] if parquet_available() else []), key="export_format"
+        )
+        if st.button("Prepare Export", key="export_users_btn") and export_columns:
+            fmt = export_format.lower()
+            # Streamed a chunk at a time into a temporary file, so only the
+            # finished file is ever held in memory, for the download itself
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, f"user_data.{fmt}")
+                with st.spinner("Exporting users..."):
+                    count = export_to_file(user_db, path, fmt, export_columns)
+                with open(path, "rb") as f:
+                    st.download_button(
+                        f"Download {count} users ({export_format})",
+                        f,
+                        f"user_data.{fmt}",
+                        EXPORT_MIME_TYPES[fmt],
+                        key="download_users_export"
+                    )
+
+def _display_analytics(user_db):
+    """Display per-agency lesson funnels and quiz score distributions."""
+    lesson_ids = list(get_lesson_titles())
+    quiz_titles = dict(get_quiz_titles())
+    report = cohort_report(user_db, lesson_ids, list(quiz_titles))
+    computed_at = datetime.datetime.fromtimestamp(report["computed_at"]).strftime("%H:%M:%S")
+    st.caption(
+        f"{report['users']} users, computed at {computed_at} in {report['seconds']:.2f}s; "
+        f"recomputed when user data changes"
+    )
+    
+    funnel = report["funnel"]
+    st.subheader("Lesson Funnel")
+    if funnel.empty:
+        st.info("No registered users found.")
+        return
+    
+    agencies = ["All agencies"] + list(funnel.index)
+    funnel_agency = st.selectbox("Agency:", agencies, key="funnel_agency")
+    counts = funnel.sum() if funnel_agency == "All agencies" else funnel.loc[funnel_agency]
+    st.bar_chart(
+        {"Lesson": lesson_ids, "Users": [int(counts[lesson_id]) for lesson_id in lesson_ids]},
+        x="Lesson", y="Users"
+    )
+    st.caption(f"Of {int(counts['Users'])} users, how many completed each lesson")
+    
+    st.write("**Share of each agency's users who completed each lesson**")
+    shares = funnel[lesson_ids].div(funnel["Users"], axis=0)
+    shares.columns = [f"Lesson {lesson_id}" for lesson_id in lesson_ids]
+    st.dataframe(shares.style.format("{:.0%}"))
+    
+    st.subheader("Quiz Scores by Agency")
+    quizzes = report["quizzes"]
+    quiz_title = st.selectbox("Quiz:", list(quiz_titles.values()), key="analytics_quiz")
+    quiz_id = next(quiz_id for quiz_id, title in quiz_titles.items() if title == quiz_title)
+    if quiz_id not in quizzes.index.get_level_values("quiz"):
+        st.info("Nobody has taken this quiz yet.")
+        return
+    scores = quizzes.xs(quiz_id, level="quiz").sort_values("Users", ascending=False)
+    st.dataframe(scores.style.format({column: "{:.1f}" for column in scores.columns if column != "Users"}))
+    st.caption("Best score per user, in percent")
+
+def _display_item_analysis(user_db):
+    """Display difficulty, discrimination and option choices per quiz question."""
+    quiz_titles = dict(get_quiz_titles())
+    report = item_report(user_db.attempts, {quiz_id: get_quiz(quiz_id) for quiz_id in quiz_titles})
+    computed_at = datetime.datetime.fromtimestamp(report["computed_at"]).strftime("%H:%M:%S")
+    st.caption(
+        f"{report['rows']} attempts read, {report['new_rows']} new at {computed_at} "
+        f"({report['seconds']:.2f}s); only each user's first attempt at a quiz counts"
+    )
+    
+    items = report["items"]
+    quiz_title = st.selectbox("Quiz:", list(quiz_titles.values()), key="items_quiz")
+    quiz_id = next(quiz_id for quiz_id, title in quiz_titles.items() if title == quiz_title)
+    quiz_items = items[items["Quiz"] == quiz_id].drop(columns="Quiz").set_index("Question")
+    if not quiz_items["Attempts"].any():
+        st.info("Nobody has taken this quiz yet.")
+        return
+    
+    st.dataframe(quiz_items.style.format({"Difficulty": "{:.0%}", "Discrimination": "{:.2f}"}, na_rep="-"))
+    st.caption(
+        "Difficulty is the share who answered correctly. Discrimination is the correlation "
+        "between answering correctly and the score on the other questions; below 0.2 the "
+        "question barely separates strong from weak users. Review flags questions that are "
+        "very easy, very hard or poorly discriminating."
+    )
+    
+    st.subheader("Option Choices")
+    labels = [f"{number}. {text}" for number, text in quiz_items["Text"].items()]
+    question = quiz_items.index[labels.index(st.selectbox("Question:", labels, key="items_question"))]
+    options = report["options"]
+    choices = options[(options["Quiz"] == quiz_id) & (options["Question"] == question)]
+    if not choices["Responses"].any():
+        st.info("No responses recorded for this question yet.")
+        return
+    
+    if quiz_items.loc[question, "Type"] == "ordering":
+        st.caption("Share of responses that put each item in its correct position")
+        shown = choices[["Option", "Picked"]]
+    else:
+        st.caption("Share of responses that picked each option; incorrect options are distractors")
+        shown = choices[["Option", "Correct", "Picked"]]
+    st.dataframe(shown.set_index("Option").style.format({"Picked": "{:.0%}"}, na_rep="-"))
+    st.caption(f"From {int(choices['Responses'].iloc[0])} first attempts with recorded responses")
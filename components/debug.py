@@ -1,8 +1,7 @@
 import streamlit as st
 import json
 import os
-import yaml
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 
 def display_debug():
     """Display a debug page with information about the current state of the application."""
@@ -37,7 +36,7 @@ def display_debug():
         
         username = st.session_state.get("username", "")
         if username:
-            user_db = UserDatabase()
+            user_db = get_user_db()
             user_data = user_db.get_user_data(username)
             
             if user_data:
@@ -96,25 +95,31 @@ def display_debug():
     # File system information
     st.subheader("File System Information")
     
-    if os.path.exists("users.yaml"):
+    user_db = get_user_db()
+    if os.path.exists(user_db.db_path):
+        st.write(f"User database: `{user_db.db_path}` ({user_db.backend_name} backend)")
+        with st.expander("Storage Statistics"):
+            st.json(user_db.storage_stats())
+        with st.expander("Login Throttling"):
+            from auth.throttle import get_login_throttle
+            st.json(get_login_throttle().stats())
         with st.expander("User Database File"):
             try:
-                with open("users.yaml", "r") as f:
-                    users_raw = yaml.safe_load(f)
-                    
-                    # Redact sensitive information
-                    redacted_users = {}
-                    for username, user_data in users_raw.items():
-                        user_data_copy = user_data.copy()
-                        if "password_hash" in user_data_copy:
-                            user_data_copy["password_hash"] = "[REDACTED]"
-                        redacted_users[username] = user_data_copy
-                    
-                    st.json(redacted_users)
+                users_raw = user_db._load_db()
+                
+                # Redact sensitive information
+                redacted_users = {}
+                for username, user_data in users_raw.items():
+                    user_data_copy = user_data.copy()
+                    if "password_hash" in user_data_copy:
+                        user_data_copy["password_hash"] = "[REDACTED]"
+                    redacted_users[username] = user_data_copy
+                
+                st.json(redacted_users)
             except Exception as e:
-                st.error(f"Error reading users.yaml: {str(e)}")
+                st.error(f"Error reading {user_db.db_path}: {str(e)}")
     else:
-        st.warning("users.yaml file not found")
+        st.warning(f"{user_db.db_path} file not found")
     
     # Lesson progress debugging tool
     st.subheader("Fix Lesson Progress")
@@ -122,7 +127,7 @@ def display_debug():
     if st.session_state.get("authenticated", False):
         username = st.session_state.get("username", "")
         if username:
-            user_db = UserDatabase()
+            user_db = get_user_db()
             current_progress = st.session_state.get("lesson_progress", 0)
             
             st.write(f"Current lesson progress: {current_progress}")
@@ -5,7 +5,7 @@ import os
 import json
 import logging
 from content.lesson_content import get_lesson, get_lesson_count, get_lesson_titles
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 
 logger = logging.getLogger(__name__)
 
@@ -19,7 +19,7 @@ def display_lessons():
         
     # Get user progress info
     username = st.session_state.get("username", None)
-    user_db = UserDatabase() if username else None
+    user_db = get_user_db() if username else None
     
     # Set up container for the lesson
     lesson_container = st.container()
@@ -1,7 +1,7 @@
 import streamlit as st
 import os
 import logging
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 from content.lesson_content import get_lesson_titles, get_lesson_count
 
 logger = logging.getLogger(__name__)
@@ -134,12 +134,9 @@ def create_sidebar():
         # Log the logout action
         logger.info(f"User {st.session_state.get('username', 'unknown')} logged out")
         
-        # Clear session state
-        for key in list(st.session_state.keys()):
-            del st.session_state[key]
-        
-        # Rerun to update UI
-        st.rerun()
+        # Revoke the session cookie, clear session state and rerun
+        from auth.auth_handler import logout
+        logout()
     
     st.sidebar.markdown('<div class="sidebar-footer">© 2025 AI Learning Platform</div>', unsafe_allow_html=True)
     
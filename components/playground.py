@@ -3,7 +3,8 @@ import os
 import json
 import time
 from utils.llm_service import get_llm_response, get_available_models
-from utils.session_state import save_conversation
+from auth.user_db import get_user_db
+from utils.session_state import save_conversation, reset_saved_conversations, load_saved_conversations_page
 
 def display_playground():
     """Display the interactive LLM playground"""
@@ -225,6 +226,11 @@ def display_playground():
             # Reset the save_clicked flag
             st.session_state.save_clicked = False
     
+    # Previously saved conversations
+    username = st.session_state.get("username")
+    if st.session_state.get("authenticated", False) and username:
+        display_saved_conversations(username)
+    
     # Prompt engineering tips
     with st.expander("Prompting Tips"):
         st.markdown("""
@@ -248,6 +254,57 @@ def display_playground():
         Remember to experiment and iterate on your prompts!
         """)
 
+def display_saved_conversations(username):
+    """Show the user's saved conversations a page at a time.
+    
+    Only titles are listed; a conversation's messages are loaded when it is
+    opened.
+    """
+    st.subheader("My Saved Conversations")
+    
+    # Callback functions for buttons
+    def on_open_click(conversation_id):
+        conversation = get_user_db().get_conversation(username, conversation_id)
+        if conversation:
+            st.session_state.conversation = conversation.get("messages", [])
+        else:
+            st.session_state.saved_conversation_error = "Could not open that conversation."
+    
+    def on_delete_click(conversation_id):
+        if get_user_db().delete_conversation(username, conversation_id):
+            reset_saved_conversations()
+        else:
+            st.session_state.saved_conversation_error = "Could not delete that conversation."
+    
+    def on_load_more_click():
+        load_saved_conversations_page(username)
+    
+    # Fetch the first page the first time the panel is shown
+    if not st.session_state.get("saved_conversations_loaded", False):
+        load_saved_conversations_page(username)
+    
+    error = st.session_state.pop("saved_conversation_error", None)
+    if error:
+        st.error(error)
+    
+    saved = st.session_state.saved_conversations
+    if not saved:
+        st.info("You haven't saved any conversations yet.")
+        return
+    
+    for entry in saved:
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            saved_at = entry.get("timestamp", "")[:16].replace("T", " ")
+            st.markdown(f"**{entry.get('title', 'Untitled')}** · {saved_at}")
+        with col2:
+            st.button("Open", key=f"open_convo_{entry['id']}", on_click=on_open_click, args=(entry["id"],))
+        with col3:
+            st.button("Delete", key=f"delete_convo_{entry['id']}", on_click=on_delete_click, args=(entry["id"],))
+    
+    if st.session_state.saved_conversations_cursor:
+        st.button("Load more", key="load_more_convos_btn", on_click=on_load_more_click)
+
 def load_prompt_templates():
     """Load predefined prompt templates"""
     templates = {
@@ -1,7 +1,7 @@
 import streamlit as st
 import random
 from content.quiz_content import get_quiz, get_quiz_titles, calculate_quiz_score
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 
 def display_quiz():
     """Display the quiz page with selection and questions"""
@@ -14,7 +14,7 @@ def display_quiz():
     username = st.session_state.get("username")
     
     # Initialize user database
-    user_db = UserDatabase()
+    user_db = get_user_db()
     
     # Get quiz history
     if username:
@@ -62,6 +62,13 @@ def display_quiz():
     
     st.write(quiz["description"])
     
+    # Show earlier attempts at this quiz
+    if username:
+        attempts = user_db.get_quiz_attempts(username, selected_quiz_id)
+        if attempts:
+            scores = ", ".join(f"{a['score']:.0f}%" for a in attempts[-5:])
+            st.caption(f"Attempts so far: {len(attempts)} (latest scores: {scores})")
+    
     # Start quiz button
     if not st.session_state.quiz_state["started"]:
         if st.button("Start Quiz"):
@@ -173,13 +180,15 @@ def display_quiz():
             
             if submitted:
                 # Calculate score
-                score = calculate_quiz_score_with_shuffled(quiz, st.session_state.quiz_state)
+                correct = grade_questions_with_shuffled(quiz, st.session_state.quiz_state)
+                responses = response_masks(quiz, st.session_state.quiz_state)
+                score = score_from_correct(correct)
                 st.session_state.quiz_state["score"] = score
                 st.session_state.quiz_state["completed"] = True
                 
-                # Save score if user is logged in
+                # Save score if user is logged in; every attempt is kept in the history
                 if username:
-                    user_db.save_quiz_score(username, str(selected_quiz_id), score)
+                    user_db.save_quiz_score(username, str(selected_quiz_id), score, correct=correct, responses=responses)
                 
                 st.rerun()
     
@@ -299,43 +308,87 @@ def display_quiz():
 
 def calculate_quiz_score_with_shuffled(quiz, quiz_state):
     """Calculate the score for a quiz, accounting for shuffled options"""
-    total_questions = len(quiz["questions"])
-    correct_count = 0
+    return score_from_correct(grade_questions_with_shuffled(quiz, quiz_state))
+
+def score_from_correct(correct):
+    """Turn per-question correctness into a percentage score"""
+    if correct:
+        return (sum(correct) / len(correct)) * 100
+    return 0
+
+def grade_questions_with_shuffled(quiz, quiz_state):
+    """Check each answer, accounting for shuffled options.
+    
+    Returns:
+        list: One bool per question, True if answered correctly
+    """
+    correct = []
     
     for i, question in enumerate(quiz["questions"]):
         if i not in quiz_state["answers"]:
+            correct.append(False)
             continue
             
         user_answer = quiz_state["answers"][i]
         shuffled_options = quiz_state["shuffled_options"].get(i, [])
+        is_correct = False
         
         if question["type"] == "multiple_choice":
             if shuffled_options:
                 # Get the original index that the user selected
                 if user_answer is not None:
                     original_answer = shuffled_options[user_answer]
-                    if original_answer == question["correct_answer"]:
-                        correct_count += 1
+                    is_correct = original_answer == question["correct_answer"]
             else:
                 # No shuffling
-                if user_answer == question["correct_answer"]:
-                    correct_count += 1
+                is_correct = user_answer == question["correct_answer"]
                     
         elif question["type"] == "multiple_select":
             if shuffled_options:
                 # Convert user's selected shuffle indices back to original indices
                 original_answers = [shuffled_options[j] for j in user_answer] if user_answer else []
-                if set(original_answers) == set(question["correct_answers"]):
-                    correct_count += 1
+                is_correct = set(original_answers) == set(question["correct_answers"])
             else:
                 # No shuffling
-                if set(user_answer) == set(question["correct_answers"]):
-                    correct_count += 1
+                is_correct = set(user_answer) == set(question["correct_answers"])
                     
         elif question["type"] == "ordering":
-            if user_answer == question["correct_order"]:
-                correct_count += 1
+            is_correct = user_answer == question["correct_order"]
+        
+        correct.append(is_correct)
+    
+    return correct
+
+def response_masks(quiz, quiz_state):
+    """Record which options were picked for each question, for item analysis.
+    
+    Options are numbered as in the quiz content, not as shuffled on screen.
+    For ordering questions, the bit for an item is set if it was put in its
+    correct position.
+    
+    Returns:
+        list: One bitmask per question, bit j set for option j
+    """
+    masks = []
+    
+    for i, question in enumerate(quiz["questions"]):
+        user_answer = quiz_state["answers"].get(i)
+        shuffled_options = quiz_state["shuffled_options"].get(i, [])
+        mask = 0
+        
+        if question["type"] == "multiple_choice":
+            if user_answer is not None:
+                mask = 1 << (shuffled_options[user_answer] if shuffled_options else user_answer)
+        
+        elif question["type"] == "multiple_select":
+            for j in user_answer or []:
+                mask |= 1 << (shuffled_options[j] if shuffled_options else j)
+        
+        elif question["type"] == "ordering":
+            for position, idx in enumerate(user_answer or []):
+                if position < len(question["correct_order"]) and idx == question["correct_order"][position]:
+                    mask |= 1 << idx
+        
+        masks.append(mask)
     
-    if total_questions > 0:
-        return (correct_count / total_questions) * 100
-    return 0 
\ No newline at end of file
+    return masks
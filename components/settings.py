@@ -1,6 +1,6 @@
 import streamlit as st
 import logging
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +27,7 @@ def display_settings():
         st.subheader("Profile Information")
         
         # Load user data
-        user_db = UserDatabase()
+        user_db = get_user_db()
         user_data = user_db.get_user_data(username)
         
         if not user_data:
@@ -56,7 +56,9 @@ def display_settings():
                 password_updated = False
                 
                 # Update profile information if changed
-                if name != user_data.get("name", "") or email != user_data.get("email", ""):
+                if email != user_data.get("email", "") and user_db.find_user_by_email(email) not in (None, username):
+                    st.error("An account with this email address already exists.")
+                elif name != user_data.get("name", "") or email != user_data.get("email", ""):
                     try:
                         # Create updated user data
                         updated_data = {
@@ -175,26 +177,10 @@ def update_user_profile(username, updated_data):
     """
     try:
         # Load the user database
-        user_db = UserDatabase()
+        user_db = get_user_db()
         
-        # Get current user data
-        user_data = user_db.get_user_data(username)
-        if not user_data:
-            return False
-        
-        # Load the database
-        db = user_db._load_db()
-        if username not in db:
-            return False
-        
-        # Update user data
-        for key, value in updated_data.items():
-            db[username][key] = value
-        
-        # Save the database
-        user_db._save_db(db)
-        
-        return True
+        # Update only this user's record
+        return user_db.update_user_fields(username, updated_data)
     except Exception as e:
         logger.error(f"Error updating user profile: {str(e)}")
         return False
@@ -211,30 +197,16 @@ def update_user_password(username, new_password):
     """
     try:
         # Load the user database
-        user_db = UserDatabase()
-        
-        # Get current user data
-        user_data = user_db.get_user_data(username)
-        if not user_data:
-            return False
-        
-        # Load the database
-        db = user_db._load_db()
-        if username not in db:
-            return False
+        user_db = get_user_db()
         
         # Hash the new password
-        import bcrypt
-        salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), salt)
+        from auth.passwords import hash_password
+        hashed_password = hash_password(new_password)
         
         # Update password
-        db[username]['password_hash'] = hashed_password.decode('utf-8')
-        
-        # Save the database
-        user_db._save_db(db)
-        
-        return True
+        return user_db.update_user_fields(username, {
+            'password_hash': hashed_password
+        })
     except Exception as e:
         logger.error(f"Error updating user password: {str(e)}")
         return False
@@ -250,22 +222,14 @@ def reset_user_progress(username):
     """
     try:
         # Load the user database
-        user_db = UserDatabase()
-        
-        # Load the database
-        db = user_db._load_db()
-        if username not in db:
-            return False
+        user_db = get_user_db()
         
         # Reset progress
-        db[username]['lesson_progress'] = 0
-        db[username]['completed_lessons'] = []
-        db[username]['quiz_scores'] = {}
-        
-        # Save the database
-        user_db._save_db(db)
-        
-        return True
+        return user_db.update_user_fields(username, {
+            'lesson_progress': 0,
+            'completed_lessons': [],
+            'quiz_scores': {}
+        })
     except Exception as e:
         logger.error(f"Error resetting user progress: {str(e)}")
         return False 
\ No newline at end of file
@@ -0,0 +1,90 @@
+"""Measure online backups at increasing database sizes.
+
+For each backend and size the store is filled with synthetic users (each
+with a saved conversation and a few quiz attempts), then a backup is taken
+while a writer thread keeps updating random users. Reported per run: the
+snapshot phase (when writers can be held off), the total time including
+compression, the archive size, and the writer's worst update latency during
+the backup compared with before it.
+
+Usage:
+    python scripts/bench_backup.py --sizes 1000 10000 --backends sqlite sharded journal
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.user_db import UserDatabase
+from auth.conversations import ConversationStore
+from auth.attempts import QuizAttemptStore
+from bench_user_store import SUFFIXES, make_user, complete_lesson
+
+def writer_latencies(store, usernames, stop):
+    """Update random users until ``stop`` is set; return each update's latency."""
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        store.mutate(random.choice(usernames), complete_lesson)
+        latencies.append(time.perf_counter() - start)
+        stop.wait(0.005)
+    return latencies
+
+def measure_writer(store, usernames, seconds=None, during=None):
+    stop = threading.Event()
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(latencies=writer_latencies(store, usernames, stop)))
+    thread.start()
+    value = during() if during else time.sleep(seconds)
+    stop.set()
+    thread.join()
+    return value, max(result['latencies'], default=0) * 1000
+
+def bench(backend, size, tmp, level):
+    root = os.path.join(tmp, f"{backend}-{size}")
+    os.makedirs(root)
+    user_db = UserDatabase(os.path.join(root, f"users{SUFFIXES.get(backend, '.yaml')}"), backend)
+    user_db.conversations = ConversationStore(os.path.join(root, "conversations"))
+    user_db.attempts = QuizAttemptStore(os.path.join(root, "quiz_attempts.bin"))
+
+    users = dict(make_user(n) for n in range(size))
+    user_db.insert_users(users)
+    usernames = list(users)
+    message = [{'role': 'user', 'content': 'How do I write a clear prompt for a report summary?'}]
+    attempts = []
+    for username in usernames:
+        user_db.conversations.save(username, "Report summary", message * 4)
+        attempts += [(username, q, 80.0, [True, True, False, True, True], None) for q in range(1, 4)]
+    user_db.attempts.record_many(attempts)
+
+    _, idle_ms = measure_writer(user_db._storage, usernames, seconds=1)
+    manifest, backup_ms = measure_writer(
+        user_db._storage, usernames, during=lambda: user_db.create_backup(os.path.join(tmp, "backup.tar.gz"), level)
+    )
+    user_db._storage.close()
+    return manifest, idle_ms, backup_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="Numbers of users")
+    parser.add_argument("--backends", nargs="+", default=["file", "journal", "sqlite", "sharded"], help="Backends to compare")
+    parser.add_argument("--level", type=int, default=6, help="gzip level")
+    args = parser.parse_args(argv)
+
+    print(f"{'backend':<9} {'users':>7} {'snapshot':>10} {'total':>9} {'archive':>9} {'max write idle':>15} {'during backup':>14}")
+    for size in args.sizes:
+        for backend in args.backends:
+            with tempfile.TemporaryDirectory() as tmp:
+                manifest, idle_ms, backup_ms = bench(backend, size, tmp, args.level)
+            print(f"{backend:<9} {size:>7} {manifest['snapshot_seconds'] * 1000:>8.0f}ms "
+                  f"{manifest['total_seconds']:>8.2f}s {manifest['bytes'] / 1e6:>7.1f}MB "
+                  f"{idle_ms:>13.1f}ms {backup_ms:>12.1f}ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
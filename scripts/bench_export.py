@@ -0,0 +1,78 @@
+"""Compare peak memory of the user export paths at increasing sizes.
+
+``dataframe`` is how the admin panel used to export: load every user, build
+a pandas DataFrame and render the whole CSV into one string. The other rows
+stream the store a chunk at a time into a file with ``export_to_file``.
+Peak memory is measured with tracemalloc, which also slows every run down,
+so compare the times only with each other.
+
+Usage:
+    python scripts/bench_export.py --sizes 10000 50000 --backend sqlite
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.user_db import UserDatabase
+from auth.bulk import export_to_file, parquet_available
+from bench_user_store import SUFFIXES, make_user
+
+def export_dataframe(user_db, path):
+    import pandas as pd
+    user_data = [
+        {
+            "Username": username,
+            "Name": data.get("name", ""),
+            "Email": data.get("email", ""),
+            "Agency": data.get("agency", "Not specified"),
+            "Lesson Progress": data.get("lesson_progress", 0),
+            "Registration Date": data.get("created_at", "Unknown")
+        }
+        for username, data in user_db._load_db().items()
+    ]
+    csv = pd.DataFrame(user_data).to_csv(index=False)
+    with open(path, 'w') as f:
+        f.write(csv)
+    return len(user_data)
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000], help="Numbers of users")
+    parser.add_argument("--backend", default="sqlite", help="Backend to export from")
+    args = parser.parse_args(argv)
+
+    print(f"{'users':>7} {'export':<10} {'time':>8} {'peak memory':>12} {'file':>9}")
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            user_db = UserDatabase(os.path.join(tmp, f"users{SUFFIXES.get(args.backend, '.yaml')}"), args.backend)
+            user_db.insert_users(dict(make_user(n) for n in range(size)))
+            runs = [
+                ("dataframe", "csv", lambda path: export_dataframe(user_db, path)),
+                ("csv", "csv", lambda path: export_to_file(user_db, path, "csv")),
+                ("jsonl", "jsonl", lambda path: export_to_file(user_db, path, "jsonl")),
+            ]
+            if parquet_available():
+                runs.append(("parquet", "parquet", lambda path: export_to_file(user_db, path, "parquet")))
+            for label, ext, run in runs:
+                path = os.path.join(tmp, f"{label}.{ext}")
+                elapsed, peak = measure(lambda: run(path))
+                print(f"{size:>7} {label:<10} {elapsed:>7.2f}s {peak / 1e6:>10.1f}MB {os.path.getsize(path) / 1e6:>7.1f}MB")
+            user_db._storage.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""Measure login throughput for real users while attackers flood the login form.
+
+Attacker threads submit wrong passwords at a high steady rate, spread over a
+few client addresses and aimed at a handful of accounts. Legitimate threads
+log their own users in over and over. The run is repeated with and without
+the login throttle so the effect on real users' latency is visible.
+
+Usage:
+    python scripts/bench_login_throttle.py --seconds 5 --attackers 16 --users 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.user_db import UserDatabase
+from auth.throttle import LoginThrottle
+
+def login(db, throttle, username, password, client_id):
+    if throttle and throttle.acquire(username, client_id):
+        return None
+    return db.verify_user(username, password)
+
+def run(db, throttle, args, victims, users):
+    stop = threading.Event()
+    counts = {'attack_checked': 0, 'attack_rejected': 0, 'logins': 0}
+    latencies = []
+    lock = threading.Lock()
+
+    def attacker(n):
+        victim = victims[n % len(victims)]
+        client = f"10.0.0.{n % args.attack_clients}"
+        while not stop.is_set():
+            result = login(db, throttle, victim, "wrong-password", client)
+            with lock:
+                counts['attack_rejected' if result is None else 'attack_checked'] += 1
+            # Each request costs the attacker a round trip; without this the
+            # threads would just spin on the GIL
+            stop.wait(args.attack_interval)
+
+    def user(n):
+        username = users[n]
+        while not stop.is_set():
+            start = time.perf_counter()
+            ok = login(db, throttle, username, "correct-password", f"192.168.1.{n}")
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    counts['logins'] += 1
+                    latencies.append(elapsed)
+            # A real user doesn't log in more than every so often
+            stop.wait(args.user_interval)
+
+    threads = [threading.Thread(target=attacker, args=(n,)) for n in range(args.attackers)]
+    threads += [threading.Thread(target=user, args=(n,)) for n in range(args.users)]
+    for t in threads:
+        t.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+    return counts, p50, p95
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=5, help="Duration of each run")
+    parser.add_argument("--attackers", type=int, default=16, help="Attacker threads")
+    parser.add_argument("--attack-clients", type=int, default=4, help="Distinct attacker addresses")
+    parser.add_argument("--attack-interval", type=float, default=0.002, help="Seconds between one attacker's requests")
+    parser.add_argument("--victims", type=int, default=2, help="Accounts under attack")
+    parser.add_argument("--users", type=int, default=4, help="Legitimate user threads")
+    parser.add_argument("--user-interval", type=float, default=0.5, help="Seconds between a user's logins")
+    parser.add_argument("--rounds", type=int, default=10, help="bcrypt cost for the test accounts")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('BCRYPT_ROUNDS', str(args.rounds))
+    with tempfile.TemporaryDirectory() as tmp:
+        db = UserDatabase(os.path.join(tmp, "users.db"))
+        victims = [f"victim{n}@pd.gov" for n in range(args.victims)]
+        users = [f"officer{n}@pd.gov" for n in range(args.users)]
+        for username in victims + users:
+            db.create_user(username, "correct-password", username, username, "PD")
+
+        # Generous limits for real users, so only the flood is cut off
+        throttles = [
+            ("no throttle", None),
+            ("throttled", LoginThrottle(user_burst=5, user_per_min=2, client_burst=20, client_per_min=30)),
+        ]
+        for label, throttle in throttles:
+            counts, p50, p95 = run(db, throttle, args, victims, users)
+            checked = counts['attack_checked'] / args.seconds
+            rejected = counts['attack_rejected'] / args.seconds
+            print(f"{label}:")
+            print(f"  attack attempts: {checked:.0f}/s hashed, {rejected:.0f}/s rejected")
+            print(f"  user logins: {counts['logins']} ({counts['logins'] / args.seconds:.1f}/s), "
+                  f"latency p50 {p50:.0f} ms, p95 {p95:.0f} ms")
+            if throttle:
+                print(f"  counters: {throttle.stats()}")
+        db._storage.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Measure the quiz attempt history at large attempt counts.
+
+Writes synthetic attempts in batches, then times loading the store from
+scratch, scanning one user's and one quiz's attempts, and compares the file
+size with the same attempts stored as YAML.
+
+Usage:
+    python scripts/bench_quiz_attempts.py --attempts 1000000 --users 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+from auth.attempts import QuizAttemptStore
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - start) * 1000
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--attempts", type=int, default=1000000, help="Attempts to write")
+    parser.add_argument("--users", type=int, default=5000, help="Distinct users")
+    parser.add_argument("--quizzes", type=int, default=6, help="Distinct quizzes")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per quiz")
+    parser.add_argument("--batch", type=int, default=10000, help="Attempts per write")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    now = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "quiz_attempts.bin")
+        store = QuizAttemptStore(path)
+        sample = []
+
+        def write():
+            for start in range(0, args.attempts, args.batch):
+                batch = []
+                for n in range(start, min(start + args.batch, args.attempts)):
+                    correct = [rng.random() < 0.7 for _ in range(args.questions)]
+                    batch.append((
+                        f"officer{rng.randrange(args.users)}@pd.gov", rng.randint(1, args.quizzes),
+                        100 * sum(correct) / len(correct), correct, now - args.attempts + n
+                    ))
+                if len(sample) < 10000:
+                    sample.extend(batch[:10000 - len(sample)])
+                store.record_many(batch)
+
+        _, write_ms = timed(write)
+        _, single_ms = timed(lambda: store.record("officer0@pd.gov", 1, 80.0, [True] * 4 + [False]))
+        size = os.path.getsize(path) + os.path.getsize(store.users_path)
+
+        cold = QuizAttemptStore(path)
+        _, load_ms = timed(lambda: len(cold))
+        _, index_ms = timed(lambda: cold.user_attempts("officer1@pd.gov"))
+        user_attempts, user_ms = timed(lambda: cold.user_attempts("officer0@pd.gov"))
+        quiz_attempts, quiz_ms = timed(lambda: cold.quiz_attempts(1))
+
+        yaml_text = yaml.safe_dump([
+            {'username': u, 'quiz_id': q, 'score': s, 'correct': c, 'timestamp': t}
+            for u, q, s, c, t in sample
+        ], default_flow_style=False)
+        yaml_bytes = len(yaml_text.encode('utf-8')) * args.attempts / len(sample)
+
+        print(f"attempts: {args.attempts}, users: {args.users}")
+        print(f"  write: {write_ms:.0f} ms in batches of {args.batch}; single attempt: {single_ms:.2f} ms")
+        print(f"  size: {size / 1e6:.1f} MB ({size / args.attempts:.1f} bytes/attempt); "
+              f"as YAML: ~{yaml_bytes / 1e6:.0f} MB")
+        print(f"  load from scratch: {load_ms:.0f} ms; first lookup (builds indexes): {index_ms:.0f} ms")
+        print(f"  one user's attempts: {len(user_attempts)} in {user_ms:.2f} ms")
+        print(f"  one quiz's attempts: {len(quiz_attempts)} in {quiz_ms:.0f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,63 @@
+"""Time loading and saving a whole user database in each serialization format.
+
+Usage:
+    python scripts/bench_user_formats.py --sizes 1000 10000 50000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.storage import orjson
+from bench_user_store import make_user
+
+def candidates():
+    """Yield (label, dumps, loads) for every format available here."""
+    yield (
+        "yaml (pure Python)",
+        lambda db: yaml.dump(db, Dumper=yaml.SafeDumper).encode('utf-8'),
+        lambda data: yaml.load(data, Loader=yaml.SafeLoader),
+    )
+    if hasattr(yaml, 'CSafeLoader'):
+        yield (
+            "yaml (libyaml)",
+            lambda db: yaml.dump(db, Dumper=yaml.CSafeDumper).encode('utf-8'),
+            lambda data: yaml.load(data, Loader=yaml.CSafeLoader),
+        )
+    yield (
+        "json",
+        lambda db: json.dumps(db, separators=(',', ':')).encode('utf-8'),
+        json.loads,
+    )
+    if orjson is not None:
+        yield (
+            "json (orjson)",
+            lambda db: orjson.dumps(db, option=orjson.OPT_NON_STR_KEYS),
+            orjson.loads,
+        )
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    args = parser.parse_args(argv)
+
+    print(f"{'format':<20}{'users':>10}{'size KB':>10}{'load ms':>12}{'save ms':>12}")
+    for size in args.sizes:
+        db = dict(make_user(n) for n in range(size))
+        for label, dumps, loads in candidates():
+            start = time.perf_counter()
+            data = dumps(db)
+            save_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            loads(data)
+            load_ms = (time.perf_counter() - start) * 1000
+            print(f"{label:<20}{size:>10}{len(data) // 1024:>10}{load_ms:>12.1f}{save_ms:>12.1f}", flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
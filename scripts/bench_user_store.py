@@ -0,0 +1,80 @@
+"""Compare user store backends at increasing numbers of users.
+
+For each backend and size the store is filled with synthetic users, then a
+sample of point reads and single-user lesson updates is timed.
+
+Usage:
+    python scripts/bench_user_store.py --sizes 1000 10000 100000 --backends file sharded
+
+Expect the monolithic YAML store to take minutes per update at 100k users.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.storage import create_backend
+
+SUFFIXES = {'sqlite': '.db', 'sharded': os.sep}
+
+def make_user(n):
+    username = f"officer{n}@agency{n % 50}.gov"
+    return username, {
+        'username': username,
+        'password_hash': '$2b$12$' + 'x' * 53,
+        'name': f"Officer {n}",
+        'email': username,
+        'agency': f"Agency {n % 50}",
+        'created_at': '2024-01-01T00:00:00',
+        'lesson_progress': n % 7,
+        'completed_lessons': list(range(1, n % 7 + 1)),
+        'quiz_scores': {str(q): {'score': 80.0, 'timestamp': '2024-01-02T00:00:00', 'answers': {}} for q in range(1, n % 7 + 1)},
+        'saved_conversations': [],
+    }
+
+def complete_lesson(record):
+    record['lesson_progress'] = record.get('lesson_progress', 0) + 1
+    record.setdefault('completed_lessons', []).append(record['lesson_progress'])
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def bench(backend, size, ops, tmp):
+    db_path = os.path.join(tmp, f"{backend}-{size}{SUFFIXES.get(backend, '.yaml')}")
+    store = create_backend(db_path, backend)
+    start = time.perf_counter()
+    store.save_all(dict(make_user(n) for n in range(size)))
+    fill = time.perf_counter() - start
+    usernames = [make_user(random.randrange(size))[0] for _ in range(ops)]
+    it = iter(usernames * 2)
+    # Warm any per-process cache so reads are measured in steady state
+    store.get(usernames[0])
+    read_ms = timed(lambda: store.get(next(it)), ops)
+    update_ms = timed(lambda: store.mutate(next(it), complete_lesson), ops)
+    store.close()
+    return fill, read_ms, update_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--backends", nargs="+", default=["file", "sharded"])
+    parser.add_argument("--ops", type=int, default=20, help="Reads and updates timed per run")
+    args = parser.parse_args(argv)
+
+    print(f"{'backend':<10}{'users':>10}{'fill s':>10}{'read ms':>12}{'update ms':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            for backend in args.backends:
+                fill, read_ms, update_ms = bench(backend, size, args.ops, tmp)
+                print(f"{backend:<10}{size:>10}{fill:>10.1f}{read_ms:>12.3f}{update_ms:>12.3f}", flush=True)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
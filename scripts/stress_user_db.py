@@ -0,0 +1,89 @@
+"""Hammer a user database from many processes and check that no update is lost.
+
+Every worker process creates its own users and repeatedly increments a
+counter on one shared user. At the end the shared counter must equal the
+total number of increments and every created user must exist.
+
+Usage:
+    python scripts/stress_user_db.py --backend file --processes 8 --updates 50
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from auth.storage import create_backend
+
+SHARED_USER = "shared@stress.test"
+SUFFIXES = {'sqlite': '.db', 'sharded': os.sep}
+
+def increment(record):
+    record['counter'] = record.get('counter', 0) + 1
+
+def worker(db_path, backend, worker_id, users, updates, results):
+    store = create_backend(db_path, backend)
+    for i in range(max(users, updates)):
+        if i < users:
+            username = f"user-{worker_id}-{i}@stress.test"
+            store.insert(username, {'username': username, 'lesson_progress': 0})
+        if i < updates:
+            store.mutate(SHARED_USER, increment)
+    results.put(store.stats())
+    store.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backend", default="file", help="Storage backend to test")
+    parser.add_argument("--processes", type=int, default=8, help="Number of worker processes")
+    parser.add_argument("--users", type=int, default=20, help="Users created by each worker")
+    parser.add_argument("--updates", type=int, default=50, help="Shared-counter increments per worker")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, f"users{SUFFIXES.get(args.backend, '.yaml')}")
+        store = create_backend(db_path, args.backend)
+        store.insert(SHARED_USER, {'username': SHARED_USER, 'counter': 0})
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=worker,
+                args=(db_path, args.backend, n, args.users, args.updates, results)
+            )
+            for n in range(args.processes)
+        ]
+        start = time.perf_counter()
+        for p in workers:
+            p.start()
+        stats = [results.get() for _ in workers]
+        for p in workers:
+            p.join()
+        elapsed = time.perf_counter() - start
+
+        expected_counter = args.processes * args.updates
+        expected_users = args.processes * args.users + 1
+        counter = store.get(SHARED_USER)['counter']
+        users = store.count()
+        store.close()
+
+    print(f"{args.backend}: {args.processes} processes finished in {elapsed:.2f}s")
+    print(f"  shared counter: {counter} (expected {expected_counter})")
+    print(f"  users: {users} (expected {expected_users})")
+    waits = [s.get('lock_wait_max_ms', 0) for s in stats]
+    holds = [s.get('lock_hold_avg_ms', 0) for s in stats]
+    if waits:
+        print(f"  max lock wait: {max(waits):.1f} ms, avg lock hold: {sum(holds) / len(holds):.2f} ms")
+    print(f"  version conflicts retried: {sum(s.get('version_conflicts', 0) for s in stats)}")
+
+    if counter != expected_counter or users != expected_users:
+        print("FAILED: updates were lost")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Per-agency cohort analytics for supervisors.
+
+User records are read once into columnar NumPy arrays (agency codes, a
+users-by-lessons completion matrix and a users-by-quizzes best score matrix),
+and every cohort matrix is then a vectorized group-by over those arrays. A
+report is cached per database and recomputed only when the store's
+``data_version`` changes.
+"""
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Score percentiles reported per agency and quiz
+PERCENTILES = [25, 50, 75, 90]
+
+UNSPECIFIED_AGENCY = "Not specified"
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def load_columns(user_db, lesson_ids, quiz_ids):
+    """Read every user's agency, lesson completions and best quiz scores.
+
+    Args:
+        user_db (UserDatabase): Database to read
+        lesson_ids (list): Lesson ids, in course order
+        quiz_ids (list): Quiz ids
+
+    Returns:
+        dict: ``agency`` (array of agency codes, one per user), ``agencies``
+        (label per code), ``completed`` (bool array, users x lessons) and
+        ``scores`` (float array, users x quizzes, NaN where not taken)
+    """
+    lesson_index = {lesson_id: i for i, lesson_id in enumerate(lesson_ids)}
+    quiz_index = {str(quiz_id): i for i, quiz_id in enumerate(quiz_ids)}
+    agency_keys = []
+    labels = {}
+    lesson_rows, lesson_cols = [], []
+    score_rows, score_cols, score_values = [], [], []
+
+    # One pass over the records, only collecting coordinates; the matrices
+    # are filled with a single vectorized assignment each
+    for row, (_, record) in enumerate(user_db.iter_users()):
+        agency = (record.get('agency') or '').strip()
+        key = agency.lower()
+        agency_keys.append(key)
+        labels.setdefault(key, agency or UNSPECIFIED_AGENCY)
+        for lesson_id in record.get('completed_lessons') or ():
+            col = lesson_index.get(lesson_id)
+            if col is not None:
+                lesson_rows.append(row)
+                lesson_cols.append(col)
+        for quiz_id, result in (record.get('quiz_scores') or {}).items():
+            col = quiz_index.get(str(quiz_id))
+            if col is not None:
+                score_rows.append(row)
+                score_cols.append(col)
+                score_values.append(result.get('score', 0) if isinstance(result, dict) else result)
+
+    users = len(agency_keys)
+    codes, uniques = pd.factorize(pd.Series(agency_keys, dtype=object))
+    completed = np.zeros((users, len(lesson_ids)), dtype=bool)
+    completed[lesson_rows, lesson_cols] = True
+    scores = np.full((users, len(quiz_ids)), np.nan)
+    scores[score_rows, score_cols] = np.asarray(score_values, dtype=float)
+    return {
+        'agency': codes,
+        'agencies': [labels[key] for key in uniques],
+        'completed': completed,
+        'scores': scores,
+    }
+
+def lesson_funnel(columns, lesson_ids):
+    """Count users per agency who completed each lesson.
+
+    Args:
+        columns (dict): Output of ``load_columns``
+        lesson_ids (list): Lesson ids, in course order
+
+    Returns:
+        pandas.DataFrame: Agencies x lessons, plus a ``Users`` column with
+        each agency's size; sorted largest agency first
+    """
+    counts = pd.DataFrame(columns['completed'], columns=lesson_ids, dtype=np.int64)
+    funnel = counts.groupby(columns['agency']).sum()
+    funnel.insert(0, 'Users', np.bincount(columns['agency'], minlength=len(columns['agencies'])))
+    funnel.index = [columns['agencies'][code] for code in funnel.index]
+    return funnel.sort_values('Users', ascending=False)
+
+def quiz_distribution(columns, quiz_ids):
+    """Summarize best quiz scores per agency and quiz.
+
+    Args:
+        columns (dict): Output of ``load_columns``
+        quiz_ids (list): Quiz ids, matching the score columns
+
+    Returns:
+        pandas.DataFrame: Indexed by (agency, quiz id), with ``Users``,
+        ``Mean`` and one column per entry of ``PERCENTILES``
+    """
+    names = ['Users', 'Mean'] + [f"p{p}" for p in PERCENTILES]
+    rows, cols = np.nonzero(~np.isnan(columns['scores']))
+    if not len(rows):
+        index = pd.MultiIndex.from_arrays([[], []], names=['agency', 'quiz'])
+        return pd.DataFrame(columns=names, index=index)
+    long = pd.DataFrame({
+        'agency': np.asarray(columns['agencies'], dtype=object)[columns['agency'][rows]],
+        'quiz': np.asarray(quiz_ids)[cols],
+        'score': columns['scores'][rows, cols],
+    })
+    grouped = long.groupby(['agency', 'quiz'])['score']
+    summary = grouped.agg(Users='count', Mean='mean')
+    quantiles = grouped.quantile([p / 100 for p in PERCENTILES]).unstack()
+    quantiles.columns = names[2:]
+    return summary.join(quantiles)
+
+def cohort_report(user_db, lesson_ids, quiz_ids):
+    """Get the lesson funnel and quiz score distributions per agency.
+
+    Reports are cached per database and reused until the store's
+    ``data_version`` changes, so reruns of the admin page don't re-read
+    every user.
+
+    Args:
+        user_db (UserDatabase): Database to analyze
+        lesson_ids (list): Lesson ids, in course order
+        quiz_ids (list): Quiz ids
+
+    Returns:
+        dict: ``funnel`` (see ``lesson_funnel``), ``quizzes`` (see
+        ``quiz_distribution``), ``users``, ``computed_at`` (Unix time),
+        ``seconds`` taken and the ``version`` it was computed at
+    """
+    key = (user_db.db_path, tuple(lesson_ids), tuple(quiz_ids))
+    # Read the version first: a write during the computation then makes
+    # the next call recompute rather than keep a stale report
+    version = user_db.data_version()
+    with _cache_lock:
+        cached = _cache.get(key)
+    if cached is not None and version is not None and cached['version'] == version:
+        return cached
+
+    start = time.perf_counter()
+    columns = load_columns(user_db, lesson_ids, quiz_ids)
+    report = {
+        'funnel': lesson_funnel(columns, lesson_ids),
+        'quizzes': quiz_distribution(columns, quiz_ids),
+        'users': len(columns['agency']),
+        'computed_at': time.time(),
+        'seconds': time.perf_counter() - start,
+        'version': version,
+    }
+    logger.info(f"Computed cohort analytics for {report['users']} users in {report['seconds']:.2f}s")
+    if version is not None:
+        with _cache_lock:
+            _cache[key] = report
+    return report
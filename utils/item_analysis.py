@@ -0,0 +1,258 @@
+"""Item analysis of quiz questions from the quiz attempt history.
+
+For every question this reports its difficulty (the share of users who got it
+right), its discrimination (the point-biserial correlation between getting it
+right and the score on the rest of the quiz) and how often each option was
+picked. Only each user's first attempt at a quiz counts: the results page
+shows the answers, so retakes say little about the questions.
+
+All of these come from running sums per quiz (counts, sums of item and total
+scores and their cross products), so a cached analysis is brought up to date
+by reading only the attempts appended since it last ran.
+"""
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from auth.attempts import MAX_OPTIONS
+
+logger = logging.getLogger(__name__)
+
+# Rules of thumb for questions worth reviewing: nearly everyone or nearly
+# nobody gets them right, or they hardly separate strong from weak users
+EASY = 0.9
+HARD = 0.2
+LOW_DISCRIMINATION = 0.2
+
+_OPTION_BITS = np.arange(MAX_OPTIONS, dtype=np.uint8)
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _signature(quizzes):
+    # Only what affects the sums; the quiz page adds keys to the questions
+    return tuple(
+        (quiz_id, tuple((q['question'], q['type'], tuple(q['options'])) for q in quiz['questions']))
+        for quiz_id, quiz in sorted(quizzes.items(), key=lambda item: str(item[0]))
+    )
+
+class _QuizSums:
+    """Running sums over the counted attempts at one quiz."""
+
+    def __init__(self, questions):
+        self.attempts = 0
+        self.correct = np.zeros(questions)
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.correct_total = np.zeros(questions)
+        self.responded = 0
+        self.picked = np.zeros((questions, MAX_OPTIONS))
+
+    def add(self, correct, responses=None):
+        """Add attempts.
+
+        Args:
+            correct (numpy.ndarray): Attempts x questions, 1 where right
+            responses (numpy.ndarray, optional): Attempts x questions option
+                bitmasks, for the attempts that have them
+        """
+        totals = correct.sum(axis=1)
+        self.attempts += len(correct)
+        self.correct += correct.sum(axis=0)
+        self.total += totals.sum()
+        self.total_sq += (totals * totals).sum()
+        self.correct_total += correct.T @ totals
+        if responses is not None and len(responses):
+            self.responded += len(responses)
+            self.picked += (responses[:, :, None] >> _OPTION_BITS & 1).sum(axis=0)
+
+    def difficulty(self):
+        """Get the share of attempts answering each question correctly."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.correct / self.attempts
+
+    def discrimination(self):
+        """Get each question's correlation with the score on the other questions.
+
+        Leaving the question itself out of the total keeps it from
+        correlating with itself, which matters on five-question quizzes.
+        """
+        n = self.attempts
+        p = self.difficulty()
+        # Sums of the rest score R = T - x, using x * x == x
+        rest = self.total - self.correct
+        rest_sq = self.total_sq - 2 * self.correct_total + self.correct
+        cross = self.correct_total - self.correct
+        with np.errstate(divide='ignore', invalid='ignore'):
+            covariance = cross / n - p * rest / n
+            variance = p * (1 - p) * (rest_sq / n - (rest / n) ** 2)
+            r = covariance / np.sqrt(variance)
+        return np.where(variance > 1e-12, r, np.nan)
+
+class ItemAnalysis:
+    """Item statistics for a set of quizzes, updated as attempts arrive."""
+
+    def __init__(self, quizzes):
+        """Start an empty analysis.
+
+        Args:
+            quizzes (dict): ``{quiz_id: quiz}``, as from ``content.quiz_content.get_quiz``
+        """
+        self.quizzes = {int(quiz_id): quiz for quiz_id, quiz in quizzes.items()}
+        self._questions = np.zeros(1 << 16, dtype=np.uint8)
+        for quiz_id, quiz in self.quizzes.items():
+            self._questions[quiz_id] = len(quiz['questions'])
+        self._lock = threading.Lock()
+        self._reset(None, None)
+
+    def _reset(self, store, generation):
+        self._store = store
+        self.generation = generation
+        self.rows = 0
+        # (user id << 16 | quiz id) of every first attempt counted, sorted
+        self._seen = np.empty(0, dtype=np.int64)
+        self.sums = {quiz_id: _QuizSums(len(quiz['questions'])) for quiz_id, quiz in self.quizzes.items()}
+
+    def update(self, attempts):
+        """Add the attempts appended since the last update.
+
+        Args:
+            attempts (QuizAttemptStore): Attempt history to read
+
+        Returns:
+            int: Number of new attempts read
+        """
+        with self._lock:
+            columns = attempts.columns(self.rows, responses=True)
+            if attempts is not self._store or columns['generation'] != self.generation:
+                # First run, or the history was reloaded (e.g. restored)
+                self._reset(attempts, columns['generation'])
+                if columns['first']:
+                    columns = attempts.columns(0, responses=True)
+            self._add(columns)
+            new = len(columns['user_id'])
+            self.rows += new
+            return new
+
+    def _add(self, columns):
+        user_id = np.frombuffer(columns['user_id'], dtype=np.uint32).astype(np.int64)
+        quiz_id = np.frombuffer(columns['quiz_id'], dtype=np.uint16)
+        questions = np.frombuffer(columns['questions'], dtype=np.uint8)
+        correct = np.frombuffer(columns['correct'], dtype=np.uint64)
+        answer_count = np.frombuffer(columns['answer_count'], dtype=np.uint8)
+        answer_start = np.frombuffer(columns['answer_start'], dtype=np.uint32).astype(np.int64)
+        answers = np.frombuffer(columns['answers'], dtype=np.uint8)
+
+        # Attempts at the current version of a known quiz
+        rows = np.flatnonzero((questions > 0) & (self._questions[quiz_id] == questions))
+        # The first of them per user and quiz, skipping pairs already counted
+        keys = user_id[rows] << 16 | quiz_id[rows]
+        keys, first = np.unique(keys, return_index=True)
+        new = ~np.isin(keys, self._seen, assume_unique=True)
+        rows = rows[first[new]]
+        self._seen = np.union1d(self._seen, keys[new])
+
+        for quiz in np.unique(quiz_id[rows]):
+            quiz_rows = rows[quiz_id[rows] == quiz]
+            n = int(questions[quiz_rows[0]])
+            positions = np.arange(n)
+            right = (correct[quiz_rows, None] >> positions.astype(np.uint64) & np.uint64(1)).astype(np.float64)
+            answered = quiz_rows[answer_count[quiz_rows] == n]
+            responses = answers[answer_start[answered, None] + positions]
+            self.sums[int(quiz)].add(right, responses)
+
+    def items(self):
+        """Get difficulty and discrimination per question.
+
+        Returns:
+            pandas.DataFrame: One row per question with ``Quiz``,
+            ``Question`` (1-based), ``Text``, ``Type``, ``Attempts``,
+            ``Difficulty``, ``Discrimination`` and ``Review``
+        """
+        frames = []
+        for quiz_id, quiz in self.quizzes.items():
+            sums = self.sums[quiz_id]
+            difficulty = sums.difficulty()
+            discrimination = sums.discrimination()
+            frames.append(pd.DataFrame({
+                'Quiz': quiz_id,
+                'Question': np.arange(1, len(quiz['questions']) + 1),
+                'Text': [q['question'] for q in quiz['questions']],
+                'Type': [q['type'] for q in quiz['questions']],
+                'Attempts': sums.attempts,
+                'Difficulty': difficulty,
+                'Discrimination': discrimination,
+                'Review': (difficulty > EASY) | (difficulty < HARD) | (discrimination < LOW_DISCRIMINATION),
+            }))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    def options(self):
+        """Get how often each option was picked.
+
+        For ordering questions, ``Picked`` is how often the item was put in
+        its correct position, and ``Correct`` is left empty.
+
+        Returns:
+            pandas.DataFrame: One row per option with ``Quiz``, ``Question``
+            (1-based), ``Option``, ``Correct``, ``Responses`` and ``Picked``
+            (share of responses)
+        """
+        rows = []
+        for quiz_id, quiz in self.quizzes.items():
+            sums = self.sums[quiz_id]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                picked = sums.picked / sums.responded
+            for i, question in enumerate(quiz['questions']):
+                if question['type'] == 'multiple_choice':
+                    right = {question['correct_answer']}
+                elif question['type'] == 'multiple_select':
+                    right = set(question['correct_answers'])
+                else:
+                    right = None
+                for j, option in enumerate(question['options'][:MAX_OPTIONS]):
+                    rows.append({
+                        'Quiz': quiz_id,
+                        'Question': i + 1,
+                        'Option': option,
+                        'Correct': None if right is None else j in right,
+                        'Responses': sums.responded,
+                        'Picked': picked[i, j],
+                    })
+        return pd.DataFrame(rows)
+
+def item_report(attempts, quizzes):
+    """Get item statistics for every question, reading only new attempts.
+
+    The analysis is cached per attempt history and quiz content, and each
+    call first adds the attempts appended since the previous one.
+
+    Args:
+        attempts (QuizAttemptStore): Attempt history to analyze
+        quizzes (dict): ``{quiz_id: quiz}``, as from ``content.quiz_content.get_quiz``
+
+    Returns:
+        dict: ``items`` (see ``ItemAnalysis.items``), ``options`` (see
+        ``ItemAnalysis.options``), ``rows`` (attempts read in all),
+        ``new_rows`` (read by this call), ``computed_at`` (Unix time) and
+        ``seconds`` taken
+    """
+    key = (attempts.path, _signature(quizzes))
+    with _cache_lock:
+        analysis = _cache.get(key)
+        if analysis is None:
+            analysis = _cache[key] = ItemAnalysis(quizzes)
+
+    start = time.perf_counter()
+    new_rows = analysis.update(attempts)
+    report = {
+        'items': analysis.items(),
+        'options': analysis.options(),
+        'rows': analysis.rows,
+        'new_rows': new_rows,
+        'computed_at': time.time(),
+        'seconds': time.perf_counter() - start,
+    }
+    if new_rows:
+        logger.info(f"Added {new_rows} quiz attempts to the item analysis in {report['seconds']:.2f}s")
+    return report
@@ -1,6 +1,6 @@
 import streamlit as st
 import logging
-from auth.user_db import UserDatabase
+from auth.user_db import get_user_db
 
 logger = logging.getLogger(__name__)
 
@@ -33,7 +33,7 @@ def initialize_session_state():
 def load_user_progress(username):
     """Load user progress from the database and update session state."""
     try:
-        user_db = UserDatabase()
+        user_db = get_user_db()
         user_data = user_db.get_user_data(username)
         
         if user_data:
@@ -45,11 +45,6 @@ def load_user_progress(username):
             quiz_scores = user_data.get('quiz_scores', {})
             st.session_state.quiz_scores = quiz_scores
             
-            # Load any saved playground conversations
-            saved_conversations = user_data.get('saved_conversations', [])
-            if saved_conversations and "conversation_history" not in st.session_state:
-                st.session_state.saved_conversations = saved_conversations
-                
             logger.info(f"Loaded progress for user {username}: {lesson_progress} lessons completed")
         else:
             # Initialize for new user
@@ -70,15 +65,17 @@ def update_user_progress(username, lesson_id):
             return False
             
         # Update in database
-        user_db = UserDatabase()
+        user_db = get_user_db()
         current_progress = st.session_state.get("lesson_progress", 0)
         
         # Only update if this is a new highest lesson
         if lesson_id > current_progress:
-            user_db.update_lesson_progress(username, lesson_id)
-            
-            # Update session state
-            st.session_state.lesson_progress = lesson_id
+            with user_db.session(username) as user:
+                if not user_db.update_lesson_progress(username, lesson_id):
+                    return False
+                
+                # Update session state
+                st.session_state.lesson_progress = user.get('lesson_progress', lesson_id)
             logger.info(f"Updated progress for user {username} to lesson {lesson_id}")
             return True
             
@@ -88,7 +85,7 @@ def update_user_progress(username, lesson_id):
         logger.error(f"Error updating user progress: {e}")
         return False
 
-def update_quiz_score(username, quiz_id, score, answers=None):
+def update_quiz_score(username, quiz_id, score, answers=None, correct=None, responses=None):
     """Update user's quiz score in both database and session state."""
     try:
         if not username:
@@ -96,19 +93,15 @@ def update_quiz_score(username, quiz_id, score, answers=None):
             return False
             
         # Update in database
-        user_db = UserDatabase()
-        success = user_db.update_quiz_score(username, quiz_id, score, answers)
+        user_db = get_user_db()
+        with user_db.session(username) as user:
+            success = user_db.update_quiz_score(username, quiz_id, score, answers, correct, responses)
+            
+            if success:
+                # Update session state from the record, which keeps the best score
+                st.session_state.quiz_scores = dict(user.get('quiz_scores', {}))
         
         if success:
-            # Update session state
-            if "quiz_scores" not in st.session_state:
-                st.session_state.quiz_scores = {}
-                
-            st.session_state.quiz_scores[str(quiz_id)] = {
-                "score": score,
-                "answers": answers or {}
-            }
-            
             logger.info(f"Updated quiz {quiz_id} score for user {username}: {score}%")
             return True
             
@@ -125,20 +118,13 @@ def save_conversation(username, title, messages):
             logger.warning("Cannot save conversation: No username provided")
             return False
             
-        # Update in database
-        user_db = UserDatabase()
+        # Save to the conversation store
+        user_db = get_user_db()
         conversation_id = user_db.save_conversation(username, title, messages)
         
         if conversation_id:
-            # Update session state if needed
-            if "saved_conversations" not in st.session_state:
-                st.session_state.saved_conversations = []
-                
-            st.session_state.saved_conversations.append({
-                "id": conversation_id,
-                "title": title,
-                "timestamp": str(conversation_id)  # Using ID as timestamp for simplicity
-            })
+            # Make the saved conversations panel start again from the newest
+            reset_saved_conversations()
             
             logger.info(f"Saved conversation '{title}' for user {username}")
             return conversation_id
@@ -149,6 +135,30 @@ def save_conversation(username, title, messages):
         logger.error(f"Error saving conversation: {e}")
         return False
 
+def reset_saved_conversations():
+    """Forget the pages of saved conversations loaded so far."""
+    st.session_state.saved_conversations = []
+    st.session_state.saved_conversations_cursor = None
+    st.session_state.saved_conversations_loaded = False
+
+def load_saved_conversations_page(username, limit=10):
+    """Append the next page of the user's saved conversations to session state.
+    
+    Args:
+        username (str): Username whose conversations are listed
+        limit (int, optional): Conversations to fetch
+    """
+    if "saved_conversations" not in st.session_state:
+        reset_saved_conversations()
+    
+    user_db = get_user_db()
+    page, cursor = user_db.list_conversations(
+        username, st.session_state.saved_conversations_cursor, limit
+    )
+    st.session_state.saved_conversations = st.session_state.saved_conversations + page
+    st.session_state.saved_conversations_cursor = cursor
+    st.session_state.saved_conversations_loaded = True
+
 def get_session_state():
     """Get all current session state variables"""
     return {key: value for key, value in st.session_state.items()} 
\ No newline at end of file